@@ -0,0 +1,121 @@
+"""Run the benchmarks: python -m benchmarks --sizes 10k,100k --out results.json
+
+Results are JSON keyed by "<tree>/<size>/<case>" so two runs can be
+compared with --compare, which exits with 1 on a regression."""
+
+import json
+import platform
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from os import cpu_count
+from os.path import join
+from shutil import rmtree
+from subprocess import DEVNULL, CalledProcessError, check_output
+from tempfile import mkdtemp
+
+from benchmarks.suite import deep_cases, drawing_cases, listing_cases, settle
+from benchmarks.trees import TREES, deep
+
+SCALE = {"k": 1000, "m": 1000 ** 2}
+DEPTH = 100
+
+
+def size(text: str):
+    """Parse 10k, 1m or 500"""
+    unit = text[-1:].lower()
+    if unit in SCALE:
+        return int(float(text[:-1]) * SCALE[unit])
+    return int(text)
+
+
+def commit():
+    """Current git commit, empty outside a checkout"""
+    try:
+        return check_output(["git", "rev-parse", "HEAD"], text=True, stderr=DEVNULL).strip()
+    except (OSError, CalledProcessError):
+        return ""
+
+
+def run(sizes: list[int], trees: list[str], runs: int, tmp: str | None, keep: bool):
+    """Build every tree and run every case on it"""
+    results: dict[str, dict] = {}
+    root = mkdtemp(prefix="elymicia-bench-", dir=tmp)
+    try:
+        for tree in trees:
+            for count in sizes:
+                path = join(root, f"{tree}-{count}")
+                print(f"building {tree} tree of {count} entries", file=sys.stderr)
+                TREES[tree](path, count)
+                settle(path)
+                for case, result in {**listing_cases(path, runs),
+                                     **drawing_cases(path, runs)}.items():
+                    results[f"{tree}/{count}/{case}"] = result
+                    print(f"  {case}: {result.get('median_ms', 0):.2f}ms", file=sys.stderr)
+        path = join(root, "deep")
+        print(f"building a {DEPTH} levels deep tree", file=sys.stderr)
+        deepest = deep(path, DEPTH)
+        for case, result in deep_cases(path, deepest, runs).items():
+            results[f"deep/{DEPTH}/{case}"] = result
+    finally:
+        if keep:
+            print(f"trees kept in {root}", file=sys.stderr)
+        else:
+            rmtree(root, ignore_errors=True)
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float):
+    """Print time and memory ratios against a baseline, return whether anything regressed"""
+    regressed = False
+    for key, result in current["results"].items():
+        base = baseline["results"].get(key)
+        if not base or "median_ms" not in base or "median_ms" not in result:
+            continue
+        time_ratio = result["median_ms"] / max(base["median_ms"], 1e-6)
+        peak_ratio = result["peak_kib"] / max(base["peak_kib"], 1e-6)
+        flag = time_ratio > threshold or peak_ratio > threshold
+        regressed = regressed or flag
+        print(f"{'REGRESSION ' if flag else ''}{key}: time x{time_ratio:.2f}, peak x{peak_ratio:.2f}")
+    return regressed
+
+
+def main():
+    """Entry point"""
+    parser = ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--sizes", default="10k,100k", help="entries per tree, i.e: 10k,100k,1m")
+    parser.add_argument("--trees", default=",".join(TREES), help="tree kinds: " + ", ".join(TREES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio counted as a regression")
+    parser.add_argument("--tmp", help="where to build the trees")
+    parser.add_argument("--keep", action="store_true", help="don't delete the trees")
+    args = parser.parse_args()
+
+    trees = args.trees.split(",")
+    unknown = [tree for tree in trees if tree not in TREES]
+    if unknown:
+        parser.error(f"unknown trees: {', '.join(unknown)}")
+    current = {
+        "meta": {
+            "commit": commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": cpu_count(),
+        },
+        "results": run([size(item) for item in args.sizes.split(",")], trees,
+                       args.runs, args.tmp, args.keep),
+    }
+    with open(args.out, "w", encoding="utf-8") as file:
+        json.dump(current, file, indent=2)
+    print(f"results written to {args.out}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        sys.exit(1 if compare(current, baseline, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
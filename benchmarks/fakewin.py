@@ -0,0 +1,68 @@
+"""Headless stand-in for a curses window"""
+
+# pylint: disable=no-member
+
+import curses
+from contextlib import contextmanager
+
+
+class FakeWindow:
+    """Records what would be painted, enough for draw_tab"""
+
+    def __init__(self, height: int = 50, width: int = 160) -> None:
+        self.height = height
+        self.width = width
+        self.cells = [[" "] * width for _ in range(height)]
+        self.writes = 0
+
+    def getmaxyx(self):
+        """Size"""
+        return self.height, self.width
+
+    def erase(self):
+        """Clear everything"""
+        for row in self.cells:
+            row[:] = [" "] * self.width
+
+    clear = erase
+
+    def box(self, *_):
+        """Border"""
+        self.writes += 1
+
+    def addnstr(self, y: int, x: int, text: str, n: int, *_):
+        """Write at most n characters"""
+        self.addstr(y, x, text[:max(n, 0)])
+
+    def addstr(self, y: int, x: int, text: str, *_):
+        """Write text, failing past the edge like curses does"""
+        if not 0 <= y < self.height or not 0 <= x < self.width:
+            raise curses.error("addstr() returned ERR")
+        self.writes += 1
+        row = self.cells[y]
+        text = text[:self.width - x]
+        row[x:x + len(text)] = text
+
+    def instr(self, y: int, x: int = 0, n: int = -1):
+        """What is painted at a position"""
+        row = "".join(self.cells[y])[x:]
+        return (row if n < 0 else row[:n]).encode()
+
+    def refresh(self):
+        """Nothing to flush"""
+
+    noutrefresh = refresh
+
+
+@contextmanager
+def headless():
+    """Let drawing code run without a terminal
+
+    curses.color_pair refuses to work before initscr, so it is swapped
+    for its arithmetic while inside the block."""
+    original = curses.color_pair
+    curses.color_pair = lambda pair: pair << 8
+    try:
+        yield
+    finally:
+        curses.color_pair = original
@@ -0,0 +1,131 @@
+"""Benchmark cases"""
+
+import tracemalloc
+from os import utime
+from os.path import join
+from pathlib import Path
+from statistics import median
+from time import perf_counter, sleep, time
+from typing import Callable
+
+from lymia import Menu
+
+from props.cache import listing_cache
+from props.colors import Basic, fmt
+from props.files import change_dir
+from props.ui.tabs import TabState, draw_tab
+from props.utils import Directory, get_fmt
+from benchmarks.fakewin import FakeWindow, headless
+
+GET_FMT_CALLS = 1000
+SCROLL_STEPS = 100
+# Old enough for the listing cache to trust the directory's mtime
+SETTLED = 3600
+
+
+def settle(path: str):
+    """Backdate a freshly made directory so it can be cached"""
+    past = time() - SETTLED
+    utime(path, (past, past))
+
+
+def tab(path: str):
+    """A tab on path, built like WindowState.start_files_view does"""
+    directory = Directory(path, fmt)
+    menu = Menu(directory, "", "",  # type: ignore
+                Basic.SELECTED, (1, 2), 1, count=lambda: len(directory))
+    return TabState(path, menu, directory, [])  # type: ignore
+
+
+def wait_loaded(state: TabState):
+    """Wait for a background load to finish"""
+    while state.content.loading:
+        sleep(0.0005)
+
+
+def measure(fn: Callable[[], object], setup: Callable[[], object] | None = None, runs: int = 5):
+    """Time runs of fn, then take its peak memory on one more traced run"""
+    times: list[float] = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        fn()
+        times.append((perf_counter() - start) * 1000)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"runs": runs, "min_ms": min(times), "median_ms": median(times),
+            "max_ms": max(times), "peak_kib": peak / 1024}
+
+
+def listing_cases(path: str, runs: int):
+    """Directory construction, refresh, get_fmt and change_dir on one directory"""
+    results = {}
+    cold = listing_cache.clear
+    results["directory"] = measure(lambda: Directory(path, fmt), cold, runs)
+    Directory(path, fmt)
+    results["directory.cached"] = measure(lambda: Directory(path, fmt), runs=runs)
+    directory = Directory(path, fmt)
+    results["refresh"] = measure(directory.refresh, cold, runs)
+
+    names = directory.listing.names[:GET_FMT_CALLS]
+
+    def get_fmts():
+        for name in names:
+            get_fmt(fmt, join(path, name))
+    results["get_fmt"] = {**measure(get_fmts, runs=runs), "calls": len(names)}
+
+    state = tab(path)
+
+    def enter():
+        change_dir(state, Path(path))
+        wait_loaded(state)
+    results["change_dir"] = measure(enter, cold, runs)
+    return results
+
+
+def drawing_cases(path: str, runs: int):
+    """draw_tab through a fake window, as the app draws its tabs"""
+    results = {}
+    window = FakeWindow()
+    state = tab(path)
+    wait_loaded(state)
+    with headless():
+        results["draw_tab.full"] = measure(lambda: draw_tab(window, state),  # type: ignore
+                                           state.viewport.invalidate, runs)
+
+        def scroll():
+            for _ in range(SCROLL_STEPS):
+                state.menu.seek((state.menu.cursor + 1) % len(state.content))
+                draw_tab(window, state)  # type: ignore
+        results["draw_tab.scroll"] = {**measure(scroll, runs=runs), "calls": SCROLL_STEPS}
+
+        def idle():
+            # What a signalled tick costs when no row has changed
+            for _ in range(SCROLL_STEPS):
+                draw_tab(window, state)  # type: ignore
+        results["draw_tab.idle"] = {**measure(idle, runs=runs), "calls": SCROLL_STEPS}
+    return results
+
+
+def deep_cases(root: str, deepest: str, runs: int):
+    """Walking down a deep chain of directories one change_dir at a time"""
+    levels: list[str] = []
+    path = Path(deepest)
+    while str(path) != root:
+        levels.append(str(path))
+        path = path.parent
+    levels.reverse()
+    state = tab(root)
+
+    def descend():
+        for level in levels:
+            change_dir(state, Path(level))
+            wait_loaded(state)
+    return {"change_dir.deep": {**measure(descend, listing_cache.clear, runs), "calls": len(levels)}}
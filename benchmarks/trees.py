@@ -0,0 +1,73 @@
+"""Synthetic directory trees"""
+
+import socket
+from os import close, makedirs, mkfifo, open as os_open, symlink, O_CREAT, O_WRONLY
+from os.path import join
+
+# Names exercising sorting, width and encoding: accents, CJK, emoji, RTL
+UNICODE = ("café", "日本語", "\U0001f600", "שלום", "naïve")
+
+
+def touch(path: str):
+    """Create an empty file"""
+    close(os_open(path, O_CREAT | O_WRONLY, 0o644))
+
+
+def name(index: int):
+    """Entry name, every tenth one is a unicode name"""
+    if index % 10 == 0:
+        return f"{UNICODE[index // 10 % len(UNICODE)]}-{index}"
+    return f"file-{index:07d}.txt"
+
+
+def flat(root: str, count: int):
+    """count regular files in one directory"""
+    makedirs(root, exist_ok=True)
+    for index in range(count):
+        touch(join(root, name(index)))
+    return root
+
+
+def mixed(root: str, count: int):
+    """count entries of every kind: files, dirs, symlink chains, fifos, sockets
+
+    Sockets are capped, binding them is slow and paths are short-lived."""
+    makedirs(root, exist_ok=True)
+    previous = ""
+    for index in range(count):
+        path = join(root, name(index))
+        kind = index % 10
+        if kind == 1:
+            makedirs(path, exist_ok=True)
+        elif kind == 2:
+            # Each link points to the previous one, ending on a file
+            symlink(previous or path + ".missing", path)
+        elif kind == 3:
+            mkfifo(path)
+        elif kind == 4 and index < 1000:
+            sock = socket.socket(socket.AF_UNIX)
+            try:
+                sock.bind(path)
+            except OSError:
+                touch(path)
+            finally:
+                sock.close()
+        else:
+            touch(path)
+        if kind != 1:
+            previous = path
+    return root
+
+
+def deep(root: str, depth: int, width: int = 10):
+    """A chain of depth nested directories holding width files each, return the deepest"""
+    path = root
+    for level in range(depth):
+        path = join(path, f"level-{level}")
+        makedirs(path, exist_ok=True)
+        for index in range(width):
+            touch(join(path, name(index)))
+    return path
+
+
+TREES = {"flat": flat, "mixed": mixed}
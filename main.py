@@ -1,7 +1,12 @@
 """File manager"""
 
-# pylint: disable=no-member,no-name-in-module
+# pylint: disable=no-member,no-name-in-module,wrong-import-position
 
+from time import perf_counter
+
+STARTED = perf_counter()
+
+import sys
 import curses
 from json import dumps, loads
 from os import getcwd
@@ -12,18 +17,49 @@ from lymia.data import ReturnType, status
 from lymia.environment import Theme
 
 from props.files import entry_file_manager
+from props.filter import Filter
 from props.state import WindowState
+from props.viewer import CLOSE
 from props.colors import basic, Basic
 from props.ui.command import command
-from props.ui.tabs import CursorHistory
+from props.ui.keys import SHIFT_TAB, TABS, VERTICAL, coalesce
+from props.ui.tabs import CursorHistory, apply_selection, needs_draw
+from props.cache import DEFAULT_BUDGET, listing_cache
+from props.du import du_pool
+from props.jobs import jobs
+from props.notifications import bus, notify
+from props.perf import recorder, span, timed
+from props import session
+from props.watch import watcher
+from props.workers import load_directory, pool, wakeup
 
 CONFIG_DIR = Path("~/.rimueirnarn.elymicia").expanduser().resolve()
 CONFIG_FILE = CONFIG_DIR / "config.json"
+SESSION_FILE = CONFIG_DIR / "session.bin"
 if not CONFIG_DIR.exists():
     CONFIG_DIR.mkdir()
     CONFIG_FILE.touch()
 
-SHIFT_TAB = 353
+FILTER_DONE = (10, 13, curses.KEY_ENTER)
+FILTER_CANCEL = 27
+FILTER_ERASE = (8, 127, curses.KEY_BACKSPACE)
+YES = (ord("y"), ord("Y"))
+TICK_MS = 100
+TRACE_FILE = "elymicia-trace.json"
+STARTUP_TARGET_MS = 150.0
+IMPORTED = perf_counter()
+startup: dict[str, float] = {}
+
+
+def report_startup():
+    """Print how long startup took, as asked by --profile-startup"""
+    marks = [("imports", IMPORTED), *startup.items()]
+    parts = [f"{name} {(mark - STARTED) * 1000:.1f}ms" for name, mark in marks]
+    total = (startup.get("first paint", IMPORTED) - STARTED) * 1000
+    verdict = "ok" if total <= STARTUP_TARGET_MS else "over"
+    print(f"startup: {', '.join(parts)} (target {STARTUP_TARGET_MS:.0f}ms, {verdict})",
+          file=sys.stderr)
+
 
 class Root(Scene):
     """Root scene"""
@@ -34,10 +70,17 @@ class Root(Scene):
         self._state = WindowState()
         self._menu: HorizontalMenu
         self._active_cursor = 0
+        self._popups = 0
+        # Set by an idle tick that found nothing to show
+        self._quiet = False
         config = loads(CONFIG_FILE.read_text() or '{}')
         if not isinstance(config, dict):
             config = {}
         self._state.settings.update(config)
+        try:
+            listing_cache.budget = int(self._state.settings.get("cache_budget", DEFAULT_BUDGET))
+        except ValueError:
+            pass
         super().__init__()
 
     @property
@@ -46,18 +89,34 @@ class Root(Scene):
         return (self.height, self.width)
 
     def update_panels(self):
-        for panel in self._state.panels:
+        popups = sum(1 for popup in self._state.popup if popup.visible)
+        if popups != self._popups:
+            # Whatever the popups covered has to be painted again
+            self._popups = popups
+            for state in self._state.tab_states:
+                state.viewport.invalidate()
+        for panel, state in zip(self._state.panels, self._state.tab_states):
+            if not panel.visible or not needs_draw(state):
+                continue
             panel.draw()
 
+    @timed("draw")
     def draw(self):
+        if self._quiet:
+            self._quiet = False
+            return
         self.update_panels()
         if self._state.popup:
             for popup in self._state.popup:
                 if not popup.visible:
                     continue
                 popup.draw()
-        self._menu.draw(self._screen)
+        with span("menu"):
+            self._menu.draw(self._screen)
         self.show_status()
+        if "first paint" not in startup:
+            startup["first paint"] = perf_counter()
+            self._state.prefetch()
 
     def deferred_op(self):
         if command.buffer.editing:
@@ -65,13 +124,18 @@ class Root(Scene):
 
     def init(self, stdscr: window):
         super().init(stdscr)
+        # Wake up periodically so background loads get painted
+        stdscr.timeout(TICK_MS)
         self._state.winsize = self.size
         command.use_screen(stdscr)
         command.use_global_state(self._state)
-        self._state.start_files_view(getcwd(), self.size)
-        self._state.start_files_view("/", self.size)
-        self._state.start_files_view("/home", self.size)
-        self._state.start_files_view("/dev", self.size)
+        active = self.restore_session()
+        if active < 0:
+            self._state.start_files_view(getcwd(), self.size)
+            self._state.start_files_view("/", self.size, lazy=True)
+            self._state.start_files_view("/home", self.size, lazy=True)
+            self._state.start_files_view("/dev", self.size, lazy=True)
+            active = 0
         self._menu = HorizontalMenu(
             self._state.tab_views,
             "[",
@@ -80,8 +144,28 @@ class Root(Scene):
         )
         self._state.trig_active(self._menu.seek)
         self._state.trig_active(lambda _: self.tab_visibility_refresh())
-        self._state.active = 0
+        self._state.active = active
         self.tab_visibility_refresh()
+        startup["init"] = perf_counter()
+
+    def restore_session(self):
+        """Reopen the last session's tabs, returns the tab to activate or -1"""
+        if self._state.settings.get("session", "on") == "off":
+            return -1
+        saved = session.load(SESSION_FILE)
+        if saved is None:
+            return -1
+        return self._state.restore_session(*saved, getcwd(), self.size)
+
+    def save_session(self):
+        """Write the session snapshot, with listings unless session=tabs"""
+        mode = self._state.settings.get("session", "on")
+        if mode == "off":
+            return
+        try:
+            session.save(SESSION_FILE, self._state.tab_states, self._state.active, mode != "tabs")
+        except OSError:
+            pass
 
     def tab_visibility_refresh(self):
         """Refresh tab visibility"""
@@ -89,22 +173,76 @@ class Root(Scene):
         for index, tab in enumerate(self._state.panels):
             if index != self._state.active:
                 tab.hide()
-                self.cleanup_menu_keymap()
             if index == self._state.active:
                 tab.show()
-                self.register_keymap(self._state.fetch()[1].menu)
+                self._state.tab_states[index].viewport.invalidate()
 
     def keymap_override(self, key: int) -> ReturnType:
+        if key == -1:
+            # Idle ticks are timed by on_tick, not as key presses
+            return self.override_key(key)
+        with span("key"):
+            return self.override_key(key)
+
+    def override_key(self, key: int):
+        """Keys while a command, a question, a popup or a filter takes them"""
         if command.buffer.editing:
             ret = command.buffer.handle_edit(key)
             if ret == ReturnType.REVERT_OVERRIDE:
-                self._override = False
-                return self.on_exitcmd()
+                ret = self.on_exitcmd()
+                # A command may have opened or closed a focused popup, or asked something
+                self._override = self._state.focus is not None or self._state.question is not None
+                return ret
             status.set(f":{command.buffer.displayed_value}")
             return ret
+        if self._state.question is not None:
+            return self.answer_key(key)
+        if self._state.focus is not None:
+            return self.focus_key(key)
+        if self._state.fetch()[1].filter is not None:
+            return self.filter_key(key)
         return ReturnType.REVERT_OVERRIDE
 
+    def answer_key(self, key: int):
+        """Keys while a yes/no question waits, anything but y means no"""
+        if key == -1:
+            ret = self.on_tick()
+            status.set(self._state.question)
+            return ret
+        if key == curses.KEY_RESIZE:
+            return self.on_resize()
+        self._state.answer(key in YES)
+        self._override = self._state.focus is not None
+        return ReturnType.CONTINUE
+
+    def focus_key(self, key: int):
+        """Keys while the file viewer, the message history or grep hits are open"""
+        if key == -1:
+            return self.on_tick()
+        if key == ord(":"):
+            return self.select_menu_item()
+        if key == curses.KEY_RESIZE:
+            return self.on_resize()
+        if key in CLOSE:
+            self._state.reset_popup()
+            self._override = False
+            return ReturnType.CONTINUE
+        self._state.focus.handle_key(key)
+        return ReturnType.CONTINUE
+
     def on_unmount(self):
+        for job in jobs.active():
+            job.token.cancel()
+        for state in self._state.tab_states:
+            if state.sizes is not None:
+                state.sizes.token.cancel()
+        self.save_session()
+        pool.shutdown()
+        du_pool.shutdown()
+        grep = sys.modules.get("props.grep")
+        if grep is not None:
+            # Only loaded once a search, a hash or a comparison ran
+            grep.scan_pool.shutdown()
         s = self._state.settings
         if s == loads(CONFIG_FILE.read_text() or '{}'):
             return
@@ -128,41 +266,66 @@ class Root(Scene):
         return ReturnType.OVERRIDE
 
     @on_key(":")
+    @timed("key")
     def enter_command(self):
         """a"""
         return self.select_menu_item()
 
+    def switch_tab(self, key: int):
+        """Switch tabs by every queued Tab/Shift+Tab press at once"""
+        count = len(self._state.panels)
+        if count == 0:
+            return ReturnType.CONTINUE
+        delta = coalesce(self._screen, key, TABS, TICK_MS)
+        self._state.active = (self._state.active + delta) % count
+        return ReturnType.CONTINUE
+
     @on_key(SHIFT_TAB)
+    @timed("key")
     def switch_left(self):
         """switch"""
-        cursor = self._menu._cursor  # pylint: disable=protected-access
-        if self._state.move_left(cursor) == "last":
-            self._menu._cursor = len(self._state.panels) - 1  # pylint: disable=protected-access
-            self.tab_visibility_refresh()
-            return ReturnType.CONTINUE
-        self._menu.move_up()
-        self.tab_visibility_refresh()
-        return ReturnType.CONTINUE
+        return self.switch_tab(SHIFT_TAB)
 
     @on_key("\t")
+    @timed("key")
     def switch_right(self):
         """switch"""
-        cursor = self._menu._cursor  # pylint: disable=protected-access
-        if self._state.move_right(cursor) == "first":
-            self._menu._cursor = 0  # pylint: disable=protected-access
-            self.tab_visibility_refresh()
+        return self.switch_tab(ord("\t"))
+
+    def move_cursor(self, key: int):
+        """Move the cursor by every queued Up/Down press at once"""
+        _, state_active = self._state.fetch()
+        delta = coalesce(self._screen, key, VERTICAL, TICK_MS)
+        count = len(state_active.content)
+        if count == 0:
             return ReturnType.CONTINUE
-        self._menu.move_down()
-        self.tab_visibility_refresh()
+        state_active.pending_cursor = -1
+        state_active.menu.seek(max(min(state_active.menu.cursor + delta, count - 1), 0))
         return ReturnType.CONTINUE
 
+    @on_key(curses.KEY_UP)
+    @timed("key")
+    def move_up(self):
+        """Move cursor up"""
+        return self.move_cursor(curses.KEY_UP)
+
+    @on_key(curses.KEY_DOWN)
+    @timed("key")
+    def move_down(self):
+        """Move cursor down"""
+        return self.move_cursor(curses.KEY_DOWN)
+
     @on_key(curses.KEY_RESIZE)
+    @timed("key")
     def on_resize(self):
         """On resize"""
         self._state.winsize = self.size
+        for state in self._state.tab_states:
+            state.viewport.invalidate()
         return ReturnType.CONTINUE
 
     @on_key(curses.KEY_LEFT)
+    @timed("key")
     def back(self):
         """back"""
         _, state_active = self._state.fetch()
@@ -176,18 +339,113 @@ class Root(Scene):
             if parent == "/" and str(path) == "/":
                 return ReturnType.CONTINUE
 
+        try:
+            load_directory(state_active.content, str(ps.path))
+        except (FileNotFoundError, PermissionError, NotADirectoryError) as exc:
+            notify(f"{type(exc).__name__}: {str(exc)}", "error")
+            return ReturnType.ERR
         state_active.cwd = str(ps.path)
-        state_active.content.chdir(ps.path)
-        state_active.menu.seek(ps.cursor)
+        state_active.menu.reset_cursor()
+        state_active.pending_cursor = ps.cursor
+        return ReturnType.CONTINUE
+
+    @on_key(" ")
+    @timed("key")
+    def toggle_selection(self):
+        """Select or unselect the entry under the cursor, then move down"""
+        _, state = self._state.fetch()
+        content = state.content
+        if content.loading or not len(content):
+            return ReturnType.CONTINUE
+        apply_selection(state)
+        state.selection.toggle(content.at(state.menu.cursor))
+        state.menu.seek(min(state.menu.cursor + 1, len(content) - 1))
         return ReturnType.CONTINUE
 
+    @on_key("/")
+    @timed("key")
+    def start_filter(self):
+        """Filter the current tab as you type"""
+        _, state = self._state.fetch()
+        try:
+            name = state.content.name(state.menu.cursor)
+        except IndexError:
+            name = None
+        state.filter = Filter(state.menu.cursor, name)
+        state.filter.reset(state.content.listing)
+        self._override = True
+        status.set("/")
+        return ReturnType.OVERRIDE
+
+    def filter_key(self, key: int):
+        """Keys while typing a filter"""
+        _, state = self._state.fetch()
+        typeahead = state.filter
+        content = state.content
+        if key == -1:
+            return self.on_tick()
+        if key == curses.KEY_RESIZE:
+            return self.on_resize()
+        if key in VERTICAL:
+            return self.move_cursor(key)
+        if key in FILTER_DONE or key == FILTER_CANCEL:
+            try:
+                name = content.name(state.menu.cursor) if key != FILTER_CANCEL else typeahead.name
+            except IndexError:
+                name = typeahead.name
+            content.narrow(None, content.listing)
+            state.filter = None
+            self._override = False
+            index = content.index(name) if name is not None else -1
+            state.menu.seek(index if index >= 0 else min(typeahead.cursor, max(len(content) - 1, 0)))
+            status.set("")
+            return ReturnType.CONTINUE
+        if key in FILTER_ERASE:
+            typeahead.erase()
+        elif 32 <= key < 127:
+            typeahead.type(chr(key))
+        else:
+            return ReturnType.CONTINUE
+        content.narrow(typeahead.matches, typeahead.listing)
+        state.menu.seek(0)
+        count = len(content) if typeahead.matches is not None else "all"
+        status.set(f"/{typeahead.query}  ({count} matches)")
+        return ReturnType.CONTINUE
+
+    @on_key(-1)
+    @timed("tick")
+    def on_tick(self):
+        """Idle tick, redraws only when a background job or the watcher asked for it"""
+        signalled = wakeup.consume()
+        watcher.sync(self._state.tab_states)
+        changed = watcher.poll(self._state.tab_states)
+        if signalled:
+            self._state.enforce_budget()
+            for job in jobs.finished():
+                self._state.reload(job.touched)
+        # Progress held back by the bus is picked up once due, without a new signal
+        shown = self.report() if signalled or bus.waiting else False
+        self._quiet = not (signalled or changed or shown)
+        return ReturnType.CONTINUE
+
+    def report(self):
+        """Show what the notification bus has due, return whether the status line changed"""
+        line = bus.drain()
+        if line is not None:
+            status.set(line)
+        return line is not None
+
     @on_key(curses.KEY_RIGHT)
+    @timed("key")
     def fetch(self):
         """fetch"""
         try:
-            return entry_file_manager(self._screen, self._state.fetch()[1], self._state)
+            ret = entry_file_manager(self._screen, self._state.fetch()[1], self._state)
+            if ret == ReturnType.OVERRIDE:
+                self._override = True
+            return ret
         except ValueError as exc:
-            status.set(f"{exc!s}")
+            notify(f"{exc!s}", "error")
             return ReturnType.ERR
 
 
@@ -198,4 +456,11 @@ def init():
 
 
 if __name__ == "__main__":
+    if "--trace" in sys.argv[1:]:
+        at = sys.argv.index("--trace") + 1
+        recorder.start_trace(sys.argv[at] if at < len(sys.argv) else TRACE_FILE)
     run(init)
+    if "--profile-startup" in sys.argv[1:]:
+        report_startup()
+    if recorder.tracing:
+        print(f"trace written to {recorder.stop_trace()}", file=sys.stderr)
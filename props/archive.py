@@ -0,0 +1,436 @@
+"""Archive and extract with compression spread over processes"""
+
+import bz2
+import gzip
+import lzma
+import tarfile
+import zipfile
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from os import cpu_count, getpid, lstat, makedirs, readlink, rename, scandir, stat_result, unlink
+from os.path import basename, dirname, exists, isfile, islink, join, relpath
+from shutil import copyfileobj
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from struct import pack
+from threading import Lock, local
+from time import localtime
+from typing import BinaryIO, Callable
+
+from props.jobs import Job, jobs
+from props.utils import STAGING_PREFIX
+from props.workers import pool
+
+BLOCK = 4 * 1024 * 1024
+LEVEL = 6
+
+# Compressed formats whose streams may be concatenated, so blocks can be
+# compressed independently (pigz style) and written one after another.
+STREAMS = {
+    "gz": lambda data, level: gzip.compress(data, level, mtime=0),
+    "bz2": lambda data, level: bz2.compress(data, level),
+    "xz": lambda data, level: lzma.compress(data, preset=level),
+}
+OPENERS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+SUFFIXES = (
+    (".tar.gz", "tar", "gz"), (".tgz", "tar", "gz"),
+    (".tar.bz2", "tar", "bz2"), (".tbz2", "tar", "bz2"),
+    (".tar.xz", "tar", "xz"), (".txz", "tar", "xz"),
+    (".tar", "tar", ""), (".zip", "zip", ""),
+    (".gz", "", "gz"), (".bz2", "", "bz2"), (".xz", "", "xz"),
+)
+
+
+def compress_block(codec: str, data: bytes, level: int):
+    """Compress one independent block (runs in a worker process)"""
+    return STREAMS[codec](data, level)
+
+
+def deflate_block(data: bytes, level: int, last: bool):
+    """Raw deflate one block; blocks end on a byte boundary so they chain"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    flush = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(flush)
+
+
+def detect(path: str):
+    """(container, codec) of an archive name"""
+    lowered = path.lower()
+    for suffix, container, codec in SUFFIXES:
+        if lowered.endswith(suffix):
+            return container, codec
+    raise ValueError(f"Unknown archive type: {basename(path)}")
+
+
+def process_pool():
+    """Process pool for compression, which doesn't scale with threads"""
+    method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(cpu_count() or 1, mp_context=get_context(method))
+
+
+class Pipeline:
+    """Keeps compressed blocks in flight, consuming results in order"""
+
+    def __init__(self, executor: Executor, job: Job, limit: int = 0) -> None:
+        self._executor = executor
+        self._job = job
+        self._limit = limit or 2 * (cpu_count() or 1)
+        self._queue: deque[Future | Callable[[], None]] = deque()
+        self._inflight = 0
+        self.sink: Callable[[bytes], None] = lambda _: None
+
+    def submit(self, fn: Callable, *args):
+        """Queue a block, whose result goes to sink"""
+        self._job.token.check()
+        self._queue.append(self._executor.submit(fn, *args))
+        self._inflight += 1
+        if self._inflight > self._limit:
+            self.drain(self._limit)
+
+    def call(self, fn: Callable[[], None]):
+        """Run fn once every block queued before it went to sink"""
+        self._queue.append(fn)
+
+    def drain(self, limit: int = 0):
+        """Consume results until at most limit blocks are in flight"""
+        while self._queue and (self._inflight > limit or not isinstance(self._queue[0], Future)):
+            item = self._queue.popleft()
+            if isinstance(item, Future):
+                self._inflight -= 1
+                self.sink(item.result())
+            else:
+                item()
+            self._job.token.check()
+
+
+class CompressedWriter:
+    """File-like writer compressing BLOCK sized pieces in parallel"""
+
+    def __init__(self, out: BinaryIO, codec: str, pipeline: Pipeline, job: Job,
+                 level: int = LEVEL) -> None:
+        self._codec = codec
+        self._level = level
+        self._pipeline = pipeline
+        self._pipeline.sink = out.write
+        self._job = job
+        self._buffer = bytearray()
+
+    def write(self, data: bytes):
+        """Buffer data, queueing full blocks"""
+        self._buffer += data
+        self._job.advance(len(data))
+        while len(self._buffer) >= BLOCK:
+            self._pipeline.submit(compress_block, self._codec, bytes(self._buffer[:BLOCK]),
+                                  self._level)
+            del self._buffer[:BLOCK]
+        return len(data)
+
+    def close(self):
+        """Queue what is left and wait for everything"""
+        if self._buffer:
+            self._pipeline.submit(compress_block, self._codec, bytes(self._buffer), self._level)
+            self._buffer.clear()
+        self._pipeline.drain()
+
+
+class CountingWriter:
+    """Pass-through writer that reports progress"""
+
+    def __init__(self, out: BinaryIO, job: Job) -> None:
+        self._out = out
+        self._job = job
+
+    def write(self, data: bytes):
+        """Write data"""
+        self._job.token.check()
+        self._job.advance(len(data))
+        return self._out.write(data)
+
+    def close(self):
+        """Nothing to flush"""
+
+
+def _dos_time(mtime: float):
+    tm = localtime(max(mtime, 315532800))
+    return ((tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2),
+            ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday)
+
+
+class ZipWriter:
+    """Streaming zip64 writer fed with blocks deflated in parallel"""
+
+    def __init__(self, out: BinaryIO, pipeline: Pipeline, job: Job, level: int = LEVEL) -> None:
+        self._out = out
+        self._pipeline = pipeline
+        self._pipeline.sink = self._write
+        self._job = job
+        self._level = level
+        self._central: list[bytes] = []
+        self._current: dict = {}
+
+    def _write(self, data: bytes):
+        self._out.write(data)
+        self._current["csize"] += len(data)
+
+    def _begin(self, name: str, st: stat_result, method: int):
+        encoded = name.encode()
+        time, date = _dos_time(st.st_mtime)
+        offset = self._out.tell()
+        self._out.write(pack("<IHHHHHIIIHH", 0x04034B50, 45, 0x800, method, time, date,
+                             0, 0xFFFFFFFF, 0xFFFFFFFF, len(encoded), 20))
+        self._out.write(encoded)
+        self._out.write(pack("<HHQQ", 1, 16, 0, 0))
+        self._current = {"name": encoded, "offset": offset, "time": time, "date": date,
+                         "method": method, "mode": st.st_mode, "csize": 0}
+
+    def _end(self, crc: int, usize: int):
+        entry = self._current
+        end = self._out.tell()
+        self._out.seek(entry["offset"] + 14)
+        self._out.write(pack("<I", crc))
+        self._out.seek(entry["offset"] + 30 + len(entry["name"]) + 4)
+        self._out.write(pack("<QQ", usize, entry["csize"]))
+        self._out.seek(end)
+        self._central.append(
+            pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 45 | (3 << 8), 45, 0x800, entry["method"],
+                 entry["time"], entry["date"], crc, 0xFFFFFFFF, 0xFFFFFFFF,
+                 len(entry["name"]), 28, 0, 0, 0, (entry["mode"] & 0xFFFF) << 16, 0xFFFFFFFF)
+            + entry["name"] + pack("<HHQQQ", 1, 24, usize, entry["csize"], entry["offset"]))
+
+    def add(self, path: str, name: str):
+        """Add a file, symlink or empty directory entry"""
+        st = lstat(path)
+        if S_ISDIR(st.st_mode):
+            def directory():
+                self._begin(name + "/", st, 0)
+                self._end(0, 0)
+            self._pipeline.call(directory)
+            return
+        if S_ISLNK(st.st_mode):
+            target = readlink(path).encode()
+            crc = zlib.crc32(target)
+
+            def link():
+                self._begin(name, st, 0)
+                self._write(target)
+                self._end(crc, len(target))
+            self._pipeline.call(link)
+            return
+        if not S_ISREG(st.st_mode):
+            return
+        self._pipeline.call(lambda: self._begin(name, st, zipfile.ZIP_DEFLATED))
+        crc = 0
+        size = 0
+        with open(path, "rb") as file:
+            data = file.read(BLOCK)
+            while True:
+                following = file.read(BLOCK) if data else b""
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                self._job.advance(len(data))
+                self._pipeline.submit(deflate_block, data, self._level, not following)
+                if not following:
+                    break
+                data = following
+        self._pipeline.call(lambda crc=crc, size=size: self._end(crc, size))
+
+    def close(self):
+        """Write the central directory"""
+        self._pipeline.drain()
+        start = self._out.tell()
+        for record in self._central:
+            self._out.write(record)
+        size = self._out.tell() - start
+        end = self._out.tell()
+        count = len(self._central)
+        self._out.write(pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count,
+                             size, start))
+        self._out.write(pack("<IIQI", 0x07064B50, 0, end, 1))
+        self._out.write(pack("<IHHHHIIH", 0x06054B50, 0, 0, 0xFFFF, 0xFFFF,
+                             0xFFFFFFFF, 0xFFFFFFFF, 0))
+
+
+def walk(path: str, job: Job):
+    """path and everything below it, directories before their content"""
+    stack = [path]
+    while stack:
+        job.token.check()
+        current = stack.pop()
+        yield current
+        if S_ISDIR(lstat(current).st_mode):
+            with scandir(current) as it:
+                names = sorted(entry.name for entry in it)
+            stack.extend(join(current, name) for name in reversed(names))
+
+
+def _size(path: str, job: Job):
+    total = 0
+    for item in walk(path, job):
+        st = lstat(item)
+        if S_ISREG(st.st_mode):
+            total += st.st_size
+    return total
+
+
+@contextmanager
+def written(dest: str):
+    """A new file that only shows up as dest once everything was written to it"""
+    staged = join(dirname(dest), f"{STAGING_PREFIX}{getpid()}-{basename(dest)}")
+    try:
+        with open(staged, "xb") as out:
+            yield out
+        if exists(dest) or islink(dest):
+            raise FileExistsError(f"Destination exists: {dest}")
+        rename(staged, dest)
+    except BaseException:
+        if exists(staged):
+            unlink(staged)
+        raise
+
+
+def check_sources(sources: list[str], container: str):
+    """Refuse what the format can't hold: a bare codec compresses one file"""
+    if not container and (len(sources) != 1 or not isfile(sources[0])):
+        raise ValueError("Only a single file can be compressed without tar, "
+                         "try .tar.gz, .tar.bz2 or .tar.xz")
+
+
+def make_archive(sources: list[str], dest: str, job: Job):
+    """Write sources into dest, picking the format from its name"""
+    container, codec = detect(dest)
+    check_sources(sources, container)
+    for source in sources:
+        job.grow(_size(source, job))
+    with process_pool() as executor, written(dest) as out:
+        pipeline = Pipeline(executor, job)
+        try:
+            if container == "zip":
+                writer = ZipWriter(out, pipeline, job)
+                for source in sources:
+                    base = dirname(source.rstrip("/"))
+                    for path in walk(source, job):
+                        writer.add(path, relpath(path, base))
+                writer.close()
+                return
+            stream = CompressedWriter(out, codec, pipeline, job) if codec else CountingWriter(out, job)
+            if not container:
+                with open(sources[0], "rb") as file:
+                    copyfileobj(file, stream, BLOCK)  # type: ignore
+            else:
+                with tarfile.open(fileobj=stream, mode="w|", bufsize=BLOCK) as tar:  # type: ignore
+                    for source in sources:
+                        tar.add(source, basename(source.rstrip("/")))
+            stream.close()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def member_path(dest: str, name: str):
+    """Where a zip member goes under dest, without leaving it"""
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return join(dest, *parts) if parts else dest
+
+
+class ZipReader:
+    """One open ZipFile per thread, so the central directory is read once each"""
+
+    def __init__(self, archive: str) -> None:
+        self._archive = archive
+        self._local = local()
+        self._opened: list[zipfile.ZipFile] = []
+        self._lock = Lock()
+
+    def get(self):
+        """This thread's handle"""
+        zf = getattr(self._local, "zf", None)
+        if zf is None:
+            zf = self._local.zf = zipfile.ZipFile(self._archive)
+            with self._lock:
+                self._opened.append(zf)
+        return zf
+
+    def close(self):
+        """Close every handle"""
+        with self._lock:
+            for zf in self._opened:
+                zf.close()
+            self._opened.clear()
+
+
+def _extract_member(reader: ZipReader, info: zipfile.ZipInfo, dest: str, job: Job):
+    job.token.check()
+    target = member_path(dest, info.filename)
+    if info.is_dir():
+        makedirs(target, exist_ok=True)
+        return
+    makedirs(dirname(target), exist_ok=True)
+    # Staged like every other file written, refusing to replace what is there
+    with reader.get().open(info) as source, written(target) as out:
+        copyfileobj(source, out, BLOCK)
+    job.advance(info.file_size, 1)
+
+
+def extract_archive(archive: str, dest: str, job: Job):
+    """Extract archive into dest, streaming its members"""
+    container, codec = detect(archive)
+    makedirs(dest, exist_ok=True)
+    if container == "zip":
+        with zipfile.ZipFile(archive) as zf:
+            members = zf.infolist()
+        for info in members:
+            job.grow(info.file_size)
+        # Members are independent, and zlib lets go of the GIL
+        reader = ZipReader(archive)
+        try:
+            with ThreadPoolExecutor(pool.workers) as executor:
+                futures = [executor.submit(_extract_member, reader, info, dest, job)
+                           for info in members]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+        finally:
+            reader.close()
+        return
+    job.grow(lstat(archive).st_size)
+    with open(archive, "rb") as raw:
+        # These read concatenated streams, which tarfile's own "r|gz" doesn't
+        source: BinaryIO = OPENERS[codec](raw, "rb") if codec else raw  # type: ignore
+        if not container:
+            target = join(dest, basename(archive)[:-len(codec) - 1])
+            with source, written(target) as out:
+                while data := source.read(BLOCK):
+                    job.token.check()
+                    out.write(data)
+                    job.done = raw.tell()
+            return
+        with source, tarfile.open(fileobj=source, mode="r|", bufsize=BLOCK) as tar:
+            for member in tar:
+                job.token.check()
+                if hasattr(tarfile, "data_filter"):
+                    tar.extract(member, dest, filter="data")
+                else:
+                    tar.extract(member, dest)
+                job.done = raw.tell()
+                job.advance(0, 1)
+
+
+def archive(sources: list[str], dest: str):
+    """Queue creating an archive"""
+    check_sources(sources, detect(dest)[0])
+    if exists(dest):
+        raise FileExistsError(f"Destination exists: {dest}")
+    return jobs.submit(Job(f"archive {basename(dest)}",
+                           lambda job: make_archive(sources, dest, job), (dirname(dest),)))
+
+
+def extract(source: str, dest: str):
+    """Queue extracting an archive"""
+    detect(source)
+    return jobs.submit(Job(f"extract {basename(source)}",
+                           lambda job: extract_archive(source, dest, job), (dest,)))
@@ -0,0 +1,162 @@
+"""Process-wide directory listing cache"""
+
+from collections import OrderedDict
+from os import stat_result
+from threading import Lock
+from time import time_ns
+from typing import TYPE_CHECKING, NamedTuple
+
+from props.inotify import IN_Q_OVERFLOW, Inotify, available
+
+if TYPE_CHECKING:
+    from props.utils import Listing
+
+DEFAULT_BUDGET = 64 * 1024 * 1024
+MAX_WATCHES = 256
+# Directories modified this recently may change again within the same
+# mtime tick, so their listing can't be trusted on mtime alone.
+RACY_NS = 2_000_000_000
+
+Key = tuple[int, int]
+
+
+class CacheEntry(NamedTuple):
+    """A cached listing"""
+    mtime: int
+    stamp: int
+    listing: "Listing"
+    size: int
+    wd: int
+
+
+def dir_key(st: stat_result) -> Key:
+    """Cache key of a directory"""
+    return (st.st_dev, st.st_ino)
+
+
+class ListingCache:
+    """LRU cache of listings keyed by (st_dev, st_ino)"""
+
+    def __init__(self, budget: int = DEFAULT_BUDGET) -> None:
+        self._budget = budget
+        self._used = 0
+        self._entries: OrderedDict[Key, CacheEntry] = OrderedDict()
+        self._watches: dict[int, Key] = {}
+        self._lock = Lock()
+        self._inotify: Inotify | None = None
+        if available():
+            try:
+                self._inotify = Inotify()
+            except OSError:
+                self._inotify = None
+
+    @property
+    def budget(self):
+        """Memory budget in bytes"""
+        return self._budget
+
+    @budget.setter
+    def budget(self, value: int):
+        with self._lock:
+            self._budget = value
+            self._evict()
+
+    @property
+    def used(self):
+        """Estimated bytes used"""
+        return self._used
+
+    def __len__(self):
+        return len(self._entries)
+
+    def listings(self):
+        """ids of the cached listings, to tell what the cache already accounts for"""
+        with self._lock:
+            return {id(entry.listing) for entry in self._entries.values()}
+
+    def get(self, st: stat_result):
+        """Return the cached listing of a directory if it is still valid"""
+        entry = self.entry(st)
+        return None if entry is None else entry.listing
+
+    def entry(self, st: stat_result):
+        """Return the cache entry of a directory if it is still valid"""
+        key = dir_key(st)
+        with self._lock:
+            self._drain()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.mtime != st.st_mtime_ns:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, path: str, st: stat_result, listing: "Listing", stamp: int = 0):
+        """Cache a listing read from a directory whose stat was st
+
+        stamp is when the read started, defaulting to now."""
+        key = dir_key(st)
+        size = listing.nbytes()
+        stamp = stamp or time_ns()
+        with self._lock:
+            self._drain()
+            if key in self._entries:
+                self._drop(key)
+            if size > self._budget or stamp - st.st_mtime_ns <= RACY_NS:
+                return
+            wd = self._watch(path)
+            if wd >= 0:
+                self._watches[wd] = key
+            self._entries[key] = CacheEntry(st.st_mtime_ns, stamp, listing, size, wd)
+            self._used += size
+            self._evict()
+
+    def invalidate(self, st: stat_result):
+        """Forget a directory"""
+        with self._lock:
+            self._drop(dir_key(st))
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def _watch(self, path: str):
+        if self._inotify is None or len(self._watches) >= MAX_WATCHES:
+            return -1
+        try:
+            return self._inotify.add_watch(path)
+        except OSError:
+            return -1
+
+    def _drain(self):
+        if self._inotify is None:
+            return
+        for event in self._inotify.read():
+            if event.mask & IN_Q_OVERFLOW:
+                for key in [k for k, e in self._entries.items() if e.wd >= 0]:
+                    self._drop(key)
+                continue
+            key = self._watches.get(event.wd)
+            if key is not None:
+                self._drop(key)
+
+    def _drop(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._used -= entry.size
+        if entry.wd >= 0:
+            self._watches.pop(entry.wd, None)
+            if self._inotify is not None:
+                self._inotify.rm_watch(entry.wd)
+
+    def _evict(self):
+        while self._used > self._budget and self._entries:
+            self._drop(next(iter(self._entries)))
+
+
+listing_cache = ListingCache()
@@ -0,0 +1,337 @@
+"""Two-tree comparison and sync
+
+Entries are matched by relative path. Files of different sizes differ
+and files with the same size and mtime are taken as equal; only files
+of the same size but different mtimes are hashed, on the scan pool."""
+
+# pylint: disable=no-member
+
+import curses
+from concurrent.futures import Future, wait
+from os import readlink, scandir
+from os.path import join
+from threading import BoundedSemaphore, Lock
+from typing import Callable, NamedTuple
+
+from props.colors import Basic
+from props.grep import scan_pool
+from props.jobs import Job, human_size, jobs
+from props.perf import syscalls, timed
+from props.scan import digests
+from props.workers import Cancelled, wakeup
+
+LEFT_ONLY = "only left"
+RIGHT_ONLY = "only right"
+LEFT_NEWER = "newer left"
+RIGHT_NEWER = "newer right"
+DIFFERS = "differs"
+MISMATCH = "type differs"
+HASH_BATCH = 32
+SYNC_LEFT = ord(">")
+SYNC_RIGHT = ord("<")
+FORCE_LEFT = ord("}")
+FORCE_RIGHT = ord("{")
+
+# What sync copies, by direction: left to right or right to left
+SYNCED = {
+    True: (LEFT_ONLY, LEFT_NEWER, DIFFERS),
+    False: (RIGHT_ONLY, RIGHT_NEWER, DIFFERS),
+}
+# Newer on the destination, only overwritten when forced
+KEPT = {True: RIGHT_NEWER, False: LEFT_NEWER}
+
+
+class Stat(NamedTuple):
+    """What comparing needs of an entry"""
+    kind: str
+    size: int
+    mtime: int
+
+
+class Diff(NamedTuple):
+    """An entry that isn't the same on both sides"""
+    relative: str
+    kind: str
+    size: int
+
+
+def entries(path: str):
+    """Entries of a directory by name"""
+    found: dict[str, Stat] = {}
+    syscalls()
+    with scandir(path) as it:
+        for entry in it:
+            if entry.is_symlink():
+                kind = "link"
+            elif entry.is_dir(follow_symlinks=False):
+                kind = "dir"
+            elif entry.is_file(follow_symlinks=False):
+                kind = "file"
+            else:
+                kind = "special"
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                # Gone since it was listed
+                continue
+            found[entry.name] = Stat(kind, st.st_size, st.st_mtime_ns)
+    return found
+
+
+def newer(left: Stat, right: Stat):
+    """Which side of a differing pair is newer"""
+    if left.mtime == right.mtime:
+        return DIFFERS
+    return LEFT_NEWER if left.mtime > right.mtime else RIGHT_NEWER
+
+
+class Comparison:
+    """Differences streamed in by a Comparer"""
+
+    def __init__(self, left: str, right: str) -> None:
+        self.left = left
+        self.right = right
+        self._diffs: list[Diff] = []
+        self._lock = Lock()
+        self.dirs = 0
+        self.files = 0
+        self.hashed = 0
+        self.errors = 0
+        self.stage = "comparing"
+        self.done = False
+
+    def add(self, diff: Diff):
+        """Add a difference"""
+        with self._lock:
+            self._diffs.append(diff)
+
+    def diffs(self):
+        """Differences found so far"""
+        with self._lock:
+            return list(self._diffs)
+
+    def __len__(self):
+        return len(self._diffs)
+
+    def copies(self, to_right: bool, force: bool = False):
+        """(src, dst) pairs that make one side match the other
+
+        Entries only on the destination side are left alone, and so are
+        entries whose types differ and, unless forced, files newer on
+        the destination."""
+        src, dst = (self.left, self.right) if to_right else (self.right, self.left)
+        kinds = SYNCED[to_right] + ((KEPT[to_right],) if force else ())
+        return [(join(src, diff.relative), join(dst, diff.relative))
+                for diff in self.diffs() if diff.kind in kinds]
+
+    def kept(self, to_right: bool):
+        """How many files a sync leaves alone for being newer on the destination"""
+        return sum(diff.kind == KEPT[to_right] for diff in self.diffs())
+
+
+class Comparer:
+    """Walks two trees side by side, hashing ambiguous pairs on the scan pool"""
+
+    def __init__(self, comparison: Comparison) -> None:
+        self._comparison = comparison
+        self._slots = BoundedSemaphore(scan_pool.workers * 2)
+        self._futures: set[Future] = set()
+        self._lock = Lock()
+
+    def run(self, job: Job):
+        """Job action"""
+        comparison = self._comparison
+        stack = [""]
+        ambiguous: list[tuple[str, Stat, Stat]] = []
+        try:
+            while stack:
+                job.token.check()
+                ambiguous.extend(self._compare(stack.pop(), stack))
+                job.advance(0, 1)
+                while len(ambiguous) >= HASH_BATCH:
+                    self._submit(job, ambiguous[:HASH_BATCH])
+                    del ambiguous[:HASH_BATCH]
+            if ambiguous:
+                self._submit(job, ambiguous)
+            comparison.stage = "hashing"
+            with self._lock:
+                pending = list(self._futures)
+            while pending:
+                job.token.check()
+                pending = list(wait(pending, timeout=0.1).not_done)
+            comparison.stage = "done"
+        except Cancelled:
+            comparison.stage = "cancelled"
+            with self._lock:
+                for future in self._futures:
+                    future.cancel()
+            raise
+        finally:
+            comparison.done = True
+            wakeup.notify()
+
+    @timed("compare")
+    def _compare(self, relative: str, stack: list[str]):
+        """Compare one directory, return same-sized files whose mtimes differ"""
+        comparison = self._comparison
+        try:
+            left = entries(join(comparison.left, relative))
+            right = entries(join(comparison.right, relative))
+        except OSError:
+            comparison.errors += 1
+            return []
+        comparison.dirs += 1
+        ambiguous: list[tuple[str, Stat, Stat]] = []
+        found = False
+        for name in sorted(left.keys() | right.keys()):
+            path = join(relative, name)
+            mine, theirs = left.get(name), right.get(name)
+            if theirs is None or mine is None:
+                kind = LEFT_ONLY if theirs is None else RIGHT_ONLY
+                present: Stat = mine or theirs  # type: ignore
+                if present.kind == "special":
+                    continue
+                comparison.add(Diff(path, kind, present.size if present.kind == "file" else 0))
+                found = True
+            elif mine.kind != theirs.kind:
+                comparison.add(Diff(path, MISMATCH, 0))
+                found = True
+            elif mine.kind == "dir":
+                stack.append(path)
+            elif mine.kind == "link":
+                if self._link(path) is not None:
+                    comparison.add(Diff(path, newer(mine, theirs), 0))
+                    found = True
+            elif mine.kind == "file":
+                comparison.files += 1
+                if mine.size != theirs.size:
+                    comparison.add(Diff(path, newer(mine, theirs), mine.size))
+                    found = True
+                elif mine.mtime != theirs.mtime:
+                    ambiguous.append((path, mine, theirs))
+        if found:
+            wakeup.notify()
+        return ambiguous
+
+    def _link(self, relative: str):
+        """Targets of a pair of symlinks that point to different places, else None"""
+        comparison = self._comparison
+        try:
+            targets = (readlink(join(comparison.left, relative)),
+                       readlink(join(comparison.right, relative)))
+        except OSError:
+            comparison.errors += 1
+            return None
+        return targets if targets[0] != targets[1] else None
+
+    def _submit(self, job: Job, pairs: list[tuple[str, Stat, Stat]]):
+        comparison = self._comparison
+        files = []
+        for relative, mine, theirs in pairs:
+            files.append((join(comparison.left, relative), mine.size, mine.mtime))
+            files.append((join(comparison.right, relative), theirs.size, theirs.mtime))
+            job.grow(mine.size * 2)
+        while not self._slots.acquire(timeout=0.1):
+            job.token.check()
+        future = scan_pool.submit(digests, files, False)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda done: self._collect(job, pairs, done))
+
+    def _collect(self, job: Job, pairs: list[tuple[str, Stat, Stat]], future: Future):
+        self._slots.release()
+        comparison = self._comparison
+        with self._lock:
+            self._futures.discard(future)
+        if future.cancelled():
+            return
+        try:
+            found = future.result()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # A worker died or the pool broke, the batch is lost
+            found = [None] * len(pairs) * 2
+        for index, (relative, mine, theirs) in enumerate(pairs):
+            left, right = found[index * 2], found[index * 2 + 1]
+            job.advance(mine.size * 2)
+            if left is None or right is None:
+                comparison.errors += 1
+                continue
+            comparison.hashed += 1
+            if left != right:
+                comparison.add(Diff(relative, newer(mine, theirs), mine.size))
+        wakeup.notify()
+
+
+class CompareView:
+    """Cursor over differences, syncing a side with syncer"""
+
+    def __init__(self, comparison: Comparison, job: Job,
+                 syncer: Callable[[Comparison, bool, bool], None]) -> None:
+        self.comparison = comparison
+        self.job = job
+        self.syncer = syncer
+        self.cursor = 0
+        self.top = 0
+        self.rows = 1
+
+    def handle_key(self, key: int):
+        """Move or sync, return False for keys it doesn't know"""
+        comparison = self.comparison
+        if key in (SYNC_LEFT, SYNC_RIGHT, FORCE_LEFT, FORCE_RIGHT):
+            self.syncer(comparison, key in (SYNC_LEFT, FORCE_LEFT),
+                        key in (FORCE_LEFT, FORCE_RIGHT))
+            return True
+        count = len(comparison)
+        moves = {
+            curses.KEY_UP: self.cursor - 1,
+            curses.KEY_DOWN: self.cursor + 1,
+            curses.KEY_PPAGE: self.cursor - self.rows,
+            curses.KEY_NPAGE: self.cursor + self.rows,
+            curses.KEY_HOME: 0,
+            curses.KEY_END: count - 1,
+        }
+        if key not in moves:
+            return False
+        self.cursor = max(min(moves[key], count - 1), 0)
+        return True
+
+    def close(self):
+        """Stop comparing if it is still running"""
+        self.job.token.cancel()
+
+
+def draw_compare(screen: curses.window, view: CompareView):
+    """Draw the differences found so far"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    comparison = view.comparison
+    view.rows = rows = max(maxy - 2, 1)
+    diffs = comparison.diffs()
+    if view.cursor < view.top:
+        view.top = view.cursor
+    elif view.cursor >= view.top + rows:
+        view.top = view.cursor - rows + 1
+    header = (f" {comparison.left} vs {comparison.right}: {comparison.stage}, "
+              f"{len(diffs)} differences, {comparison.dirs} dirs, {comparison.files} files, "
+              f"{comparison.hashed} hashed, {comparison.errors} errors"
+              " | >: sync left to right, <: right to left, keeping newer files"
+              " (} and { overwrite them) ")
+    selected = curses.color_pair(int(Basic.SELECTED))
+    try:
+        screen.addnstr(0, 2, header, max(maxx - 4, 0))
+        for y, index in enumerate(range(view.top, min(view.top + rows, len(diffs)))):
+            diff = diffs[index]
+            size = human_size(diff.size) if diff.size else ""
+            label = f"{diff.kind:<12} {size:>10}  {diff.relative}"
+            screen.addnstr(y + 1, 1, label, max(maxx - 2, 0),
+                           selected if index == view.cursor else 0)
+    except curses.error:
+        pass
+
+
+def compare(left: str, right: str):
+    """Queue a comparison of two trees, return its results and job"""
+    comparison = Comparison(left, right)
+    job = jobs.submit(Job(f"compare {left} {right}", Comparer(comparison).run))
+    return comparison, job
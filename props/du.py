@@ -0,0 +1,271 @@
+"""Background directory sizes"""
+
+from collections import OrderedDict
+from os import lstat, scandir
+from os.path import join
+from stat import S_ISDIR
+from threading import Lock
+from time import time_ns
+from typing import NamedTuple
+
+from props.cache import RACY_NS
+from props.jobs import human_size
+from props.perf import syscalls, timed
+from props.workers import Cancelled, Token, WorkerPool, wakeup
+
+MAX_NODES = 500_000
+# Directories a task walks before handing the rest of its stack back to the pool
+SPLIT_EVERY = 256
+
+Key = tuple[int, int]
+
+
+class Node(NamedTuple):
+    """Names one directory holds directly"""
+    mtime: int
+    files: tuple[str, ...]
+    subdirs: tuple[str, ...]
+
+
+class SizeCache:
+    """LRU of directory nodes keyed by (st_dev, st_ino), valid for one mtime
+
+    Only names are cached, which saves reading directories again. Files
+    are still stat()ed every time: one growing in place, like a log or a
+    download, doesn't move its directory's mtime."""
+
+    def __init__(self, limit: int = MAX_NODES) -> None:
+        self._limit = limit
+        self._nodes: OrderedDict[Key, Node] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Key, mtime: int):
+        """Cached node, if the directory didn't change since"""
+        with self._lock:
+            node = self._nodes.get(key)
+            if node is None or node.mtime != mtime:
+                return None
+            self._nodes.move_to_end(key)
+            return node
+
+    def put(self, key: Key, node: Node):
+        """Remember a node, unless its directory may still change unnoticed"""
+        if time_ns() - node.mtime < RACY_NS:
+            return
+        with self._lock:
+            self._nodes[key] = node
+            self._nodes.move_to_end(key)
+            while len(self._nodes) > self._limit:
+                self._nodes.popitem(last=False)
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._nodes.clear()
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+size_cache = SizeCache()
+du_pool = WorkerPool()
+
+
+class Sizes:
+    """Disk usage of every entry of one directory, filled in the background
+
+    Hard-linked files are counted once for the whole directory, the way
+    du does, and the walk doesn't leave the directory's filesystem."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.token = Token()
+        self.version = 0
+        self.pending = 0
+        self.errors = 0
+        self._values: dict[str, int] = {}
+        self._partial: set[str] = set()
+        self._seen: set[Key] = set()
+        # Entries that are mount points, which aren't entered
+        self._mounts: set[str] = set()
+        # Bytes found so far and tasks still walking, by entry
+        self._totals: dict[str, int] = {}
+        self._tasks: dict[str, int] = {}
+        self._lock = Lock()
+        self._dev = -1
+
+    def get(self, name: str):
+        """Size of an entry and whether it is final, None if unknown yet"""
+        value = self._values.get(name)
+        if value is None:
+            return None
+        return value, name not in self._partial
+
+    def nbytes(self):
+        """Rough memory footprint"""
+        with self._lock:
+            return 100 * len(self._values) + 80 * len(self._seen)
+
+    @property
+    def total(self):
+        """Sum of what is known so far"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def _publish(self, name: str, value: int, final: bool):
+        with self._lock:
+            self._values[name] = value
+            if final:
+                self._partial.discard(name)
+            else:
+                self._partial.add(name)
+            self.version += 1
+        wakeup.notify()
+
+    def _linked(self, linked: tuple[tuple[int, int, int], ...]):
+        total = 0
+        with self._lock:
+            for dev, ino, size in linked:
+                if (dev, ino) not in self._seen:
+                    self._seen.add((dev, ino))
+                    total += size
+        return total
+
+    def _node(self, path: str):
+        """lstat of a directory and its names, read again only once its mtime moved"""
+        syscalls()
+        st = lstat(path)
+        key = (st.st_dev, st.st_ino)
+        node = size_cache.get(key, st.st_mtime_ns)
+        if node is not None:
+            return st, node
+        syscalls()
+        files: list[str] = []
+        subdirs: list[str] = []
+        with scandir(path) as it:
+            for entry in it:
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        files.append(entry.name)
+                        continue
+                    syscalls()
+                    if entry.stat(follow_symlinks=False).st_dev == self._dev:
+                        subdirs.append(entry.name)
+                except OSError:
+                    # Stat()ed again with the files, where it counts as unreadable
+                    files.append(entry.name)
+        node = Node(st.st_mtime_ns, tuple(files), tuple(subdirs))
+        size_cache.put(key, node)
+        return st, node
+
+    def _walk(self, stack: list[str]):
+        """Size up to SPLIT_EVERY directories off stack, return (bytes, errors)"""
+        total = errors = 0
+        for _ in range(SPLIT_EVERY):
+            if not stack:
+                break
+            self.token.check()
+            path = stack.pop()
+            try:
+                st, node = self._node(path)
+            except OSError:
+                errors += 1
+                continue
+            total += st.st_blocks * 512
+            linked: list[tuple[int, int, int]] = []
+            for name in node.files:
+                syscalls()
+                try:
+                    fst = lstat(join(path, name))
+                except OSError:
+                    errors += 1
+                    continue
+                if fst.st_nlink > 1:
+                    linked.append((fst.st_dev, fst.st_ino, fst.st_blocks * 512))
+                else:
+                    total += fst.st_blocks * 512
+            total += self._linked(tuple(linked))
+            stack.extend(join(path, sub) for sub in node.subdirs)
+        return total, errors
+
+    @timed("du")
+    def _measure(self, name: str, stack: list[str]):
+        """Walk part of an entry's tree, fanning what is left out to the pool"""
+        total = errors = 0
+        try:
+            total, errors = self._walk(stack)
+        except Cancelled:
+            stack.clear()
+        parts = [stack[index::du_pool.workers] for index in range(min(len(stack), du_pool.workers))]
+        with self._lock:
+            self.errors += errors
+            self._totals[name] += total
+            self._tasks[name] += len(parts) - 1
+            value = self._totals[name]
+            done = not self._tasks[name]
+            if done:
+                self.pending -= 1
+        if not self.token.cancelled:
+            self._publish(name, value, done)
+        for part in parts:
+            du_pool.submit(self._measure, name, part)
+        wakeup.notify()
+
+    def start(self):
+        """Size every entry in the background"""
+        self.pending = 1
+        du_pool.submit(self._scan)
+        return self.token
+
+    def _scan(self):
+        errors = 0
+        try:
+            self._dev = lstat(self.path).st_dev
+            with scandir(self.path) as it:
+                entries = list(it)
+        except OSError:
+            errors += 1
+            entries = []
+        subdirs: list[str] = []
+        for entry in entries:
+            try:
+                est = entry.stat(follow_symlinks=False)
+            except OSError:
+                errors += 1
+                continue
+            if S_ISDIR(est.st_mode) and est.st_dev != self._dev:
+                with self._lock:
+                    self._mounts.add(entry.name)
+                    self.version += 1
+            elif S_ISDIR(est.st_mode):
+                subdirs.append(entry.name)
+            elif est.st_nlink > 1:
+                self._publish(entry.name, self._linked(
+                    ((est.st_dev, est.st_ino, est.st_blocks * 512),)), True)
+            else:
+                self._publish(entry.name, est.st_blocks * 512, True)
+        with self._lock:
+            self.errors += errors
+            self.pending += len(subdirs) - 1
+            for name in subdirs:
+                self._totals[name] = 0
+                self._tasks[name] = 1
+        for name in subdirs:
+            if self.token.cancelled:
+                break
+            du_pool.submit(self._measure, name, [join(self.path, name)])
+        wakeup.notify()
+
+    def label(self, name: str):
+        """Size column of an entry"""
+        value = self.get(name)
+        if value is None:
+            return "mount" if name in self._mounts else "\u2026"
+        size, final = value
+        return human_size(size) if final else f">{human_size(size)}"
+
+    def summary(self):
+        """Footer text"""
+        state = f", {self.pending} pending" if self.pending else ""
+        errors = f", {self.errors} unreadable" if self.errors else ""
+        return f" du {human_size(self.total)}{state}{errors} "
@@ -0,0 +1,414 @@
+"""Duplicate file finder
+
+Files are grouped by size, then by a digest of their first and last
+blocks, and only what still collides is hashed in full. Digests are
+kept on disk keyed by (st_dev, st_ino, size, st_mtime_ns), so running
+again over the same tree hashes nothing that hasn't changed."""
+
+# pylint: disable=no-member
+
+import curses
+import struct
+from collections import OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from os import replace, scandir
+from os.path import relpath
+from pathlib import Path
+from threading import Lock
+from time import time_ns
+from typing import Callable
+
+from props.cache import RACY_NS
+from props.colors import Basic
+from props.find import pseudo_mounts
+from props.grep import scan_pool
+from props.jobs import Job, human_size, jobs
+from props.perf import syscalls, timed
+from props.scan import DIGEST_SIZE, EDGE, digests
+from props.workers import Cancelled, wakeup
+
+HASH_FILE = Path("~/.rimueirnarn.elymicia/hashes.bin").expanduser()
+MAX_CACHED = 500_000
+PARTIAL_BATCH = 256
+FULL_BATCH = 64 * 1024 ** 2
+MAGIC = b"ELYH"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")  # magic, version, record count
+RECORD = struct.Struct(f"<QQQq{DIGEST_SIZE}s{DIGEST_SIZE}s")
+UNKNOWN = bytes(DIGEST_SIZE)
+MARK = ord(" ")
+MARK_EXTRA = ord("a")
+UNMARK = ord("u")
+REMOVE = ord("D")
+
+Key = tuple[int, int, int, int]
+File = tuple[str, int, int]
+
+
+class HashCache:
+    """Partial and full digests on disk, keyed by (st_dev, st_ino, size, st_mtime_ns)
+
+    Files modified within RACY_NS of being hashed aren't cached, they may
+    change again without their mtime moving."""
+
+    def __init__(self, path: Path, limit: int = MAX_CACHED) -> None:
+        self._path = path
+        self._limit = limit
+        self._entries: OrderedDict[Key, tuple[bytes, bytes]] = OrderedDict()
+        self._loaded = False
+        self._dirty = False
+        self._lock = Lock()
+
+    def _load(self):
+        self._loaded = True
+        try:
+            data = self._path.read_bytes()
+            magic, version, count = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                return
+            for dev, ino, size, mtime, partial, full in RECORD.iter_unpack(
+                    data[HEADER.size:HEADER.size + count * RECORD.size]):
+                self._entries[(dev, ino, size, mtime)] = (partial, full)
+        except (OSError, struct.error):
+            self._entries.clear()
+
+    def get(self, key: Key):
+        """Partial and full digests, UNKNOWN where not cached"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            found = self._entries.get(key)
+            if found is None:
+                return UNKNOWN, UNKNOWN
+            self._entries.move_to_end(key)
+            return found
+
+    def put(self, key: Key, partial: bytes = UNKNOWN, full: bytes = UNKNOWN):
+        """Remember digests of a file, keeping those already known"""
+        if time_ns() - key[3] <= RACY_NS:
+            return
+        with self._lock:
+            old = self._entries.get(key, (UNKNOWN, UNKNOWN))
+            self._entries[key] = (partial if partial != UNKNOWN else old[0],
+                                  full if full != UNKNOWN else old[1])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._limit:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def save(self):
+        """Write the cache if it changed, least recently used entries first"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = bytearray(HEADER.pack(MAGIC, VERSION, len(self._entries)))
+            for key, (partial, full) in self._entries.items():
+                data += RECORD.pack(*key, partial, full)
+            self._dirty = False
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self._path.with_name(self._path.name + ".tmp")
+        temporary.write_bytes(data)
+        replace(temporary, self._path)
+
+
+hash_cache = HashCache(HASH_FILE)
+
+
+class DupeGroup:
+    """Files with the same content"""
+
+    def __init__(self, size: int, paths: list[str]) -> None:
+        self.size = size
+        self.paths = paths
+        self.marked: set[str] = set()
+
+    @property
+    def wasted(self):
+        """Bytes freed by keeping one copy"""
+        return self.size * (len(self.paths) - 1)
+
+
+class DupeResults:
+    """What a dupes job found so far"""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.stage = "listing"
+        self.files = 0
+        self.hashed = 0
+        self.cached = 0
+        self.errors = 0
+        self.groups: list[DupeGroup] = []
+        self.keys: dict[str, Key] = {}
+        self.done = False
+
+    @property
+    def wasted(self):
+        """Bytes freed by keeping one copy of everything"""
+        return sum(group.wasted for group in self.groups)
+
+    def marked(self):
+        """Marked paths, skipping groups where every copy is marked"""
+        return [path for group in self.groups if len(group.marked) < len(group.paths)
+                for path in group.paths if path in group.marked]
+
+    def forget(self, paths: set[str]):
+        """Drop removed paths, and groups left with a single file"""
+        groups = []
+        for group in self.groups:
+            group.paths = [path for path in group.paths if path not in paths]
+            group.marked -= paths
+            if len(group.paths) > 1:
+                groups.append(group)
+        self.groups = groups
+
+
+class Dupes:
+    """Finds duplicates under a directory, staged by size, edges and content"""
+
+    def __init__(self, root: str, results: DupeResults, min_size: int = 1) -> None:
+        self._root = root
+        self._results = results
+        self._min_size = max(min_size, 1)
+        self._keys = results.keys
+        self._skip = pseudo_mounts() - {root}
+
+    def run(self, job: Job):
+        """Job action"""
+        results = self._results
+        try:
+            by_size = self._list(job)
+            results.stage = "hashing edges"
+            wakeup.notify()
+            candidates = [files for files in by_size.values() if len(files) > 1]
+            by_edges = self._group(job, candidates, True)
+            results.stage = "hashing contents"
+            wakeup.notify()
+            # Up to 2 * EDGE bytes the edges are the whole content
+            small = [files for size, files in by_edges if size <= 2 * EDGE]
+            large = [files for size, files in by_edges if size > 2 * EDGE]
+            groups = small + [files for _, files in self._group(job, large, False)]
+            results.groups = sorted(
+                (DupeGroup(files[0][1], sorted(path for path, _, _ in files)) for files in groups),
+                key=lambda group: group.wasted, reverse=True)
+            results.stage = "done"
+        except Cancelled:
+            results.stage = "cancelled"
+            raise
+        finally:
+            results.done = True
+            wakeup.notify()
+            try:
+                hash_cache.save()
+            except OSError:
+                pass
+
+    @timed("dupes")
+    def _list(self, job: Job):
+        """Regular files by size, one path per inode"""
+        by_size: dict[int, list[File]] = defaultdict(list)
+        seen: set[tuple[int, int]] = set()
+        stack = [self._root]
+        while stack:
+            job.token.check()
+            path = stack.pop()
+            syscalls()
+            count = 0
+            try:
+                with scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.path not in self._skip:
+                                    stack.append(entry.path)
+                                continue
+                            if not entry.is_file(follow_symlinks=False):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            self._results.errors += 1
+                            continue
+                        if st.st_size < self._min_size or (st.st_dev, st.st_ino) in seen:
+                            continue
+                        seen.add((st.st_dev, st.st_ino))
+                        self._keys[entry.path] = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+                        by_size[st.st_size].append((entry.path, st.st_size, st.st_mtime_ns))
+                        count += 1
+            except OSError:
+                self._results.errors += 1
+            self._results.files += count
+            job.advance(0, count)
+        return by_size
+
+    def _group(self, job: Job, candidates: list[list[File]], partial: bool):
+        """Split candidate groups by digest, return (size, files) groups still colliding"""
+        found: dict[str, bytes] = {}
+        missing: list[File] = []
+        for files in candidates:
+            for file in files:
+                digest = hash_cache.get(self._keys[file[0]])[0 if partial else 1]
+                if digest == UNKNOWN:
+                    missing.append(file)
+                    job.grow(min(file[1], 2 * EDGE) if partial else file[1])
+                else:
+                    found[file[0]] = digest
+                    self._results.cached += 1
+        self._hash(job, missing, partial, found)
+        groups: list[tuple[int, list[File]]] = []
+        for files in candidates:
+            by_digest: dict[bytes, list[File]] = defaultdict(list)
+            for file in files:
+                if file[0] in found:
+                    by_digest[found[file[0]]].append(file)
+            groups.extend((files[0][1], same) for same in by_digest.values() if len(same) > 1)
+        return groups
+
+    def _hash(self, job: Job, files: list[File], partial: bool, found: dict[str, bytes]):
+        """Hash files on the scan pool, at most two batches per worker in flight"""
+        batches: list[list[File]] = [[]]
+        size = 0
+        for file in files:
+            if len(batches[-1]) >= PARTIAL_BATCH or size >= FULL_BATCH:
+                batches.append([])
+                size = 0
+            batches[-1].append(file)
+            size += min(file[1], 2 * EDGE) if partial else file[1]
+        running: dict[Future, list[File]] = {}
+        try:
+            while batches or running:
+                job.token.check()
+                while batches and len(running) < scan_pool.workers * 2:
+                    batch = batches.pop()
+                    if batch:
+                        running[scan_pool.submit(digests, batch, partial)] = batch
+                done, _ = wait(running, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._collect(job, running.pop(future), future, partial, found)
+        finally:
+            for future in running:
+                future.cancel()
+
+    def _collect(self, job: Job, batch: list[File], future: Future, partial: bool,
+                 found: dict[str, bytes]):
+        try:
+            hashed = future.result()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # A worker died or the pool broke, the batch is lost
+            hashed = [None] * len(batch)
+        for (path, size, _), digest in zip(batch, hashed):
+            if digest is None:
+                self._results.errors += 1
+                continue
+            found[path] = digest
+            if partial:
+                hash_cache.put(self._keys[path], partial=digest)
+            else:
+                hash_cache.put(self._keys[path], full=digest)
+            self._results.hashed += 1
+            job.advance(min(size, 2 * EDGE) if partial else size)
+
+
+class DupesView:
+    """Cursor over duplicate groups, marking files for removal with remover
+
+    remover asks before removing anything and calls removed once it did."""
+
+    def __init__(self, results: DupeResults, job: Job,
+                 remover: Callable[[list[str]], None]) -> None:
+        self.results = results
+        self.job = job
+        self.remover = remover
+        self.cursor = 0
+        self.top = 0
+        self.rows = 1
+
+    def lines(self):
+        """(group, path) per row, path is None on a group's header"""
+        rows: list[tuple[DupeGroup, str | None]] = []
+        for group in self.results.groups:
+            rows.append((group, None))
+            rows.extend((group, path) for path in group.paths)
+        return rows
+
+    def handle_key(self, key: int):
+        """Move, mark or remove, return False for keys it doesn't know"""
+        rows = self.lines()
+        if key == MARK and self.cursor < len(rows):
+            group, path = rows[self.cursor]
+            for item in group.paths if path is None else [path]:
+                group.marked.symmetric_difference_update({item})
+            self.cursor = min(self.cursor + 1, len(rows) - 1)
+            return True
+        if key == MARK_EXTRA:
+            for group in self.results.groups:
+                group.marked = set(group.paths[1:])
+            return True
+        if key == UNMARK:
+            for group in self.results.groups:
+                group.marked.clear()
+            return True
+        if key == REMOVE:
+            paths = self.results.marked()
+            if paths:
+                self.remover(paths)
+            return True
+        moves = {
+            curses.KEY_UP: self.cursor - 1,
+            curses.KEY_DOWN: self.cursor + 1,
+            curses.KEY_PPAGE: self.cursor - self.rows,
+            curses.KEY_NPAGE: self.cursor + self.rows,
+            curses.KEY_HOME: 0,
+            curses.KEY_END: len(rows) - 1,
+        }
+        if key not in moves:
+            return False
+        self.cursor = max(min(moves[key], len(rows) - 1), 0)
+        return True
+
+    def removed(self, paths: list[str]):
+        """Drop paths queued for removal from the groups"""
+        self.results.forget(set(paths))
+        self.cursor = min(self.cursor, max(len(self.lines()) - 1, 0))
+
+    def close(self):
+        """Stop the search if it is still running"""
+        self.job.token.cancel()
+
+
+def draw_dupes(screen: curses.window, view: DupesView):
+    """Draw duplicate groups, marked files with a *"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    results = view.results
+    view.rows = rows = max(maxy - 2, 1)
+    lines = view.lines() if results.done else []
+    if view.cursor < view.top:
+        view.top = view.cursor
+    elif view.cursor >= view.top + rows:
+        view.top = view.cursor - rows + 1
+    header = (f" dupes in {results.root}: {results.stage}, {results.files} files, "
+              f"{results.hashed} hashed, {results.cached} cached, {results.errors} errors")
+    if results.done:
+        header += (f", {len(results.groups)} groups, {human_size(results.wasted)} wasted"
+                   " | space: mark, a: all but first, u: unmark, D: remove ")
+    selected = curses.color_pair(int(Basic.SELECTED))
+    try:
+        screen.addnstr(0, 2, header, max(maxx - 4, 0))
+        for y, index in enumerate(range(view.top, min(view.top + rows, len(lines)))):
+            group, path = lines[index]
+            if path is None:
+                label = f"{len(group.paths)} \u00d7 {human_size(group.size)}"
+            else:
+                label = f"  {'*' if path in group.marked else ' '} {relpath(path, results.root)}"
+            screen.addnstr(y + 1, 1, label, max(maxx - 2, 0),
+                           selected if index == view.cursor else 0)
+    except curses.error:
+        pass
+
+
+def dupes(root: str, min_size: int = 1):
+    """Queue a duplicate search under root, return its results and job"""
+    results = DupeResults(root)
+    job = jobs.submit(Job(f"dupes {root}", Dupes(root, results, min_size).run))
+    return results, job
@@ -1,24 +1,30 @@
 """Files operations"""
-from os import environ, listdir
+from os import R_OK, X_OK, access, environ
 from os.path import join
 from pathlib import Path
 import curses
-from subprocess import call
 
-from lymia.data import ReturnType, status
+from lymia.data import ReturnType
+from lymia.panel import Panel
 from lymia.utils import hide_system
+from props.meta import stat_cache
+from props.notifications import notify
 from props.state import WindowState
 from props.ui.tabs import CursorHistory, TabState
+from props.viewer import Viewer, draw_viewer
+from props.workers import load_directory
 
 def knock_knock(path: Path):
     """Return false if we aren't allowed"""
-    try:
-        listdir(path)
-    except PermissionError:
-        status.set("Cannot open: Permission Error")
+    if not access(path, R_OK | X_OK):
+        notify("Cannot open: Permission Error", "error")
         return False
     return True
 
+def cursor_path(state: TabState):
+    """Path of the entry under a tab's cursor"""
+    return join(state.content.cwd, state.content.name(state.menu.cursor))
+
 def get_editor(state: WindowState):
     """Get file editor through environ"""
     app_ed = state.settings.get("EDITOR", "")
@@ -30,8 +36,13 @@ def get_editor(state: WindowState):
 def change_dir(state: TabState, path: Path, cursor: int = 0):
     """Change directory"""
     hist = CursorHistory(str(state.cwd), cursor)
-    state.content.chdir(str(path))
+    try:
+        load_directory(state.content, str(path))
+    except (FileNotFoundError, PermissionError, NotADirectoryError) as exc:
+        notify(f"{type(exc).__name__}: {str(exc)}", "error")
+        return ReturnType.ERR
     state.cwd = str(path)
+    state.pending_cursor = -1
     state.menu.reset_cursor()
     state.cursor_history.append(hist)
     return ReturnType.CONTINUE
@@ -46,28 +57,45 @@ def entry_file_manager(screen: curses.window, state: TabState, wstate: WindowSta
 
     path: Path = entry.content().expanduser()
     try:
-        path.stat()
+        meta = stat_cache.lookup(str(path))
     except PermissionError:
-        status.set(f"Access to: {path} failed, permission denied")
+        notify(f"Access to: {path} failed, permission denied", "error")
+        return ReturnType.ERR
+    except OSError as exc:
+        notify(f"Access to: {path} failed, {exc.strerror}", "error")
         return ReturnType.ERR
 
-    if not path.is_dir() and not path.is_symlink():
-        editor = get_editor(wstate)
-        return open_file(screen, editor, str(path))
-    if path.is_symlink():
-        normalized = path.readlink()
-        if str(normalized)[0] != "/":
-            normalized = Path(join(state.cwd, str(normalized)))
-        if not normalized.is_dir():
-            editor = get_editor(wstate)
-            return open_file(screen, editor, str(path))
+    if not meta.is_dir:
+        return open_entry(screen, wstate, path)
     if not knock_knock(path):
         return ReturnType.ERR
 
     return change_dir(state, path, cursor)
 
-def open_file(screen: curses.window, editor: str, file: str):
-    """Open a file"""
+def open_entry(screen: curses.window, wstate: WindowState, path: Path):
+    """Open a file in the viewer, or in $EDITOR with viewer=editor"""
+    try:
+        regular = stat_cache.lookup(str(path)).is_file
+    except OSError:
+        regular = False
+    if wstate.settings.get("viewer", "") == "editor" or not regular:
+        return open_file(screen, get_editor(wstate), str(path))
+    return view_file(screen, wstate, str(path))
+
+def view_file(screen: curses.window, wstate: WindowState, file: str):
+    """Open a file in the built-in viewer"""
+    try:
+        viewer = Viewer(file)
+    except (OSError, ValueError) as exc:
+        notify(f"Cannot view {file}: {exc}", "error")
+        return ReturnType.ERR
+    maxy, maxx = screen.getmaxyx()
+    wstate.open_viewer(Panel(maxy - 2, maxx, 1, 0, draw_viewer, viewer), viewer)
+    return ReturnType.OVERRIDE
+
+def open_file(screen: curses.window, editor: str, *files: str):
+    """Open files, all in one editor"""
+    from subprocess import call  # pylint: disable=import-outside-toplevel
     with hide_system(screen):
-        call([editor, file])
+        call([editor, *files])
     return ReturnType.CONTINUE
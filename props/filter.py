@@ -0,0 +1,96 @@
+"""Typeahead filter"""
+
+import re
+from array import array
+
+from props.utils import Listing
+
+# Ranks, best first, packed into the top of the sort key
+PREFIX, WORD, SUBSTRING, FUZZY = range(4)
+SEPARATORS = "._- "
+
+
+def subsequence(query: str):
+    """Regex finding query's characters in order, with anything in between"""
+    return re.compile(".*?".join(map(re.escape, query)))
+
+
+def score(query: str, pattern: re.Pattern | None, name: str):
+    """Sort key of a lowercased name, lower is better, None if it doesn't match
+
+    Without a pattern only substrings match."""
+    found = name.find(query)
+    if found == 0:
+        rank, span = PREFIX, len(query)
+    elif found > 0:
+        rank = WORD if name[found - 1] in SEPARATORS else SUBSTRING
+        span = len(query)
+    else:
+        match = pattern.search(name) if pattern is not None else None
+        if match is None:
+            return None
+        rank, span = FUZZY, match.end() - match.start()
+    return (rank << 40) | (min(span, 0xFFFFF) << 20) | min(len(name), 0xFFFFF)
+
+
+class Filter:
+    """Typeahead state of a tab
+
+    Each added character only rescans the entries that matched the query
+    before it, and every step is kept so backspace costs nothing."""
+
+    def __init__(self, cursor: int, name: str | None) -> None:
+        self.cursor = cursor
+        self.name = name
+        self.listing: Listing | None = None
+        self._lowered: list[str] = []
+        self._steps: list[tuple[str, array]] = []
+
+    @property
+    def query(self):
+        """Current query"""
+        return self._steps[-1][0] if self._steps else ""
+
+    @property
+    def matches(self):
+        """Listing indices matching the query, best first, None for no query"""
+        return self._steps[-1][1] if self._steps else None
+
+    def reset(self, listing: Listing):
+        """Start over on another listing, keeping the query"""
+        query = self.query
+        self.listing = listing
+        self._lowered = [name.lower() for name in listing.names]
+        self._steps.clear()
+        self.search(query)
+
+    def search(self, query: str):
+        """Narrow down to query, return the matches"""
+        if self.listing is None:
+            return None
+        while self._steps and not query.startswith(self._steps[-1][0]):
+            self._steps.pop()
+        if not query or (self._steps and self._steps[-1][0] == query):
+            return self.matches
+        lowered = query.lower()
+        # One character is a substring or nothing
+        pattern = subsequence(lowered) if len(lowered) > 1 else None
+        names = self._lowered
+        candidates = self._steps[-1][1] if self._steps else range(len(names))
+        packed: list[int] = []
+        for index in candidates:
+            key = score(lowered, pattern, names[index])
+            if key is not None:
+                packed.append(key << 32 | index)
+        packed.sort()
+        ranked = array("I", (item & 0xFFFFFFFF for item in packed))
+        self._steps.append((query, ranked))
+        return ranked
+
+    def type(self, char: str):
+        """Add a character"""
+        return self.search(self.query + char)
+
+    def erase(self):
+        """Remove the last character"""
+        return self.search(self.query[:-1])
@@ -0,0 +1,295 @@
+"""Parallel recursive find"""
+
+# pylint: disable=no-member
+
+import curses
+import re
+from collections import deque
+from fnmatch import translate
+from os import DirEntry, scandir
+from os.path import relpath
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import time
+from typing import Callable
+
+from props.perf import syscalls, timed
+from props.workers import Cancelled, Token, pool, wakeup
+
+QUEUE_SIZE = 4096
+MAX_RESULTS = 100_000
+PSEUDO_FS = frozenset((
+    "proc", "sysfs", "devtmpfs", "devpts", "cgroup", "cgroup2", "debugfs",
+    "tracefs", "securityfs", "pstore", "bpf", "configfs", "fusectl",
+    "mqueue", "hugetlbfs", "autofs", "binfmt_misc", "efivarfs", "rpc_pipefs",
+))
+UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+# A bare number of days, like find -mtime
+TIME_UNITS = {"": 86400, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+Matcher = Callable[[DirEntry], bool]
+
+
+def parse_size(value: str):
+    """Parse 512, 10k or 1.5m into bytes"""
+    unit = value[-1:].lower() if value[-1:].isalpha() else ""
+    if unit not in UNITS:
+        raise ValueError(f"Invalid size: {value}")
+    try:
+        return int(float(value[:-1] if unit else value) * UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid size: {value}") from None
+
+
+def pseudo_mounts(path: str = "/proc/mounts"):
+    """Mount points of pseudo filesystems"""
+    mounts: set[str] = set()
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2] in PSEUDO_FS:
+                    mounts.add(fields[1].replace("\\040", " "))
+    except OSError:
+        pass
+    return mounts
+
+
+def _compare(spec: str, scale: dict[str, int], name: str):
+    """Split "+10k" into a comparison sign, a number and its unit's factor"""
+    sign = spec[0] if spec[:1] in ("+", "-") else ""
+    body = spec[1:] if sign else spec
+    unit = body[-1:].lower() if body[-1:].isalpha() else ""
+    if unit not in scale:
+        raise ValueError(f"Invalid {name}: {spec}")
+    try:
+        value = float(body[:-1] if unit else body)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {spec}") from None
+    return sign, value, scale[unit]
+
+
+def parse_query(args: list[str]):
+    """Build a matcher and a depth limit from :find arguments
+
+    A bare word is a glob, re:... a regular expression, and type=f|d|l,
+    size=[+-]N[kmgt], mtime=[+-]N[smhdw] and depth=N narrow things down."""
+    tests: list[Matcher] = []
+    depth = -1
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep:
+            if arg.startswith("re:"):
+                pattern = re.compile(arg[3:])
+            else:
+                pattern = re.compile(translate(arg), re.IGNORECASE)
+            tests.append(lambda e, p=pattern: p.search(e.name) is not None)
+        elif key == "type":
+            kinds = {"f": DirEntry.is_file, "d": DirEntry.is_dir}
+            if value == "l":
+                tests.append(DirEntry.is_symlink)
+            elif value in kinds:
+                test = kinds[value]
+                tests.append(lambda e, t=test: not e.is_symlink() and t(e))
+            else:
+                raise ValueError(f"Invalid type: {value}")
+        elif key == "size":
+            sign, size, factor = _compare(value, UNITS, "size")
+            tests.append(_size_test(sign, size * factor))
+        elif key == "mtime":
+            tests.append(_mtime_test(*_compare(value, TIME_UNITS, "mtime")))
+        elif key == "depth":
+            try:
+                depth = int(value)
+            except ValueError:
+                raise ValueError(f"Invalid depth: {value}") from None
+        else:
+            raise ValueError(f"Unknown option: {key}")
+
+    def match(entry: DirEntry):
+        return all(test(entry) for test in tests)
+    return match, depth
+
+
+def _size_test(sign: str, size: float) -> Matcher:
+    def test(entry: DirEntry):
+        value = entry.stat(follow_symlinks=False).st_size
+        if sign == "+":
+            return value > size
+        if sign == "-":
+            return value < size
+        return value == size
+    return test
+
+
+def _mtime_test(sign: str, age: float, unit: int) -> Matcher:
+    """Compare ages in whole units, like find: mtime=2 is two to three days old"""
+    def test(entry: DirEntry):
+        value = (time() - entry.stat(follow_symlinks=False).st_mtime) // unit
+        if sign == "+":
+            return value > age
+        if sign == "-":
+            return value < age
+        return value == age
+    return test
+
+
+class FindResults:
+    """Matches streamed in by a Finder"""
+
+    def __init__(self, root: str, query: str) -> None:
+        self.root = root
+        self.query = query
+        self._matches: list[str] = []
+        self._lock = Lock()
+        self.count = 0
+        self.scanned = 0
+        self.errors = 0
+        self.done = False
+
+    def add(self, paths: list[str], scanned: int = 0, errors: int = 0):
+        """Add a batch of matches, with the directories and errors it took"""
+        with self._lock:
+            room = MAX_RESULTS - len(self._matches)
+            self._matches.extend(paths[:room])
+            self.count += len(paths)
+            self.scanned += scanned
+            self.errors += errors
+
+    def tail(self, count: int):
+        """Most recent matches"""
+        with self._lock:
+            return self._matches[-count:] if count > 0 else []
+
+    def __len__(self):
+        return len(self._matches)
+
+    def __getitem__(self, index: int):
+        return self._matches[index]
+
+
+class Finder:
+    """Walks a tree with several scandir workers sharing a bounded queue"""
+
+    def __init__(self, root: str, match: Matcher, depth: int, results: FindResults,
+                 workers: int = 0) -> None:
+        self._root = root
+        self._match = match
+        self._depth = depth
+        self._results = results
+        self._workers = workers or pool.workers
+        self._queue: Queue[tuple[str, int]] = Queue(QUEUE_SIZE)
+        # Directories that found the queue full, taken once it runs dry
+        self._overflow: deque[tuple[str, int]] = deque()
+        self._pending = 0
+        self._lock = Lock()
+        self._skip = pseudo_mounts() - {root}
+        self.token = Token()
+
+    def start(self):
+        """Start walking in the background"""
+        self._push(self._root, 0)
+        for _ in range(self._workers):
+            Thread(target=self._work, daemon=True).start()
+        return self.token
+
+    def _push(self, path: str, depth: int):
+        with self._lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((path, depth))
+        except Full:
+            # Every worker may be pushing, so waiting for room could deadlock
+            with self._lock:
+                self._overflow.append((path, depth))
+
+    def _finish_one(self):
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            self._results.done = True
+            wakeup.notify()
+
+    def _next(self):
+        """Next directory to scan, None if there was none for a while"""
+        try:
+            return self._queue.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            if self._overflow:
+                return self._overflow.pop()
+        try:
+            return self._queue.get(timeout=0.1)
+        except Empty:
+            return None
+
+    def _work(self):
+        while not self._results.done:
+            item = self._next()
+            if item is None:
+                continue
+            try:
+                self._scan(*item)
+            except Cancelled:
+                self._results.done = True
+                wakeup.notify()
+                return
+            except Exception:  # pylint: disable=broad-exception-caught
+                # One broken directory must not leave the search hanging
+                self._results.add([], errors=1)
+            finally:
+                self._finish_one()
+
+    @timed("find")
+    def _scan(self, path: str, depth: int):
+        self.token.check()
+        syscalls()
+        matches: list[str] = []
+        subdirs: list[str] = []
+        errors = 0
+        try:
+            with scandir(path) as it:
+                for entry in it:
+                    try:
+                        if self._match(entry):
+                            matches.append(entry.path)
+                        if entry.is_dir(follow_symlinks=False) and entry.path not in self._skip:
+                            subdirs.append(entry.path)
+                    except OSError:
+                        errors += 1
+        except OSError:
+            errors += 1
+        # Workers share the results, so counts go through add and its lock
+        self._results.add(matches, 1, errors)
+        if matches:
+            wakeup.notify()
+        if self._depth < 0 or depth < self._depth:
+            for subdir in subdirs:
+                self.token.check()
+                self._push(subdir, depth + 1)
+
+
+def draw_results(screen: curses.window, results: FindResults):
+    """Draw find results"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    state = "done" if results.done else "searching\u2026"
+    header = (f" find {results.query} in {results.root}: {results.count} matches, "
+              f"{results.scanned} dirs, {results.errors} errors, {state} ")
+    try:
+        screen.addnstr(0, 2, header, max(maxx - 4, 0))
+        for index, path in enumerate(results.tail(maxy - 2)):
+            screen.addnstr(index + 1, 1, relpath(path, results.root), max(maxx - 2, 0))
+    except curses.error:
+        pass
+
+
+def find(root: str, args: list[str]):
+    """Start a find under root, return its results and cancellation token"""
+    match, depth = parse_query(args)
+    results = FindResults(root, " ".join(args))
+    finder = Finder(root, match, depth, results)
+    return results, finder.start()
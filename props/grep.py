@@ -0,0 +1,321 @@
+"""Parallel content search
+
+A thread walks the tree and hands batches of files to a process pool,
+where props.scan searches them through mmap with a bytes regex."""
+
+# pylint: disable=no-member
+
+import curses
+import multiprocessing
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from fnmatch import fnmatch
+from os import cpu_count, scandir
+from os.path import relpath
+from threading import BoundedSemaphore, Lock, Thread
+from typing import Callable
+
+from props.colors import Basic
+from props.find import parse_size, pseudo_mounts
+from props.perf import syscalls, timed
+from props.scan import Hit, scan
+from props.viewer import CONTROL
+from props.workers import Cancelled, Token, wakeup
+
+BATCH_FILES = 64
+BATCH_BYTES = 8 * 1024 ** 2
+DEFAULT_LIMIT = 16 * 1024 ** 2
+MAX_HITS = 100_000
+OPEN = (10, 13, curses.KEY_ENTER, curses.KEY_RIGHT)
+
+
+def parse_query(args: list[str]):
+    """Pattern, regex flags, size limit and name glob from :grep arguments
+
+    The first bare word is a regular expression, -i ignores case,
+    max=N[kmgt] skips bigger files and name=GLOB only searches matching names."""
+    pattern = None
+    flags = re.MULTILINE
+    limit = DEFAULT_LIMIT
+    glob = ""
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if arg == "-i":
+            flags |= re.IGNORECASE
+        elif sep and key == "max":
+            limit = parse_size(value)
+        elif sep and key == "name":
+            glob = value
+        elif pattern is None:
+            pattern = arg
+        else:
+            raise ValueError(f"Unexpected argument: {arg}")
+    if pattern is None:
+        raise ValueError("Provide a pattern, i.e: grep TODO name=*.py")
+    raw = pattern.encode("utf-8", "surrogateescape")
+    re.compile(raw, flags)
+    return raw, flags, limit, glob
+
+
+class ScanPool:
+    """Lazily started process pool for content scans"""
+
+    def __init__(self, workers: int | None = None) -> None:
+        self._workers = workers or cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = Lock()
+
+    @property
+    def workers(self):
+        """Worker count"""
+        return self._workers
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run fn in a worker process"""
+        with self._lock:
+            if self._executor is None:
+                # Forking a process that runs threads can inherit held locks
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() \
+                    else "spawn"
+                self._executor = ProcessPoolExecutor(
+                    self._workers, multiprocessing.get_context(method))
+            return self._executor.submit(fn, *args)
+
+    def shutdown(self):
+        """Stop the workers, dropping queued batches"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+scan_pool = ScanPool()
+
+
+class GrepResults:
+    """Hits streamed in by a Grep"""
+
+    def __init__(self, root: str, query: str) -> None:
+        self.root = root
+        self.query = query
+        self._hits: list[Hit] = []
+        self._lock = Lock()
+        self.count = 0
+        self.files = 0
+        self.binary = 0
+        self.large = 0
+        self.errors = 0
+        self.done = False
+        self.token: Token | None = None
+
+    def add(self, hits: list[Hit], counts: tuple[int, int, int, int]):
+        """Add a scanned batch"""
+        with self._lock:
+            room = MAX_HITS - len(self._hits)
+            self._hits.extend(hits[:room])
+            self.count += len(hits)
+            self.files += counts[0]
+            self.binary += counts[1]
+            self.large += counts[2]
+            self.errors += counts[3]
+
+    def __len__(self):
+        return len(self._hits)
+
+    def __getitem__(self, index: int):
+        return self._hits[index]
+
+
+class Grep:
+    """Walks a tree, searching its files in batches on the scan pool
+
+    At most two batches per worker are in flight, so a huge tree doesn't
+    pile up file lists faster than they are searched."""
+
+    def __init__(self, root: str, query: tuple[bytes, int, int, str],
+                 results: GrepResults) -> None:
+        self._root = root
+        self._pattern, self._flags, self._limit, self._glob = query
+        self._results = results
+        self._slots = BoundedSemaphore(scan_pool.workers * 2)
+        self._futures: set[Future] = set()
+        self._pending = 1
+        self._lock = Lock()
+        self._skip = pseudo_mounts() - {root}
+        self.token = Token()
+
+    def start(self):
+        """Start searching in the background"""
+        Thread(target=self._walk, daemon=True).start()
+        return self.token
+
+    def _walk(self):
+        batch: list[str] = []
+        size = 0
+        stack = [self._root]
+        try:
+            while stack:
+                self.token.check()
+                for path, length in self._scan(stack.pop(), stack):
+                    batch.append(path)
+                    size += length
+                    if len(batch) >= BATCH_FILES or size >= BATCH_BYTES:
+                        self._submit(batch)
+                        batch, size = [], 0
+            if batch:
+                self._submit(batch)
+        except Cancelled:
+            self._cancel()
+        self._finish_one()
+
+    @timed("grep")
+    def _scan(self, path: str, stack: list[str]):
+        """Files of one directory worth searching, subdirectories go on stack"""
+        syscalls()
+        files: list[tuple[str, int]] = []
+        large = errors = 0
+        try:
+            with scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self._skip:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            if self._glob and not fnmatch(entry.name, self._glob):
+                                continue
+                            length = entry.stat(follow_symlinks=False).st_size
+                            if length > self._limit:
+                                large += 1
+                            else:
+                                files.append((entry.path, length))
+                    except OSError:
+                        errors += 1
+        except OSError:
+            errors += 1
+        if large or errors:
+            # Batches are counted from pool threads, so this goes through add too
+            self._results.add([], (0, 0, large, errors))
+        return files
+
+    def _submit(self, batch: list[str]):
+        while not self._slots.acquire(timeout=0.1):
+            self.token.check()
+        self.token.check()
+        with self._lock:
+            self._pending += 1
+        try:
+            future = scan_pool.submit(scan, batch, self._pattern, self._flags, self._limit)
+        except RuntimeError:
+            # The pool was shut down under us
+            self._slots.release()
+            self._finish_one()
+            raise Cancelled() from None
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._collect)
+
+    def _collect(self, future: Future):
+        self._slots.release()
+        with self._lock:
+            self._futures.discard(future)
+        if not future.cancelled():
+            try:
+                self._results.add(*future.result())
+            except Exception:  # pylint: disable=broad-exception-caught
+                # A worker died or the pool broke, the batch is lost
+                self._results.add([], (0, 0, 0, 1))
+            wakeup.notify()
+        self._finish_one()
+
+    def _cancel(self):
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+        self._results.done = True
+        wakeup.notify()
+
+    def _finish_one(self):
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            self._results.done = True
+            wakeup.notify()
+
+
+class GrepView:
+    """Cursor over grep hits, opening the selected one with opener"""
+
+    def __init__(self, results: GrepResults, opener: Callable[[Hit], None]) -> None:
+        self.results = results
+        self.opener = opener
+        self.cursor = 0
+        self.top = 0
+        self.rows = 1
+        # Set while a hit is being opened, the search goes on behind the viewer
+        self.keep = False
+
+    def handle_key(self, key: int):
+        """Move or open, return False for keys it doesn't know"""
+        count = len(self.results)
+        if key in OPEN:
+            if self.cursor < count:
+                self.keep = True
+                self.opener(self.results[self.cursor])
+            return True
+        moves = {
+            curses.KEY_UP: self.cursor - 1,
+            curses.KEY_DOWN: self.cursor + 1,
+            curses.KEY_PPAGE: self.cursor - self.rows,
+            curses.KEY_NPAGE: self.cursor + self.rows,
+            curses.KEY_HOME: 0,
+            curses.KEY_END: count - 1,
+        }
+        if key not in moves:
+            return False
+        self.cursor = max(min(moves[key], count - 1), 0)
+        return True
+
+    def close(self):
+        """Stop searching, unless a hit is being opened"""
+        if not self.keep and self.results.token is not None:
+            self.results.token.cancel()
+        self.keep = False
+
+
+def draw_grep(screen: curses.window, view: GrepView):
+    """Draw grep hits with the cursor on the selected one"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    results = view.results
+    view.rows = rows = max(maxy - 2, 1)
+    count = len(results)
+    if view.cursor < view.top:
+        view.top = view.cursor
+    elif view.cursor >= view.top + rows:
+        view.top = view.cursor - rows + 1
+    state = "done" if results.done else "searching\u2026"
+    header = (f" grep {results.query} in {results.root}: {results.count} hits, "
+              f"{results.files} files, {results.binary} binary, {results.large} too big, "
+              f"{results.errors} errors, {state} | enter: open, q: close ")
+    selected = curses.color_pair(int(Basic.SELECTED))
+    try:
+        screen.addnstr(0, 2, header, max(maxx - 4, 0))
+        for y, index in enumerate(range(view.top, min(view.top + rows, count))):
+            path, line, _, text = results[index]
+            label = f"{relpath(path, results.root)}:{line}: {text.expandtabs(4).translate(CONTROL)}"
+            screen.addnstr(y + 1, 1, label, max(maxx - 2, 0),
+                           selected if index == view.cursor else 0)
+    except curses.error:
+        pass
+
+
+def grep(root: str, args: list[str]):
+    """Start a grep under root, return its results and cancellation token"""
+    query = parse_query(args)
+    results = GrepResults(root, " ".join(args))
+    results.token = Grep(root, query, results).start()
+    return results, results.token
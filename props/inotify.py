@@ -0,0 +1,105 @@
+"""Minimal inotify binding through ctypes"""
+
+import ctypes
+from os import close, fsencode, fsdecode, read
+from struct import Struct
+from typing import NamedTuple
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+DIR_CHANGES = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+               | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = Struct("iIII")
+
+
+class InotifyEvent(NamedTuple):
+    """A single inotify event"""
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+def _libc():
+    # The process's own symbols include libc's; find_library would spawn ldconfig
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1  # pylint: disable=pointless-statement
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_lib = _libc()
+
+
+def available():
+    """Whether inotify can be used on this system"""
+    return _lib is not None
+
+
+class Inotify:
+    """Non-blocking inotify instance"""
+
+    def __init__(self) -> None:
+        if _lib is None:
+            raise OSError("inotify is not available")
+        fd = _lib.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1 failed")
+        self._fd = fd
+
+    def fileno(self):
+        """File descriptor, usable with select"""
+        return self._fd
+
+    def add_watch(self, path: str, mask: int = DIR_CHANGES):
+        """Watch path, return a watch descriptor"""
+        wd = _lib.inotify_add_watch(self._fd, fsencode(path), mask)  # type: ignore
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed: {path}")
+        return wd
+
+    def rm_watch(self, wd: int):
+        """Stop watching a watch descriptor"""
+        _lib.inotify_rm_watch(self._fd, wd)  # type: ignore
+
+    def read(self):
+        """Read every pending event without blocking"""
+        events: list[InotifyEvent] = []
+        while True:
+            try:
+                data = read(self._fd, 65536)
+            except BlockingIOError:
+                return events
+            if not data:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, size = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = fsdecode(data[offset:offset + size].rstrip(b"\0"))
+                offset += size
+                events.append(InotifyEvent(wd, mask, cookie, name))
+
+    def close(self):
+        """Close the instance"""
+        if self._fd >= 0:
+            close(self._fd)
+            self._fd = -1
@@ -0,0 +1,734 @@
+"""Background jobs"""
+
+import errno
+from collections import deque
+from datetime import datetime
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from io import FileIO
+from os import (
+    O_CREAT,
+    O_DIRECTORY,
+    O_EXCL,
+    O_NOFOLLOW,
+    O_RDONLY,
+    O_WRONLY,
+    close,
+    getpid,
+    getuid,
+    lstat,
+    makedirs,
+    open as os_open,
+    readlink,
+    rename,
+    rmdir,
+    scandir,
+    sendfile,
+    symlink,
+    unlink,
+    write,
+)
+from os.path import basename, dirname, exists, expanduser, isdir, islink, join
+from shutil import copystat, rmtree
+from urllib.parse import quote
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable
+
+from props.notifications import bus
+from props.utils import DELETING_PREFIX, STAGING_PREFIX
+from props.workers import Cancelled, Token, pool
+
+try:
+    from os import copy_file_range
+except ImportError:  # not Linux
+    copy_file_range = None  # pylint: disable=invalid-name
+
+CHUNK = 64 * 1024 * 1024
+BUFFER = 1024 * 1024
+# Files below this size are copied in parallel, bigger ones one at a time
+SMALL_FILE = 1024 * 1024
+MAX_RUNNING = 2
+# Notification source shared by the progress of every job
+PROGRESS = "jobs"
+# errno values meaning "this kernel or filesystem can't do it, try another way"
+UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+def human_size(size: float):
+    """Human readable byte count"""
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(size) < 1024 or unit == "TiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def human_time(seconds: float):
+    """h:mm:ss"""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+class Job:
+    """A unit of background work with progress accounting"""
+
+    def __init__(self, title: str, action: Callable[["Job"], None],
+                 touched: tuple[str, ...] = ()) -> None:
+        self.id = 0
+        self.title = title
+        self.state = "queued"
+        self.error = ""
+        self.total = 0
+        self.done = 0
+        self.files = 0
+        self.touched = touched
+        self.token = Token()
+        self._action = action
+        self._lock = Lock()
+        self._started = 0.0
+        self._finished = 0.0
+
+    def advance(self, size: int, files: int = 0):
+        """Account for processed bytes and files"""
+        with self._lock:
+            self.done += size
+            self.files += files
+        bus.publish(PROGRESS, jobs.status)
+
+    def grow(self, size: int):
+        """Account for more bytes to process"""
+        with self._lock:
+            self.total += size
+
+    def run(self):
+        """Run the job in the current thread"""
+        self.state = "running"
+        self._started = monotonic()
+        try:
+            self._action(self)
+        except Cancelled:
+            self.state = "cancelled"
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # Besides OSError, a broken worker pool or a bug must still end the job
+            self.state = "failed"
+            self.error = f"{type(exc).__name__}: {exc}"
+        else:
+            self.state = "done"
+        self._finished = monotonic()
+
+    @property
+    def finished(self):
+        """Whether the job stopped, whatever the reason"""
+        return self.state in ("done", "failed", "cancelled")
+
+    @property
+    def rate(self):
+        """Bytes per second"""
+        if not self._started:
+            return 0.0
+        elapsed = (self._finished or monotonic()) - self._started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds left, -1 if unknown"""
+        rate = self.rate
+        if rate <= 0 or self.total <= 0:
+            return -1.0
+        return max(self.total - self.done, 0) / rate
+
+    def progress(self):
+        """One line progress report"""
+        if self.state == "failed":
+            return f"[{self.id}] {self.title}: {self.error}"
+        if self.state != "running":
+            return f"[{self.id}] {self.title}: {self.state}"
+        if not self.total:
+            elapsed = max(monotonic() - self._started, 1e-9)
+            return f"[{self.id}] {self.title}: {self.files} files, {self.files / elapsed:.0f}/s"
+        percent = min(self.done * 100 // self.total, 100)
+        eta = self.eta
+        return (f"[{self.id}] {self.title}: {percent}% {human_size(self.rate)}/s"
+                f"{f' ETA {human_time(eta)}' if eta >= 0 else ''}")
+
+
+class JobQueue:
+    """Runs jobs in background threads, a few at a time"""
+
+    def __init__(self, running: int = MAX_RUNNING) -> None:
+        self._running = running
+        self._queue: deque[Job] = deque()
+        self._jobs: list[Job] = []
+        self._reported: set[int] = set()
+        self._lock = Lock()
+        self._threads = 0
+        self._next = 1
+
+    @property
+    def jobs(self):
+        """Every job, oldest first"""
+        return list(self._jobs)
+
+    def submit(self, job: Job):
+        """Queue a job"""
+        with self._lock:
+            job.id = self._next
+            self._next += 1
+            self._jobs.append(job)
+            self._queue.append(job)
+            if self._threads < self._running:
+                self._threads += 1
+                Thread(target=self._work, daemon=True).start()
+        return job
+
+    def _work(self):
+        exited = False
+        try:
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        # Under the lock, so submit starts a new thread from now on
+                        self._threads -= 1
+                        exited = True
+                        return
+                    job = self._queue.popleft()
+                if not job.token.cancelled:
+                    job.run()
+                else:
+                    job.state = "cancelled"
+                bus.publish(f"job {job.id}", job.progress(),
+                            "error" if job.state == "failed" else "info", final=True)
+        finally:
+            if not exited:
+                with self._lock:
+                    self._threads -= 1
+
+    def get(self, job_id: int):
+        """Job by id"""
+        for job in self._jobs:
+            if job.id == job_id:
+                return job
+        raise KeyError(job_id)
+
+    def active(self):
+        """Jobs that haven't finished"""
+        return [job for job in self._jobs if not job.finished]
+
+    def finished(self):
+        """Jobs that finished since the last call"""
+        done = [job for job in self._jobs if job.finished and job.id not in self._reported]
+        self._reported.update(job.id for job in done)
+        return done
+
+    def status(self):
+        """Status bar text for running jobs, empty when idle"""
+        active = self.active()
+        if not active:
+            return ""
+        running = [job for job in active if job.state == "running"]
+        line = running[0].progress() if running else active[0].progress()
+        if len(active) > 1:
+            line += f" (+{len(active) - 1} more)"
+        return line
+
+
+jobs = JobQueue()
+
+
+def copy_data(src: int, dst: int, job: Job):
+    """Copy everything between descriptors, in the kernel when possible
+
+    Tries copy_file_range, then sendfile, then falls back to large
+    buffered reads."""
+    for method in (_copy_range, _sendfile):
+        copied = method(src, dst, job)
+        if copied >= 0:
+            return copied
+    copied = 0
+    buffer = bytearray(BUFFER)
+    view = memoryview(buffer)
+    reader = FileIO(src, closefd=False)
+    while True:
+        job.token.check()
+        count = reader.readinto(buffer)
+        if not count:
+            return copied
+        offset = 0
+        while offset < count:
+            offset += write(dst, view[offset:count])
+        job.advance(count)
+        copied += count
+
+
+def _kernel_copy(call: Callable[[], int], job: Job):
+    """Repeat a kernel copy call until EOF, -1 if it is unsupported"""
+    copied = 0
+    while True:
+        job.token.check()
+        try:
+            count = call()
+        except OSError as exc:
+            if copied == 0 and exc.errno in UNSUPPORTED:
+                return -1
+            raise
+        if not count:
+            return copied
+        copied += count
+        job.advance(count)
+
+
+def _copy_range(src: int, dst: int, job: Job):
+    if copy_file_range is None:
+        return -1
+    return _kernel_copy(lambda: copy_file_range(src, dst, CHUNK), job)
+
+
+def _sendfile(src: int, dst: int, job: Job):
+    return _kernel_copy(lambda: sendfile(dst, src, None, CHUNK), job)
+
+
+def copy_file(src: str, dst: str, job: Job):
+    """Copy one regular file with its permissions and times"""
+    job.token.check()
+    infd = os_open(src, O_RDONLY)
+    try:
+        outfd = os_open(dst, O_WRONLY | O_CREAT | O_EXCL, 0o600)
+        try:
+            copy_data(infd, outfd, job)
+        finally:
+            close(outfd)
+    finally:
+        close(infd)
+    copystat(src, dst, follow_symlinks=False)
+    job.advance(0, 1)
+
+
+def plan_tree(src: str, job: Job):
+    """Walk src, returning its directories, files with sizes and symlinks"""
+    dirs: list[str] = [""]
+    files: list[tuple[str, int]] = []
+    links: list[str] = []
+    stack = [""]
+    while stack:
+        job.token.check()
+        relative = stack.pop()
+        with scandir(join(src, relative)) as it:
+            for entry in it:
+                path = join(relative, entry.name)
+                if entry.is_symlink():
+                    links.append(path)
+                elif entry.is_dir(follow_symlinks=False):
+                    dirs.append(path)
+                    stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    size = entry.stat(follow_symlinks=False).st_size
+                    files.append((path, size))
+                    job.grow(size)
+    return dirs, files, links
+
+
+def copy_tree(src: str, dst: str, job: Job):
+    """Copy a tree: small files across a pool, big ones streamed in order"""
+    dirs, files, links = plan_tree(src, job)
+    for relative in dirs:
+        makedirs(join(dst, relative), exist_ok=relative != "")
+    for relative in links:
+        symlink(readlink(join(src, relative)), join(dst, relative))
+    small = [path for path, size in files if size < SMALL_FILE]
+    big = [path for path, size in files if size >= SMALL_FILE]
+    with ThreadPoolExecutor(pool.workers) as executor:
+        futures = [executor.submit(copy_file, join(src, path), join(dst, path), job)
+                   for path in small]
+        try:
+            for path in big:
+                copy_file(join(src, path), join(dst, path), job)
+        finally:
+            if futures:
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                if job.token.cancelled:
+                    for future in futures:
+                        future.cancel()
+                for future in done:
+                    future.result()
+    # Directory times change while files land in them
+    for relative in reversed(dirs):
+        copystat(join(src, relative), join(dst, relative), follow_symlinks=False)
+
+
+def discard(path: str):
+    """Remove what an interrupted copy left behind"""
+    try:
+        if isdir(path) and not islink(path):
+            rmtree(path)
+        elif exists(path) or islink(path):
+            unlink(path)
+    except OSError:
+        pass
+
+
+def copy_path(src: str, dst: str, job: Job):
+    """Copy a file, symlink or tree to a new dst, removed again if the copy stops early"""
+    st = lstat(src)
+    if exists(dst) or islink(dst):
+        raise FileExistsError(errno.EEXIST, "Destination exists", dst)
+    if not (S_ISLNK(st.st_mode) or S_ISDIR(st.st_mode) or S_ISREG(st.st_mode)):
+        raise OSError(errno.EINVAL, f"Cannot copy special file: {src}")
+    try:
+        if S_ISLNK(st.st_mode):
+            symlink(readlink(src), dst)
+            job.advance(0, 1)
+        elif S_ISDIR(st.st_mode):
+            copy_tree(src, dst, job)
+        else:
+            job.grow(st.st_size)
+            copy_file(src, dst, job)
+    except BaseException:
+        discard(dst)
+        raise
+
+
+def move_path(src: str, dst: str, job: Job):
+    """Move by renaming on the same device, by copying otherwise"""
+    if lstat(src).st_dev == lstat(dirname(dst) or ".").st_dev:
+        try:
+            rename(src, dst)
+            job.advance(0, 1)
+            return
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+    copy_path(src, dst, job)
+    job.token.check()
+    remove_path(src, job)
+
+
+def replace_file(src: str, dst: str, job: Job):
+    """Copy src over an existing file, which is swapped for the copy only once it is complete"""
+    # The prefix keeps the half-written copy out of listings
+    staged = join(dirname(dst), f"{STAGING_PREFIX}{getpid()}-{basename(dst)}")
+    job.grow(lstat(src).st_size)
+    try:
+        copy_file(src, staged, job)
+        rename(staged, dst)
+    except BaseException:
+        if exists(staged):
+            unlink(staged)
+        raise
+
+
+def sync(copies: list[tuple[str, str]], title: str):
+    """Queue copying each src to its dst, replacing regular files already there"""
+
+    def action(job: Job):
+        for src, dst in copies:
+            job.token.check()
+            if islink(dst) or not exists(dst):
+                if islink(dst):
+                    unlink(dst)
+                copy_path(src, dst, job)
+            elif isdir(dst) or isdir(src):
+                raise IsADirectoryError(errno.EISDIR, "Cannot replace a directory", dst)
+            else:
+                replace_file(src, dst, job)
+    return jobs.submit(Job(title, action, tuple({dirname(dst) for _, dst in copies})))
+
+
+def target(src: str, dst: str):
+    """Where src ends up when copied or moved to dst"""
+    if isdir(dst):
+        dst = join(dst, basename(src.rstrip("/")))
+    if exists(dst) or islink(dst):
+        raise FileExistsError(errno.EEXIST, "Destination exists", dst)
+    return dst
+
+
+def copy(src: str, dst: str):
+    """Queue a copy of src to dst"""
+    dst = target(src, dst)
+    title = f"copy {basename(src)} -> {dst}"
+    return jobs.submit(Job(title, lambda job: copy_path(src, dst, job), (dirname(dst),)))
+
+
+def move(src: str, dst: str):
+    """Queue a move of src to dst"""
+    dst = target(src, dst)
+    title = f"move {basename(src)} -> {dst}"
+    return jobs.submit(Job(title, lambda job: move_path(src, dst, job),
+                           (dirname(dst), dirname(src))))
+
+
+def _transfer_all(sources: list[str], dst: str, verb: str,
+                  method: Callable[[str, str, Job], None]):
+    if not isdir(dst):
+        raise NotADirectoryError(errno.ENOTDIR, "Destination must be a directory", dst)
+    targets = [(src, target(src, dst)) for src in sources]
+
+    def action(job: Job):
+        for src, path in targets:
+            job.token.check()
+            method(src, path, job)
+    touched = {dst, *(dirname(src) for src in sources)} if verb == "move" else {dst}
+    return jobs.submit(Job(f"{verb} {len(sources)} entries -> {dst}", action, tuple(touched)))
+
+
+def copy_all(sources: list[str], dst: str):
+    """Queue one copy of several entries into the directory dst"""
+    return _transfer_all(sources, dst, "copy", copy_path)
+
+
+def move_all(sources: list[str], dst: str):
+    """Queue one move of several entries into the directory dst"""
+    return _transfer_all(sources, dst, "move", move_path)
+
+
+class _Node:
+    """A directory being emptied; removed once its scan and children are done
+
+    It is reached by name from its parent's descriptor, dir_fd, and keeps
+    its own, fd, open until its children are gone."""
+
+    __slots__ = ("name", "parent", "dir_fd", "fd", "pending", "lock")
+
+    def __init__(self, name: str, parent: "_Node | None", dir_fd: int) -> None:
+        self.name = name
+        self.parent = parent
+        self.dir_fd = dir_fd
+        self.fd = -1
+        # The scan itself counts as pending work
+        self.pending = 1
+        self.lock = Lock()
+
+
+class _Remover:
+    """Empties a tree across a pool, unlinking relative to directory fds"""
+
+    def __init__(self, job: Job) -> None:
+        self._job = job
+        self._executor = ThreadPoolExecutor(pool.workers)
+        self._done = Event()
+        self._error: BaseException | None = None
+        self._open: set[int] = set()
+        self._lock = Lock()
+
+    def run(self, path: str):
+        """Remove path and everything below it"""
+        top = os_open(dirname(path) or ".", O_RDONLY | O_DIRECTORY)
+        try:
+            self._submit(_Node(basename(path), None, top))
+            self._done.wait()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        finally:
+            # Whatever a failure left open
+            with self._lock:
+                for fd in self._open:
+                    close(fd)
+                self._open.clear()
+            close(top)
+        if self._error is not None:
+            raise self._error
+
+    def _submit(self, node: _Node):
+        try:
+            self._executor.submit(self._scan, node)
+        except RuntimeError:
+            # Shut down after a failure or cancellation
+            pass
+
+    def _fail(self, exc: BaseException):
+        if self._error is None:
+            self._error = exc
+        self._done.set()
+
+    def _scan(self, node: _Node):
+        try:
+            self._job.token.check()
+            with self._lock:
+                # O_NOFOLLOW: a directory swapped for a symlink since it was listed isn't entered
+                node.fd = fd = os_open(node.name, O_RDONLY | O_DIRECTORY | O_NOFOLLOW,
+                                       dir_fd=node.dir_fd)
+                self._open.add(fd)
+            removed = 0
+            with scandir(fd) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        with node.lock:
+                            node.pending += 1
+                        self._submit(_Node(entry.name, node, fd))
+                        continue
+                    unlink(entry.name, dir_fd=fd)
+                    removed += 1
+                    if removed % 1024 == 0:
+                        self._job.advance(0, 1024)
+                        self._job.token.check()
+            self._job.advance(0, removed % 1024)
+            self._complete(node)
+        except BaseException as exc:  # pylint: disable=broad-except
+            self._fail(exc)
+
+    def _complete(self, node: _Node | None):
+        while node is not None:
+            with node.lock:
+                node.pending -= 1
+                if node.pending:
+                    return
+            with self._lock:
+                self._open.discard(node.fd)
+                close(node.fd)
+            # The parent's descriptor stays open until this returns
+            rmdir(node.name, dir_fd=node.dir_fd)
+            self._job.advance(0, 1)
+            node = node.parent
+        self._done.set()
+
+
+def remove_path(path: str, job: Job):
+    """Remove a file, symlink or tree"""
+    if isdir(path) and not islink(path):
+        _Remover(job).run(path)
+    else:
+        unlink(path)
+        job.advance(0, 1)
+
+
+def stage(path: str):
+    """Rename path out of the way next to itself, return the new path"""
+    parent, name = dirname(path), basename(path)
+    staged = join(parent, f"{DELETING_PREFIX}{getpid()}-{name}")
+    rename(path, staged)
+    return staged
+
+
+def delete(path: str):
+    """Queue removal of path, which disappears from its directory at once"""
+    staged = stage(path)
+
+    def action(job: Job):
+        try:
+            remove_path(staged, job)
+        except BaseException:
+            # Put back whatever is left, so nothing hides behind the prefix
+            if exists(staged) or islink(staged):
+                rename(staged, path)
+            raise
+    return jobs.submit(Job(f"delete {basename(path)}", action, (dirname(path),)))
+
+
+def _mount_point(path: str):
+    dev = lstat(path).st_dev
+    while path != "/":
+        parent = dirname(path)
+        if lstat(parent).st_dev != dev:
+            return path
+        path = parent
+    return path
+
+
+def trash_dir(path: str):
+    """XDG trash directory that path can be renamed into"""
+    home = expanduser("~/.local/share/Trash")
+    makedirs(home, exist_ok=True)
+    if lstat(home).st_dev == lstat(path).st_dev:
+        return home
+    top = join(_mount_point(path), f".Trash-{getuid()}")
+    return top
+
+
+def move_to_trash(path: str, directory: str, job: Job):
+    """Move path into a trash directory, with its .trashinfo"""
+    makedirs(join(directory, "files"), mode=0o700, exist_ok=True)
+    makedirs(join(directory, "info"), mode=0o700, exist_ok=True)
+    name = basename(path)
+    candidate = name
+    count = 1
+    while True:
+        try:
+            info = os_open(join(directory, "info", f"{candidate}.trashinfo"),
+                           O_WRONLY | O_CREAT | O_EXCL, 0o600)
+            break
+        except FileExistsError:
+            count += 1
+            candidate = f"{name}.{count}"
+    try:
+        date = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        write(info, (f"[Trash Info]\nPath={quote(path)}\n"
+                     f"DeletionDate={date}\n").encode())
+    finally:
+        close(info)
+    try:
+        rename(path, join(directory, "files", candidate))
+    except OSError:
+        unlink(join(directory, "info", f"{candidate}.trashinfo"))
+        raise
+    job.advance(0, 1)
+
+
+def trash(path: str):
+    """Queue moving path into the XDG trash"""
+    path = path.rstrip("/") or "/"
+    directory = trash_dir(path)
+
+    def action(job: Job):
+        move_to_trash(path, directory, job)
+    return jobs.submit(Job(f"trash {basename(path)}", action, (dirname(path),)))
+
+
+def identity(path: str):
+    """(st_dev, st_ino, size, st_mtime_ns) of path, None if it is gone"""
+    try:
+        st = lstat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def remove_files(paths: list[str], to_trash: bool = False,
+                 expected: dict[str, tuple[int, int, int, int]] | None = None):
+    """Queue removal of several entries as one job, into the XDG trash if to_trash
+
+    Deleted entries are staged at once, like delete does, and whatever
+    is left of them is put back if the job stops early. Entries in
+    expected are only removed while their identity still matches, the
+    rest is left in place and the job fails saying how many."""
+    expected = expected or {}
+    staged: list[tuple[str, str]] = []
+    if not to_trash:
+        try:
+            for path in paths:
+                staged.append((stage(path), path))
+        except OSError:
+            for temporary, path in staged:
+                rename(temporary, path)
+            raise
+
+    def changed(current: str, path: str):
+        return path in expected and identity(current) != expected[path]
+
+    def action(job: Job):
+        skipped = 0
+        if to_trash:
+            for path in paths:
+                job.token.check()
+                if changed(path, path):
+                    skipped += 1
+                    continue
+                move_to_trash(path, trash_dir(path), job)
+        else:
+            position = 0
+            try:
+                for position, (temporary, path) in enumerate(staged):
+                    job.token.check()
+                    if changed(temporary, path):
+                        rename(temporary, path)
+                        skipped += 1
+                        continue
+                    remove_path(temporary, job)
+            except BaseException:
+                for temporary, path in staged[position:]:
+                    if exists(temporary) or islink(temporary):
+                        rename(temporary, path)
+                raise
+        if skipped:
+            raise OSError(f"{skipped} changed since they were checked, left in place")
+    title = f"{'trash' if to_trash else 'delete'} {len(paths)} entries"
+    return jobs.submit(Job(title, action, tuple({dirname(path) for path in paths})))
@@ -0,0 +1,171 @@
+"""Entry metadata for the long listing, and the stat cache behind it"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from grp import getgrgid
+from os import lstat, readlink, stat, stat_result
+from os.path import join
+from pwd import getpwuid
+from stat import S_ISDIR, S_ISLNK, S_ISREG, filemode
+from threading import Lock
+from time import localtime, monotonic, strftime
+from typing import Iterable, NamedTuple
+
+from props.jobs import human_size
+from props.perf import syscalls, timed
+from props.workers import pool, wakeup
+
+MAX_ENTRIES = 65536
+# How long a stat is trusted before it is taken again
+TTL = 2.0
+BATCH = 64
+
+
+class Meta(NamedTuple):
+    """lstat of an entry, plus where a symlink points"""
+    st: stat_result
+    target: str | None = None
+    resolved: stat_result | None = None
+    stamp: float = 0.0
+
+    @property
+    def is_link(self):
+        """Whether the entry is a symlink"""
+        return S_ISLNK(self.st.st_mode)
+
+    @property
+    def followed(self):
+        """stat of what the entry leads to, None for a dangling link"""
+        return self.resolved if self.is_link else self.st
+
+    @property
+    def is_dir(self):
+        """Whether the entry is, or links to, a directory"""
+        followed = self.followed
+        return followed is not None and S_ISDIR(followed.st_mode)
+
+    @property
+    def is_file(self):
+        """Whether the entry is, or links to, a regular file"""
+        followed = self.followed
+        return followed is not None and S_ISREG(followed.st_mode)
+
+
+def take(path: str):
+    """Stat an entry now"""
+    syscalls()
+    st = lstat(path)
+    target = resolved = None
+    if S_ISLNK(st.st_mode):
+        syscalls(2)
+        try:
+            target = readlink(path)
+            resolved = stat(path)
+        except OSError:
+            pass
+    return Meta(st, target, resolved, monotonic())
+
+
+class StatCache:
+    """LRU of entry metadata keyed by path, trusted for TTL seconds"""
+
+    def __init__(self, limit: int = MAX_ENTRIES) -> None:
+        self._limit = limit
+        self._entries: OrderedDict[str, Meta] = OrderedDict()
+        self._inflight: set[str] = set()
+        self._lock = Lock()
+        self.version = 0
+
+    def peek(self, path: str):
+        """Cached metadata, however old, and whether it is still fresh"""
+        meta = self._entries.get(path)
+        if meta is None:
+            return None, False
+        return meta, monotonic() - meta.stamp < TTL
+
+    def _put(self, path: str, meta: Meta):
+        with self._lock:
+            self._entries[path] = meta
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._limit:
+                self._entries.popitem(last=False)
+
+    def lookup(self, path: str):
+        """Fresh metadata, stat()ing only if the cache has none"""
+        meta, fresh = self.peek(path)
+        if meta is not None and fresh:
+            return meta
+        meta = take(path)
+        self._put(path, meta)
+        return meta
+
+    def forget(self, path: str):
+        """Drop an entry"""
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def request(self, cwd: str, names: Iterable[str]):
+        """Stat entries of cwd in the background, in batches"""
+        batch: list[str] = []
+        with self._lock:
+            for name in names:
+                path = join(cwd, name)
+                if path in self._inflight:
+                    continue
+                self._inflight.add(path)
+                batch.append(path)
+        for start in range(0, len(batch), BATCH):
+            pool.submit(self._fetch, batch[start:start + BATCH])
+
+    @timed("stat")
+    def _fetch(self, paths: list[str]):
+        taken = 0
+        try:
+            for path in paths:
+                try:
+                    self._put(path, take(path))
+                except OSError:
+                    continue
+                taken += 1
+        finally:
+            with self._lock:
+                self._inflight.difference_update(paths)
+                # Vanished entries alone mustn't cause a redraw, it would ask again
+                if taken:
+                    self.version += 1
+            if taken:
+                wakeup.notify()
+
+
+stat_cache = StatCache()
+
+
+@lru_cache(maxsize=1024)
+def owner(uid: int):
+    """User name of a uid"""
+    try:
+        return getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@lru_cache(maxsize=1024)
+def group(gid: int):
+    """Group name of a gid"""
+    try:
+        return getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def long_label(meta: Meta | None, label: str):
+    """Permissions, owner, group, size, mtime, then the label"""
+    if meta is None:
+        return f"{'?' * 10} {'':8} {'':8} {'':>10} {'':16} {label}"
+    st = meta.st
+    when = strftime("%Y-%m-%d %H:%M", localtime(st.st_mtime))
+    text = (f"{filemode(st.st_mode)} {owner(st.st_uid)[:8]:8} {group(st.st_gid)[:8]:8} "
+            f"{human_size(st.st_size):>10} {when} {label}")
+    if meta.target is not None:
+        text += f" -> {meta.target}"
+    return text
@@ -0,0 +1,152 @@
+"""Notifications"""
+
+# pylint: disable=no-member
+
+import curses
+from collections import deque
+from threading import Lock
+from time import localtime, monotonic, strftime, time
+from typing import Callable, NamedTuple
+
+from lymia.data import status
+
+from props.workers import wakeup
+
+HISTORY = 1000
+# Shortest time between two visible updates from the same source
+INTERVAL = 0.2
+
+Text = str | Callable[[], str]
+
+
+class Notice(NamedTuple):
+    """A message kept in the history"""
+    when: float
+    source: str
+    text: str
+    level: str
+
+
+class Bus:
+    """Thread-safe channel from background work to the status bar
+
+    Progress is coalesced per source: publishing only stores the latest
+    text (or a callable making it), and the main thread shows at most one
+    update per source every INTERVAL seconds. Final messages go to the
+    history and are shown right away."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._pending: dict[str, tuple[Text, str, bool]] = {}
+        self._shown: dict[str, float] = {}
+        self._history: deque[Notice] = deque(maxlen=HISTORY)
+        self._line = ""
+        self.version = 0
+
+    def publish(self, source: str, text: Text, level: str = "info", final: bool = False):
+        """Report progress or, with final, an outcome worth keeping"""
+        with self._lock:
+            queued = self._pending.get(source)
+            if queued is not None and queued[2] and not final:
+                # Don't let late progress hide an outcome
+                return
+            self._pending[source] = (text, level, final)
+        # Progress repeating what is already shown or queued can wait
+        if final or text != (self._line if queued is None else queued[0]):
+            wakeup.notify()
+
+    @property
+    def waiting(self):
+        """Whether some progress is held back until it is due"""
+        return bool(self._pending)
+
+    def post(self, text: str, level: str = "info", source: str = "app"):
+        """Record a message and show it now (main thread only)"""
+        self._record(Notice(time(), source, text, level))
+        self._line = text
+        status.set(text)
+
+    def _record(self, notice: Notice):
+        with self._lock:
+            self._history.append(notice)
+            self.version += 1
+
+    def drain(self):
+        """Pick up what is due, return the new status line or None (main thread only)"""
+        now = monotonic()
+        due: list[tuple[str, Text, str, bool]] = []
+        with self._lock:
+            for source, (text, level, final) in list(self._pending.items()):
+                if final or now - self._shown.get(source, 0.0) >= INTERVAL:
+                    due.append((source, text, level, final))
+                    del self._pending[source]
+                    self._shown[source] = now
+        line = None
+        for source, text, level, final in due:
+            text = text() if callable(text) else text
+            if final:
+                self._record(Notice(time(), source, text, level))
+            if text and text != self._line:
+                line = self._line = text
+        return line
+
+    def history(self):
+        """Recorded messages, oldest first"""
+        with self._lock:
+            return list(self._history)
+
+
+bus = Bus()
+
+
+def notify(text: str, level: str = "info"):
+    """Show a message on the status bar and keep it in the history"""
+    bus.post(text, level)
+
+
+class HistoryView:
+    """Scroll position of the message history popup"""
+
+    def __init__(self, source: Bus) -> None:
+        self.bus = source
+        # Lines scrolled up from the newest message
+        self.back = 0
+        self.rows = 1
+
+    def handle_key(self, key: int):
+        """Scroll, return False for keys it doesn't know"""
+        count = len(self.bus.history())
+        moves = {
+            curses.KEY_UP: self.back + 1,
+            curses.KEY_DOWN: self.back - 1,
+            curses.KEY_PPAGE: self.back + self.rows,
+            curses.KEY_NPAGE: self.back - self.rows,
+            curses.KEY_HOME: count,
+            curses.KEY_END: 0,
+        }
+        if key not in moves:
+            return False
+        self.back = max(min(moves[key], count - self.rows), 0)
+        return True
+
+    def close(self):
+        """Nothing to release"""
+
+
+def draw_history(screen: curses.window, view: HistoryView):
+    """Draw the message history, newest at the bottom"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    view.rows = max(maxy - 2, 1)
+    notices = view.bus.history()
+    end = len(notices) - view.back
+    shown = notices[max(end - view.rows, 0):end]
+    try:
+        screen.addnstr(0, 2, f" messages ({len(notices)}) | q: close ", max(maxx - 4, 0))
+        for y, notice in enumerate(shown):
+            mark = "!" if notice.level == "error" else " "
+            line = f"{strftime('%H:%M:%S', localtime(notice.when))} {mark} {notice.text}"
+            screen.addnstr(y + 1, 1, line, max(maxx - 2, 0))
+    except curses.error:
+        pass
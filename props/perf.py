@@ -0,0 +1,188 @@
+"""Timing instrumentation"""
+
+# pylint: disable=no-member
+
+import curses
+from collections import deque
+from functools import wraps
+from json import dump
+from os import getpid
+from threading import Lock, get_ident, local
+from time import perf_counter_ns
+from typing import Callable, TypeVar
+
+# Latest samples kept per operation for the percentiles
+SAMPLES = 2048
+MAX_EVENTS = 500_000
+
+F = TypeVar("F", bound=Callable)
+
+
+class Op:
+    """Samples of one operation"""
+
+    __slots__ = ("samples", "count", "calls")
+
+    def __init__(self) -> None:
+        self.samples: deque[int] = deque(maxlen=SAMPLES)
+        self.count = 0
+        self.calls = 0
+
+
+def percentile(ordered: list[int], fraction: float):
+    """Value under which fraction of sorted samples fall"""
+    if not ordered:
+        return 0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class Span:
+    """One timed run of an operation, see Recorder.span"""
+
+    __slots__ = ("recorder", "name", "start", "calls")
+
+    def __init__(self, recorder: "Recorder", name: str) -> None:
+        self.recorder = recorder
+        self.name = name
+        self.start = 0
+        self.calls = 0
+
+    def __enter__(self):
+        self.recorder.stack().append(self)
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *_):
+        end = perf_counter_ns()
+        self.recorder.stack().pop()
+        self.recorder.record(self.name, self.start, end, self.calls)
+
+
+class Recorder:
+    """Latencies and system call counts per operation, optionally traced
+
+    System calls are the ones we issue ourselves (stat, scandir, ...),
+    counted by hand by the code making them through syscalls(), so they
+    are estimates: reading a scandir iterator isn't counted per entry."""
+
+    def __init__(self) -> None:
+        self._ops: dict[str, Op] = {}
+        self._lock = Lock()
+        self._local = local()
+        self._origin = perf_counter_ns()
+        self._events: deque[tuple[str, int, int, int, int]] | None = None
+        self._trace_path = ""
+
+    def stack(self) -> list[Span]:
+        """Spans open on this thread"""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name: str):
+        """Time a block: with recorder.span("list"): ..."""
+        return Span(self, name)
+
+    def timed(self, name: str):
+        """Decorator timing every call of a function"""
+        def decorator(fn: F) -> F:
+            @wraps(fn)
+            def inner(*args, **kwargs):
+                with Span(self, name):
+                    return fn(*args, **kwargs)
+            return inner  # type: ignore
+        return decorator
+
+    def syscalls(self, count: int = 1):
+        """Charge system calls to the innermost span of this thread"""
+        stack = getattr(self._local, "stack", None)
+        if stack:
+            stack[-1].calls += count
+
+    def record(self, name: str, start: int, end: int, calls: int = 0):
+        """Add a sample"""
+        duration = end - start
+        with self._lock:
+            op = self._ops.get(name)
+            if op is None:
+                op = self._ops[name] = Op()
+            op.samples.append(duration)
+            op.count += 1
+            op.calls += calls
+            if self._events is not None:
+                self._events.append((name, start, duration, get_ident(), calls))
+
+    def summary(self):
+        """(name, count, p50, p95, p99, max, syscalls per run) of every operation, in ns"""
+        with self._lock:
+            ops = [(name, op.count, op.calls, sorted(op.samples))
+                   for name, op in sorted(self._ops.items())]
+        return [(name, count, percentile(ordered, 0.5), percentile(ordered, 0.95),
+                 percentile(ordered, 0.99), ordered[-1] if ordered else 0, calls / max(count, 1))
+                for name, count, calls, ordered in ops]
+
+    def reset(self):
+        """Forget every sample"""
+        with self._lock:
+            self._ops.clear()
+
+    @property
+    def tracing(self):
+        """Path of the trace being recorded, empty if none"""
+        return self._trace_path
+
+    def start_trace(self, path: str):
+        """Record every span until stop_trace"""
+        with self._lock:
+            self._events = deque(maxlen=MAX_EVENTS)
+            self._trace_path = path
+
+    def stop_trace(self):
+        """Write the trace as Chrome trace JSON (chrome://tracing, Perfetto), return its path"""
+        with self._lock:
+            events, path = self._events, self._trace_path
+            self._events = None
+            self._trace_path = ""
+        if events is None:
+            return ""
+        pid = getpid()
+        trace = [{
+            "name": name, "ph": "X", "pid": pid, "tid": tid,
+            "ts": (start - self._origin) / 1000, "dur": duration / 1000,
+            "args": {"syscalls": calls},
+        } for name, start, duration, tid, calls in events]
+        with open(path, "w", encoding="utf-8") as file:
+            dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+        return path
+
+
+recorder = Recorder()
+span = recorder.span
+timed = recorder.timed
+syscalls = recorder.syscalls
+
+
+def _ms(ns: float):
+    return f"{ns / 1e6:.2f}"
+
+
+def draw_stats(screen: curses.window, source: Recorder):
+    """Draw latency percentiles and estimated system calls per operation"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    width = max(maxx - 2, 0)
+    header = f"{'operation':<16}{'count':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'~sys/op':>8}"
+    trace = f", tracing to {source.tracing}" if source.tracing else ""
+    try:
+        screen.addnstr(0, 2, f" stats, system calls are estimates{trace} ", max(maxx - 4, 0))
+        screen.addnstr(1, 1, header, width, curses.A_BOLD)
+        for y, (name, count, p50, p95, p99, worst, calls) in enumerate(source.summary(), 2):
+            if y >= maxy - 1:
+                break
+            line = (f"{name[:15]:<16}{count:>9}{_ms(p50):>9}{_ms(p95):>9}{_ms(p99):>9}"
+                    f"{_ms(worst):>9}{calls:>8.1f}")
+            screen.addnstr(y, 1, line, width)
+    except curses.error:
+        pass
@@ -0,0 +1,135 @@
+"""Content scanning for props.grep and props.dupes, run inside worker processes
+
+Only the standard library is imported, so workers start quickly."""
+
+import mmap
+import re
+from hashlib import blake2b
+from os import O_NONBLOCK, O_RDONLY, close, fstat, lseek, open as os_open, readv, SEEK_SET
+from stat import S_ISREG
+
+SNIFF = 8192
+MAX_TEXT = 512
+MAX_PER_FILE = 1000
+# Partial digests cover the first and the last EDGE bytes
+EDGE = 4096
+HASH_CHUNK = 1024 * 1024
+DIGEST_SIZE = 16
+
+# What scan_file made of a file
+TEXT = 0
+BINARY = 1
+LARGE = 2
+SPECIAL = 3
+
+Hit = tuple[str, int, int, str]
+
+
+def search(view: mmap.mmap, regex: re.Pattern, path: str):
+    """Matching lines of a mapped file as (path, line, line offset, text)
+
+    Newlines are only counted between hits and nothing is decoded but
+    the hit lines themselves."""
+    hits: list[Hit] = []
+    size = len(view)
+    line = 1
+    counted = 0
+    pos = 0
+    while pos < size and len(hits) < MAX_PER_FILE:
+        match = regex.search(view, pos)
+        if match is None:
+            break
+        start = view.rfind(b"\n", 0, match.start()) + 1
+        if start >= size:
+            # An empty match after the final newline, past the last line
+            break
+        end = view.find(b"\n", match.start())
+        if end < 0:
+            end = size
+        line += view[counted:start].count(b"\n")
+        counted = start
+        text = view[start:min(end, start + MAX_TEXT * 4)].decode("utf-8", "replace")
+        hits.append((path, line, start, text.rstrip("\r")[:MAX_TEXT]))
+        pos = end + 1
+    return hits
+
+
+def scan_file(path: str, regex: re.Pattern, limit: int) -> tuple[int, list[Hit]]:
+    """Kind of a file and its hits, binary and larger than limit are skipped"""
+    # O_NONBLOCK: a file swapped for a fifo since it was listed must not hang us
+    fd = os_open(path, O_RDONLY | O_NONBLOCK)
+    try:
+        st = fstat(fd)
+        if not S_ISREG(st.st_mode):
+            return SPECIAL, []
+        if st.st_size > limit:
+            return LARGE, []
+        if st.st_size == 0:
+            return TEXT, []
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as view:
+            if view.find(b"\0", 0, SNIFF) >= 0:
+                return BINARY, []
+            view.madvise(mmap.MADV_SEQUENTIAL)
+            return TEXT, search(view, regex, path)
+    finally:
+        close(fd)
+
+
+def scan(paths: list[str], pattern: bytes, flags: int, limit: int):
+    """Search a batch of files, return hits and (scanned, binary, large, errors)"""
+    regex = re.compile(pattern, flags)
+    hits: list[Hit] = []
+    counts = [0, 0, 0, 0]
+    for path in paths:
+        try:
+            kind, found = scan_file(path, regex, limit)
+        except (OSError, ValueError):
+            counts[3] += 1
+            continue
+        if kind == TEXT:
+            counts[0] += 1
+            hits.extend(found)
+        elif kind == BINARY:
+            counts[1] += 1
+        elif kind == LARGE:
+            counts[2] += 1
+    return hits, tuple(counts)
+
+
+def digest(path: str, size: int, mtime: int, partial: bool):
+    """blake2b of a file, or of its first and last EDGE bytes when partial
+
+    Files no longer matching size and mtime yield None. Up to 2 * EDGE
+    bytes a partial digest covers the whole file."""
+    fd = os_open(path, O_RDONLY | O_NONBLOCK)
+    try:
+        st = fstat(fd)
+        if not S_ISREG(st.st_mode) or st.st_size != size or st.st_mtime_ns != mtime:
+            return None
+        hasher = blake2b(digest_size=DIGEST_SIZE)
+        buffer = bytearray(EDGE if partial else HASH_CHUNK)
+        view = memoryview(buffer)
+        if partial:
+            hasher.update(view[:readv(fd, [buffer])])
+            if size > EDGE:
+                lseek(fd, max(size - EDGE, EDGE), SEEK_SET)
+                hasher.update(view[:readv(fd, [buffer])])
+            return hasher.digest()
+        while True:
+            count = readv(fd, [buffer])
+            if not count:
+                return hasher.digest()
+            hasher.update(view[:count])
+    finally:
+        close(fd)
+
+
+def digests(files: list[tuple[str, int, int]], partial: bool):
+    """Digests of (path, size, mtime) files, None for those that failed or changed"""
+    found: list[bytes | None] = []
+    for path, size, mtime in files:
+        try:
+            found.append(digest(path, size, mtime, partial))
+        except OSError:
+            found.append(None)
+    return found
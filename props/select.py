@@ -0,0 +1,158 @@
+"""Multi-selection of a tab's entries
+
+Selections are bitsets over a Listing's indices, one bit per entry.
+Bulk changes (all, invert, glob) go through a big int so that they run
+in C; single entries are flipped in place."""
+
+import re
+from fnmatch import translate
+from itertools import compress, repeat
+from operator import contains
+
+from props.utils import Listing
+
+# bytes of 0 and 1 to and from the digits int() and format() work with
+DIGITS = bytes.maketrans(b"\0\1", b"01")
+FLAGS = bytes.maketrans(b"01", b"\0\1")
+GLOB = frozenset("*?[")
+# Past this many names, rebuilding the bitset beats looking each one up
+FEW = 1024
+
+
+def pack(flags: bytes):
+    """Bitset of a byte per entry, 0 or 1"""
+    if not flags:
+        return bytearray()
+    value = int(flags.translate(DIGITS)[::-1], 2)
+    return bytearray(value.to_bytes((len(flags) + 7) // 8, "little"))
+
+
+def unpack(bits: bytearray, count: int):
+    """A byte per entry, 0 or 1, of a bitset"""
+    if not count:
+        return b""
+    value = int.from_bytes(bits, "little")
+    return format(value, f"0{count}b")[::-1].encode().translate(FLAGS)
+
+
+def matcher(pattern: str):
+    """Whether each name matches a glob, through str methods where the glob allows"""
+    body = pattern.strip("*")
+    if body and not GLOB & set(body):
+        if pattern == f"*{body}*":
+            return lambda names: map(contains, names, repeat(body))
+        if pattern == f"*{body}":
+            return lambda names: map(str.endswith, names, repeat(body))
+        if pattern == f"{body}*":
+            return lambda names: map(str.startswith, names, repeat(body))
+    match = re.compile(translate(pattern)).match
+    return lambda names: map(bool, map(match, names))
+
+
+class Selection:
+    """Selected entries of a listing, kept by name across relistings"""
+
+    def __init__(self) -> None:
+        self.listing: Listing | None = None
+        self.cwd = ""
+        # Directory.version the bits were laid out for
+        self.stamp = -1
+        # Listing.version too, in case the entries moved without a follow
+        self._listed = -1
+        self.bits = bytearray()
+        self.count = 0
+        # Bumped on every change, for redraws
+        self.version = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, index: int):
+        return index >> 3 < len(self.bits) and bool(self.bits[index >> 3] >> (index & 7) & 1)
+
+    def _valid(self):
+        """Whether the bits still line up with the listing's entries"""
+        listing = self.listing
+        return (listing is not None and listing.version == self._listed
+                and len(self.bits) == (len(listing) + 7) // 8)
+
+    def _value(self):
+        return int.from_bytes(self.bits, "little")
+
+    def _store(self, value: int):
+        size = len(self.bits)
+        self.bits = bytearray(value.to_bytes(size, "little"))
+        self.count = value.bit_count()
+        self.version += 1
+
+    def _mask(self):
+        listing = self.listing
+        return (1 << (len(listing) if listing is not None else 0)) - 1
+
+    def follow(self, cwd: str, listing: Listing, version: int, names: list[str] | None = None):
+        """Move the selection onto the listing of cwd at version, by name
+
+        names are selected instead of what was, for listings changed in
+        place. Another directory starts with nothing selected."""
+        if names is None:
+            if listing is self.listing and version == self.stamp:
+                return
+            names = self.names() if cwd == self.cwd else []
+        self.cwd = cwd
+        self.listing = listing
+        self.stamp = version
+        self._listed = listing.version
+        self.bits = bytearray((len(listing) + 7) // 8)
+        if len(names) > FEW:
+            wanted = set(names)
+            self.bits = pack(bytes(map(wanted.__contains__, listing.names)))
+        else:
+            for name in names:
+                index = listing.find(name)
+                if index >= 0:
+                    self.bits[index >> 3] |= 1 << (index & 7)
+        self.count = self._value().bit_count() if names else 0
+        self.version += 1
+
+    def toggle(self, index: int):
+        """Flip one entry"""
+        if not 0 <= index >> 3 < len(self.bits):
+            return
+        mask = 1 << (index & 7)
+        self.bits[index >> 3] ^= mask
+        self.count += 1 if self.bits[index >> 3] & mask else -1
+        self.version += 1
+
+    def clear(self):
+        """Select nothing"""
+        self._store(0)
+
+    def all(self):
+        """Select everything"""
+        self._store(self._mask())
+
+    def invert(self):
+        """Select what isn't, and only that"""
+        self._store(self._value() ^ self._mask())
+
+    def glob(self, pattern: str, selected: bool = True):
+        """Select, or deselect, the names matching a glob"""
+        if self.listing is None:
+            return 0
+        matched = pack(bytes(matcher(pattern)(self.listing.names)))
+        value = int.from_bytes(matched, "little")
+        self._store(self._value() | value if selected else self._value() & ~value)
+        return value.bit_count()
+
+    def indices(self):
+        """Listing indices of the selected entries"""
+        if not self.count or not self._valid():
+            return []
+        return list(compress(range(len(self.listing)), unpack(self.bits, len(self.listing))))
+
+    def names(self):
+        """Names of the selected entries"""
+        if self.listing is None:
+            return []
+        names = self.listing.names
+        return [names[index] for index in self.indices()]
@@ -0,0 +1,231 @@
+"""Binary session snapshot, so restarts paint their tabs without relisting them
+
+The file holds every tab (directory, cursor, sort order, flags and cursor
+history) and, optionally, the listing each tab was showing together with
+the (st_dev, st_ino, st_mtime_ns) it was read at. A saved listing is only
+reused while its directory's mtime is unchanged."""
+
+import struct
+import sys
+from array import array
+from os import replace, stat
+from pathlib import Path
+from typing import NamedTuple
+
+from props.cache import listing_cache
+from props.perf import syscalls, timed
+from props.ui.tabs import TabState
+from props.utils import Listing
+
+MAGIC = b"ELYS"
+VERSION = 1
+# Bigger listings are quicker to read again than to save and load
+MAX_ENTRIES = 100_000
+
+HEADER = struct.Struct("<4sHII")  # magic, version, active tab, tab count
+TAB = struct.Struct("<qBI")  # cursor, flags, cursor history length
+CURSOR = struct.Struct("<q")
+LISTING = struct.Struct("<QQqqII")  # dev, ino, mtime, stamp, entries, name bytes
+SIZE = struct.Struct("<I")
+
+F_WATCH = 1
+F_LONG = 2
+F_DU = 4
+F_LISTING = 8
+
+
+class Snapshot(NamedTuple):
+    """A listing and the directory it was read from"""
+    dev: int
+    ino: int
+    mtime: int
+    stamp: int
+    listing: Listing
+
+
+class SavedTab(NamedTuple):
+    """A tab as it was when the session ended"""
+    cwd: str
+    cursor: int
+    sort: str
+    watch: bool
+    long: bool
+    du: bool
+    history: list[tuple[str, int]]
+    snapshot: Snapshot | None
+
+
+class Writer:
+    """Append-only buffer of packed values"""
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def pack(self, layout: struct.Struct, *values):
+        """Append packed values"""
+        self.data += layout.pack(*values)
+
+    def blob(self, raw: bytes):
+        """Append bytes prefixed by their length"""
+        self.pack(SIZE, len(raw))
+        self.data += raw
+
+    def text(self, value: str):
+        """Append a string, file names that aren't valid UTF-8 included"""
+        self.blob(value.encode("utf-8", "surrogateescape"))
+
+
+class Reader:
+    """Cursor over a snapshot, raising ValueError past its end"""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size: int):
+        """Next size bytes"""
+        end = self.offset + size
+        if end > len(self.data):
+            raise ValueError("truncated session")
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, layout: struct.Struct):
+        """Next packed values"""
+        return layout.unpack(self.take(layout.size))
+
+    def blob(self):
+        """Next length-prefixed bytes"""
+        return self.take(self.unpack(SIZE)[0])
+
+    def text(self):
+        """Next string"""
+        return bytes(self.blob()).decode("utf-8", "surrogateescape")
+
+
+def native(column: array):
+    """Column in little-endian order, the way it is stored"""
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def capture(state: TabState):
+    """Snapshot of a tab's listing, None unless the listing cache vouches for it
+
+    Only a listing that is still the cached one for the directory's
+    current mtime is known to be complete and up to date."""
+    content = state.content
+    listing = content.listing
+    if not state.loaded or content.loading or len(listing) > MAX_ENTRIES:
+        return None
+    try:
+        syscalls()
+        st = stat(content.cwd)
+    except OSError:
+        return None
+    entry = listing_cache.entry(st)
+    if entry is None or entry.listing is not listing:
+        return None
+    return Snapshot(st.st_dev, st.st_ino, entry.mtime, entry.stamp, listing)
+
+
+def name_cursor(state: TabState):
+    """Cursor as an index in name order, which is how listings are saved"""
+    if not state.loaded:
+        return state.pending_cursor
+    try:
+        return state.content.listing.find(state.content.name(state.menu.cursor))
+    except IndexError:
+        return -1
+
+
+def write_listing(out: Writer, snapshot: Snapshot):
+    """Append a listing column by column"""
+    listing = snapshot.listing
+    names = "\0".join(listing.names).encode("utf-8", "surrogateescape")
+    out.pack(LISTING, snapshot.dev, snapshot.ino, snapshot.mtime, snapshot.stamp,
+             len(listing), len(names))
+    out.data += names
+    out.data += listing.types.tobytes()
+    out.data += native(listing.inodes).tobytes()
+
+
+def read_listing(data: Reader):
+    """Read back a listing written by write_listing"""
+    dev, ino, mtime, stamp, count, size = data.unpack(LISTING)
+    listing = Listing()
+    names = bytes(data.take(size)).decode("utf-8", "surrogateescape")
+    listing.names = names.split("\0") if count else []
+    listing.types = array("B", data.take(count))
+    listing.inodes = native(array("Q", data.take(count * listing.inodes.itemsize)))
+    if len(listing.names) != count:
+        raise ValueError("corrupted listing")
+    return Snapshot(dev, ino, mtime, stamp, listing)
+
+
+@timed("session")
+def save(path: Path, states: list[TabState], active: int, listings: bool = True):
+    """Write the session, with the tabs' listings unless listings is False"""
+    out = Writer()
+    out.pack(HEADER, MAGIC, VERSION, active, len(states))
+    for state in states:
+        snapshot = capture(state) if listings else None
+        flags = ((F_WATCH if state.watch else 0) | (F_LONG if state.long else 0)
+                 | (F_DU if state.du else 0) | (F_LISTING if snapshot else 0))
+        out.text(state.cwd)
+        out.text(state.sort)
+        out.pack(TAB, name_cursor(state), flags, len(state.cursor_history))
+        for item in state.cursor_history:
+            out.text(str(item.path))
+            out.pack(CURSOR, item.cursor)
+        if snapshot is not None:
+            write_listing(out, snapshot)
+    # Written aside first, a crash mid-write must not leave half a session
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.write_bytes(out.data)
+    replace(temporary, path)
+
+
+@timed("session")
+def load(path: Path):
+    """Active tab index and saved tabs, None without a usable session"""
+    try:
+        data = Reader(path.read_bytes())
+        magic, version, active, count = data.unpack(HEADER)
+        if magic != MAGIC or version != VERSION:
+            return None
+        tabs: list[SavedTab] = []
+        for _ in range(count):
+            cwd = data.text()
+            sort = data.text()
+            cursor, flags, length = data.unpack(TAB)
+            history = []
+            for _ in range(length):
+                history.append((data.text(), data.unpack(CURSOR)[0]))
+            snapshot = read_listing(data) if flags & F_LISTING else None
+            tabs.append(SavedTab(cwd, cursor, sort, bool(flags & F_WATCH), bool(flags & F_LONG),
+                                 bool(flags & F_DU), history, snapshot))
+    except (OSError, ValueError, struct.error):
+        return None
+    return active, tabs
+
+
+def warm(tab: SavedTab):
+    """Hand a saved listing to the listing cache if its directory is unchanged
+
+    Listing the tab then finds it there and publishes it right away."""
+    snapshot = tab.snapshot
+    if snapshot is None:
+        return False
+    try:
+        syscalls()
+        st = stat(tab.cwd)
+    except OSError:
+        return False
+    if (st.st_dev, st.st_ino, st.st_mtime_ns) != (snapshot.dev, snapshot.ino, snapshot.mtime):
+        return False
+    listing_cache.put(tab.cwd, st, snapshot.listing, snapshot.stamp)
+    return True
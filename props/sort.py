@@ -0,0 +1,149 @@
+"""Sort orders for directory listings"""
+
+import re
+from array import array
+from os import lstat
+from os.path import join, splitext
+from typing import Any, Sequence
+
+from props.perf import syscalls, timed
+from props.utils import KEYERS, T_DIR, Listing
+from props.workers import pool, wakeup
+
+ORDERS = ("name", "size", "mtime", "ext", "type")
+# Orders whose keys need a stat per entry, computed in the background
+STAT_ORDERS = ("size", "mtime")
+PENDING = "stat"
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def parse(spec: str):
+    """Split a sort spec like "-size" into its order and reverse flag"""
+    reverse = spec.startswith("-")
+    order = spec[1:] if reverse else spec
+    if order and order not in ORDERS:
+        raise ValueError(f"Unknown sort order: {order}")
+    return order, reverse
+
+
+def natural(name: str):
+    """Case-insensitive key that orders digit runs by their value"""
+    parts: list[Any] = _DIGITS.split(name.casefold())
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
+
+def _stat(path: str, name: str):
+    syscalls()
+    try:
+        return lstat(join(path, name))
+    except OSError:
+        return None
+
+
+def _size_key(path: str, name: str, _: int):
+    st = _stat(path, name)
+    return st.st_size if st is not None else -1
+
+
+def _mtime_key(path: str, name: str, _: int):
+    st = _stat(path, name)
+    return st.st_mtime_ns if st is not None else 0
+
+
+# What Listing.insert computes for entries added to an already keyed listing
+KEYERS.update(
+    name=lambda _, name, __: natural(name),
+    ext=lambda _, name, __: (splitext(name)[1].casefold(), natural(name)),
+    type=lambda _, name, code: (code != T_DIR, natural(name)),
+    size=_size_key,
+    mtime=_mtime_key,
+)
+
+
+def _natural_keys(listing: Listing):
+    keys = listing.keys.get("name")
+    if keys is None:
+        keys = listing.keys["name"] = [natural(name) for name in listing.names]
+    return keys
+
+
+@timed("sort.stat")
+def stat_keys(path: str, names: list[str]):
+    """Size and mtime keys of names in path (runs in a worker)"""
+    syscalls(len(names))
+    sizes = array("q")
+    mtimes = array("q")
+    for name in names:
+        try:
+            st = lstat(join(path, name))
+        except OSError:
+            sizes.append(-1)
+            mtimes.append(0)
+            continue
+        sizes.append(st.st_size)
+        mtimes.append(st.st_mtime_ns)
+    return sizes, mtimes
+
+
+def _stat_job(path: str, names: list[str]):
+    try:
+        return stat_keys(path, names)
+    finally:
+        wakeup.notify()
+
+
+def _install(listing: Listing):
+    """Take in the keys a finished stat job computed, unless the listing changed since
+
+    Only the main thread touches listing.keys; workers hand their keys
+    back through the job's future, tagged with the version they read."""
+    pending = listing.keys.get(PENDING)
+    if pending is None or not pending[1].done():
+        return
+    del listing.keys[PENDING]
+    version, future = pending
+    try:
+        sizes, mtimes = future.result()
+    except Exception:  # pylint: disable=broad-exception-caught
+        return
+    if version == listing.version:
+        listing.keys["size"] = sizes
+        listing.keys["mtime"] = mtimes
+
+
+def request_stat_keys(path: str, listing: Listing):
+    """Compute stat keys of listing in the background, once"""
+    _install(listing)
+    if PENDING in listing.keys:
+        return
+    # Entry changes drop it with the other columns, its keys would be stale anyway
+    listing.keys[PENDING] = (listing.version, pool.submit(_stat_job, path, listing.names[:]))
+
+
+def keys_for(listing: Listing, order: str) -> Sequence | None:
+    """Sort keys of listing for order, None if they aren't computed yet"""
+    if order in STAT_ORDERS:
+        _install(listing)
+        keys = listing.keys.get(order)
+        return keys if keys is not None and len(keys) == len(listing) else None
+    names = _natural_keys(listing)
+    if order == "name":
+        return names
+    keys = listing.keys.get(order)
+    if keys is not None:
+        return keys
+    if order == "ext":
+        keys = [(splitext(name)[1].casefold(), key)
+                for name, key in zip(listing.names, names)]
+    else:
+        keys = [(code != T_DIR, key) for code, key in zip(listing.types, names)]
+    listing.keys[order] = keys
+    return keys
+
+
+def argsort(keys: Sequence, reverse: bool = False):
+    """Permutation that sorts keys; ties keep their name order"""
+    order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+    return array("I", order)
@@ -1,15 +1,31 @@
 """Global Window State"""
+from os import scandir
 from pathlib import Path
 from posixpath import basename
-from typing import Callable
+from time import monotonic
+from typing import TYPE_CHECKING, Callable
 from lymia.data import status
 from lymia.panel import Panel
 from lymia.menu import  Menu
-from props.ui.tabs import TabState, draw_tab
+from props.cache import listing_cache
+from props.session import SavedTab, warm
+from props.ui.tabs import DEFAULT_TAB_BUDGET, CursorHistory, TabState, draw_tab, footprint, hibernate
 from props.utils import Directory
+from props.find import parse_size
+from props.notifications import HistoryView, notify
+from props.viewer import Viewer
+from props.workers import Token, load_directory
 
 from .colors import fmt, Basic
 
+if TYPE_CHECKING:
+    # Loaded with the commands that open them, they pull in heavy modules
+    from props.compare import CompareView
+    from props.dupes import DupesView
+    from props.grep import GrepView
+
+    Focus = Viewer | HistoryView | GrepView | DupesView | CompareView
+
 class WindowState:
     """Window state to manage panels and tab states"""
 
@@ -20,7 +36,12 @@ class WindowState:
         self._trig: list[Callable[[int], None]] = []
         self._active = 0
         self._popup: list[Panel] = []
+        self._popup_jobs: list[Token] = []
+        # Popup taking the keys: a file viewer, the message history or results
+        self._focus: "Focus | None" = None
         self._kv: dict[str, str] = {}
+        # Yes/no question waiting for a key, with what to do on yes
+        self._question: tuple[str, Callable[[], None]] | None = None
 
     @property
     def settings(self):
@@ -32,9 +53,58 @@ class WindowState:
         """Popup panel"""
         return self._popup
 
+    @property
+    def focus(self):
+        """Popup taking the keys, if one is open"""
+        return self._focus
+
+    @property
+    def viewer(self):
+        """File viewer, if one is open"""
+        return self._focus if isinstance(self._focus, Viewer) else None
+
     def reset_popup(self):
         """Reset popup to None"""
         self._popup.clear()
+        for token in self._popup_jobs:
+            token.cancel()
+        self._popup_jobs.clear()
+        if self._focus is not None:
+            self._focus.close()
+            self._focus = None
+
+    def open_popup(self, panel: Panel, token: Token | None = None):
+        """Show a popup, cancelling token's job once the popup is closed"""
+        self._popup.append(panel)
+        if token is not None:
+            self._popup_jobs.append(token)
+
+    def open_focus(self, panel: Panel, focus: "Focus", token: Token | None = None):
+        """Show a popup taking the keys, replacing any popup"""
+        self.reset_popup()
+        self._focus = focus
+        self.open_popup(panel, token)
+
+    def open_viewer(self, panel: Panel, viewer: Viewer):
+        """Show a file viewer, replacing any popup"""
+        self.open_focus(panel, viewer, viewer.index.start())
+
+    @property
+    def question(self):
+        """Yes/no question waiting for an answer, if any"""
+        return self._question[0] if self._question is not None else None
+
+    def ask(self, question: str, action: Callable[[], None]):
+        """Ask a yes/no question on the status bar, running action on yes"""
+        self._question = (f"{question} (y/n)", action)
+        status.set(self._question[0])
+
+    def answer(self, yes: bool):
+        """Settle the pending question"""
+        question, self._question = self._question, None
+        status.set("")
+        if yes and question is not None:
+            question[1]()
 
     @property
     def winsize(self):
@@ -74,6 +144,8 @@ class WindowState:
         if value < 0:
             return
         self._active = value
+        self.tab_states[value].used = monotonic()
+        self.materialize(value)
 
         for trig in self._trig:
             trig(value)
@@ -93,15 +165,23 @@ class WindowState:
         """Return tab views"""
         return basename(self.tab_states[index].cwd) or '/', lambda: None
 
-    def start_files_view(self, path: str, size: tuple[int, int] = (-1, -1)):
-        """Generate file manager view"""
+    def start_files_view(self, path: str, size: tuple[int, int] = (-1, -1), lazy: bool = False):
+        """Generate file manager view
+
+        Lazy views are placeholders that list their directory once they get
+        activated or prefetched, and don't steal the active tab."""
         if size == (-1, -1):
             size = self.winsize
         path = str(Path(path).expanduser())
+        directory = Directory(path, fmt, load=False)
         try:
-            directory = Directory(path, fmt)
-        except (FileNotFoundError, PermissionError) as exc:
-            status.set(f"{type(exc).__name__}: {str(exc)}")
+            if lazy:
+                # Not listed yet, but a directory that can't be opened still isn't a tab
+                scandir(path).close()
+            else:
+                load_directory(directory, path)
+        except (FileNotFoundError, PermissionError, NotADirectoryError) as exc:
+            notify(f"{type(exc).__name__}: {str(exc)}", "error")
             return 0, 0
         state = TabState(
             path,
@@ -109,13 +189,111 @@ class WindowState:
                  Basic.SELECTED, (1, 2), 1, count=lambda: len(directory)),
             directory,  # type: ignore,
             [],
+            watch=self.settings.get("watch", "off") == "on",
+            long=self.settings.get("long", "off") == "on",
+            loaded=not lazy,
+            sort=self.settings.get("sort", ""),
         )
         panel = Panel(size[0] - 2, size[1], 1, 0, draw_tab, state)
         self.panels.append(panel)
         self.tab_states.append(state)
-        self.active = len(self.tab_states) - 1
+        if not lazy:
+            self.active = len(self.tab_states) - 1
         return panel, state
 
+    def restore_session(self, active: int, tabs: list[SavedTab], cwd: str,
+                        size: tuple[int, int] = (-1, -1)):
+        """Reopen the tabs of a saved session, the first one following cwd
+
+        Returns the index of the tab to activate, -1 if none could be opened."""
+        restored = -1
+        for index, saved in enumerate(tabs):
+            if index == 0 and saved.cwd != cwd:
+                saved = saved._replace(cwd=cwd, cursor=-1, history=[], snapshot=None)
+            warm(saved)
+            state = self.start_files_view(saved.cwd, size, lazy=index != active)[1]
+            if not state:
+                continue
+            state.sort = saved.sort
+            state.watch = saved.watch
+            state.long = saved.long
+            state.du = saved.du
+            state.cursor_history = [CursorHistory(path, cursor) for path, cursor in saved.history]
+            state.pending_cursor = saved.cursor
+            if index == active or restored < 0:
+                restored = len(self.tab_states) - 1
+        return restored
+
+    def materialize(self, index: int | None = None):
+        """List the directory of a placeholder tab"""
+        state = self.fetch(index)[1]
+        if state.loaded:
+            return True
+        state.loaded = True
+        try:
+            load_directory(state.content, state.cwd)
+        except (FileNotFoundError, PermissionError, NotADirectoryError) as exc:
+            notify(f"{type(exc).__name__}: {str(exc)}", "error")
+            return False
+        return True
+
+    def prefetch(self):
+        """Start listing every placeholder tab in the background"""
+        for index, state in enumerate(self.tab_states):
+            if not state.loaded:
+                self.materialize(index)
+
+    @property
+    def tab_budget(self):
+        """Memory budget of the tabs in bytes, from the tab_budget setting"""
+        try:
+            return parse_size(str(self.settings.get("tab_budget", DEFAULT_TAB_BUDGET)))
+        except ValueError:
+            return DEFAULT_TAB_BUDGET
+
+    def footprints(self):
+        """Rough bytes each tab alone holds on to, and bytes of listings tabs share
+
+        A listing held by several tabs is counted once, as shared, and one
+        held by the listing cache isn't counted: the cache has its own
+        budget. So hibernating a tab frees about its own size."""
+        cached = listing_cache.listings()
+        holders: dict[int, int] = {}
+        for state in self.tab_states:
+            holders[id(state.content.listing)] = holders.get(id(state.content.listing), 0) + 1
+        sizes: list[int] = []
+        shared: dict[int, int] = {}
+        for state in self.tab_states:
+            listing = state.content.listing
+            owned = holders[id(listing)] == 1 and id(listing) not in cached
+            if not owned and id(listing) not in cached:
+                shared[id(listing)] = listing.nbytes()
+            sizes.append(footprint(state, owned))
+        return sizes, sum(shared.values())
+
+    def enforce_budget(self):
+        """Hibernate the least recently used tabs until the rest fit the budget
+
+        The active tab and tabs with a selection are never hibernated.
+        Returns how many tabs were."""
+        sizes, shared = self.footprints()
+        total = sum(sizes) + shared
+        budget = self.tab_budget
+        if total <= budget:
+            return 0
+        states = self.tab_states
+        hibernated = 0
+        for index in sorted(range(len(states)), key=lambda index: states[index].used):
+            if total <= budget:
+                break
+            state = states[index]
+            if index == self._active or not state.loaded or state.selection:
+                continue
+            hibernate(state)
+            total -= sizes[index]
+            hibernated += 1
+        return hibernated
+
     def pop_files_view(self, index: int | None = None):
         """Pop files view"""
         pop_index = 0
@@ -128,18 +306,14 @@ class WindowState:
         self._tab_states.pop(pop_index)
         self.active = index
 
-    def move_right(self, index: int):
-        """Switch file view"""
-        if index >= len(self.tab_states) - 1:
-            self._active = 0
-            return 'first'
-        self._active += 1
-        return 'right'
-
-    def move_left(self, index: int):
-        """Switch file view"""
-        if index <= 0:
-            self._active = len(self._panels) - 1
-            return 'last'
-        self._active -= 1
-        return 'left'
+    def reload(self, paths: tuple[str, ...]):
+        """Relist tabs showing one of paths, keeping their cursor position"""
+        for state in self.tab_states:
+            if not state.loaded or state.content.cwd not in paths:
+                continue
+            cursor = state.menu.cursor
+            try:
+                load_directory(state.content, state.content.cwd)
+            except OSError:
+                continue
+            state.pending_cursor = cursor
@@ -1,16 +1,32 @@
 """VIM-like command"""
 import curses
+import re
+from collections import deque
 from pathlib import Path
 from shlex import split
 from os import environ
-from subprocess import call
-from typing import Callable
-from lymia.data import ReturnType, status
+from typing import TYPE_CHECKING, Callable
+from lymia.data import ReturnType
 from lymia.forms import Text
 from lymia.panel import Panel
 from lymia.utils import hide_system
-from props.files import change_dir, get_editor, open_file as fs_open
+from props.files import change_dir, cursor_path, get_editor, open_file as fs_open, view_file
+from props.find import draw_results, find as start_find, parse_size
+from props.cache import listing_cache
+from props.jobs import (Job, copy as copy_job, copy_all, delete as delete_job, human_size, jobs,
+                        move as move_job, move_all, remove_files, sync, trash)
+from props.notifications import HistoryView, bus, draw_history, notify
+from props.perf import draw_stats, recorder, timed
+from props.sort import ORDERS, parse
 from props.state import WindowState
+from props.ui.tabs import apply_selection, selected_paths
+from props.watch import watcher
+
+if TYPE_CHECKING:
+    # Imported by their commands instead: tarfile, lzma, zipfile, multiprocessing...
+    from props.compare import Comparison
+    from props.dupes import DupesView
+    from props.grep import GrepResults
 
 class Command:
     """Commands"""
@@ -64,6 +80,7 @@ class Command:
         """buffer form"""
         return self._buffer
 
+    @timed("command")
     def call(self) -> ReturnType:
         """Call appropriate function"""
         args = split(self._buffer.value)
@@ -74,7 +91,7 @@ class Command:
             return ReturnType.CONTINUE
         if not fn:
             try:
-                status.set(f"Command {base} is not found")
+                notify(f"Command {base} is not found", "error")
                 return ReturnType.ERR
             except IndexError:
                 return ReturnType.CONTINUE
@@ -92,12 +109,52 @@ def show_help(screen: curses.window, _):
             hs = "(undocumented)"
         screen.addstr(index + 1, 1, f"[{cmd}] -> {hs}{alias_str}")
 
+def show_jobs(screen: curses.window, _):
+    """Show jobs"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    for index, job in enumerate(jobs.jobs[-(maxy - 2):]):
+        try:
+            screen.addnstr(index + 1, 1, job.progress(), max(maxx - 2, 0))
+        except curses.error:
+            pass
+
 def show_config(screen: curses.window, state: dict[str, str]):
     """Show config"""
     screen.box()
     for index, (key, value) in enumerate(state.items()):
         screen.addstr(index + 1, 1, f"{key} = {value!r}")
 
+def draw_memory(screen: curses.window, state: WindowState):
+    """Show what each tab holds on to against the tab budget"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    width = max(maxx - 2, 0)
+    sizes, shared = state.footprints()
+    header = (f" memory: tabs {human_size(sum(sizes) + shared)} of {human_size(state.tab_budget)}"
+              f" ({human_size(shared)} shared), "
+              f"listing cache {human_size(listing_cache.used)} of {human_size(listing_cache.budget)} ")
+    try:
+        screen.addnstr(0, 2, header, max(maxx - 4, 0))
+        screen.addnstr(1, 1, f"{'tab':>4} {'state':<8}{'entries':>9}{'own':>12}  directory",
+                       width, curses.A_BOLD)
+        for y, (index, tab) in enumerate(enumerate(state.tab_states), 2):
+            if y >= maxy - 1:
+                break
+            if index == state.active:
+                status = "active"
+            elif not tab.loaded:
+                status = "asleep"
+            else:
+                status = "loading" if tab.content.loading else "loaded"
+            line = (f"{index + 1:>4} {status:<8}{len(tab.content.listing):>9}"
+                    f"{human_size(sizes[index]):>12}  {tab.cwd}")
+            screen.addnstr(y, 1, line, width)
+    except curses.error:
+        pass
+
 
 command = Command()
 
@@ -112,6 +169,7 @@ def q(_, state: WindowState, *__):
 @command.add_command("term", "terminal")
 def term(screen: curses.window, *_):
     """Switch to terminal"""
+    from subprocess import call  # pylint: disable=import-outside-toplevel
     with hide_system(screen):
         ret = call(environ.get('SHELL', '/bin/sh'))
         input(f"\n[Return code {ret}] Press enter to return")
@@ -126,7 +184,7 @@ def new_tab(_, state: WindowState, args: list[str]):
             path = path[1:-1]
         state.start_files_view(path)
     except IndexError:
-        status.set("Please provide the path")
+        notify("Please provide the path", "error")
     return ReturnType.CONTINUE
 
 @command.add_command('closetab', 'ct')
@@ -135,11 +193,11 @@ def close_tab(_, state: WindowState, args: list[str]):
     try:
         state.pop_files_view(int(args[0]))
     except TypeError:
-        status.set(f"Invalid argument: {args[0]}")
+        notify(f"Invalid argument: {args[0]}", "error")
         return ReturnType.ERR
     except IndexError:
         if len(args) > 1:
-            status.set(f"Cannot find tab index {args[0]}, max is {len(state.panels) -1}")
+            notify(f"Cannot find tab index {args[0]}, max is {len(state.panels) -1}", "error")
             return ReturnType.ERR
         state.pop_files_view()
     if len(state.panels) == 0:
@@ -149,7 +207,7 @@ def close_tab(_, state: WindowState, args: list[str]):
 @command.add_command('pwd')
 def pwd(_, state: WindowState, *__):
     """Show current working directory"""
-    status.set(f"{state.fetch()[1].cwd}")
+    notify(f"{state.fetch()[1].cwd}")
     return ReturnType.CONTINUE
 
 @command.add_command('cd')
@@ -158,7 +216,7 @@ def cd(_, state: WindowState, args: list[str]):
     try:
         path = Path(args[0]).expanduser().absolute()
     except IndexError:
-        status.set("Please provide the path")
+        notify("Please provide the path", "error")
         return ReturnType.ERR
     tabstate = state.fetch()[1]
     ret = change_dir(tabstate, path, tabstate.menu.cursor)
@@ -185,18 +243,22 @@ def quit0(*_):
 
 @command.add_command("open")
 def open_file(screen: curses.window, state: WindowState, args):
-    """Open a file"""
-    try:
-        file = args[0]
-    except IndexError:
-        status.set("Please provide filename")
+    """Open a file, or every selected entry in one editor"""
+    tabstate = state.fetch()[1]
+    apply_selection(tabstate)
+    if args:
+        files = [args[0]]
+    elif tabstate.selection:
+        files = selected_paths(tabstate)
+    else:
+        notify("Please provide filename", "error")
         return ReturnType.ERR
     try:
         editor = get_editor(state)
     except ValueError:
-        status.set("Please provide editor through environment variables")
+        notify("Please provide editor through environment variables", "error")
         return ReturnType.ERR
-    fs_open(screen, editor, file)
+    fs_open(screen, editor, *files)
     return ReturnType.CONTINUE
 
 @command.add_command("set")
@@ -205,12 +267,12 @@ def set_config(_, state: WindowState, args: list[str]):
     try:
         val = args[0]
     except IndexError:
-        status.set("Provide an argument, i.e: set key=value")
+        notify("Provide an argument, i.e: set key=value", "error")
         return ReturnType.ERR
     try:
         var, v = val.split('=', 1)
     except ValueError:
-        status.set(f"Invalid syntax: {val}")
+        notify(f"Invalid syntax: {val}", "error")
         return ReturnType.ERR
     state.settings[var] = v
     return ReturnType.CONTINUE
@@ -222,3 +284,414 @@ def get_config(screen: curses.window, state: WindowState, _):
     panel = Panel(maxy - 2, maxx, 1, 0, show_config, state.settings)
     state.popup.append(panel)
     return ReturnType.CONTINUE
+
+@command.add_command("watch")
+def watch(_, state: WindowState, args: list[str]):
+    """Toggle live updates of the current tab, or set them with on/off"""
+    if not watcher.enabled:
+        notify("Live updates need inotify, which isn't available", "error")
+        return ReturnType.ERR
+    tabstate = state.fetch()[1]
+    if args and args[0] not in ("on", "off"):
+        notify(f"Invalid argument: {args[0]}", "error")
+        return ReturnType.ERR
+    tabstate.watch = args[0] == "on" if args else not tabstate.watch
+    notify(f"Live updates {'on' if tabstate.watch else 'off'}")
+    return ReturnType.CONTINUE
+
+@command.add_command("sort")
+def sort(_, state: WindowState, args: list[str]):
+    """Sort by name, size, mtime, ext or type (prefix - to reverse, none to reset)"""
+    tabstate = state.fetch()[1]
+    if not args:
+        notify(f"Sorted by {tabstate.sort or 'none'}, available: {', '.join(ORDERS)}")
+        return ReturnType.CONTINUE
+    spec = "" if args[0] == "none" else args[0]
+    try:
+        parse(spec)
+    except ValueError as exc:
+        notify(str(exc), "error")
+        return ReturnType.ERR
+    tabstate.sort = spec
+    state.settings["sort"] = spec
+    return ReturnType.CONTINUE
+
+@command.add_command("find")
+def find(screen: curses.window, state: WindowState, args: list[str]):
+    """Find files by glob, re:regex, type=, size=, mtime= and depth="""
+    if not args:
+        notify("Provide a pattern, i.e: find *.py size=+1k", "error")
+        return ReturnType.ERR
+    try:
+        results, token = start_find(state.fetch()[1].cwd, args)
+    except (ValueError, re.error) as exc:
+        notify(str(exc), "error")
+        return ReturnType.ERR
+    maxy, maxx = screen.getmaxyx()
+    state.open_popup(Panel(maxy - 2, maxx, 1, 0, draw_results, results), token)
+    return ReturnType.CONTINUE
+
+# The last grep, reopened by :grep without arguments
+recent_greps: "deque[GrepResults]" = deque(maxlen=1)
+
+def open_hit(screen: curses.window, state: WindowState, hit: tuple[str, int, int, str]):
+    """View the file of a grep hit at its line"""
+    path, _, offset, _ = hit
+    view_file(screen, state, path)
+    if state.viewer is not None:
+        state.viewer.seek(offset)
+
+@command.add_command("grep")
+def grep(screen: curses.window, state: WindowState, args: list[str]):
+    """Search file contents by regex, -i, max=SIZE and name=GLOB, no arguments reopen the last search"""
+    # pylint: disable-next=import-outside-toplevel
+    from props.grep import GrepView, draw_grep, grep as start_grep
+    if args:
+        try:
+            results = start_grep(state.fetch()[1].cwd, args)[0]
+        except (ValueError, re.error) as exc:
+            notify(str(exc), "error")
+            return ReturnType.ERR
+        recent_greps.append(results)
+    elif recent_greps:
+        results = recent_greps[0]
+    else:
+        notify("Provide a pattern, i.e: grep TODO name=*.py", "error")
+        return ReturnType.ERR
+    maxy, maxx = screen.getmaxyx()
+    view = GrepView(results, lambda hit: open_hit(screen, state, hit))
+    state.open_focus(Panel(maxy - 2, maxx, 1, 0, draw_grep, view), view)
+    return ReturnType.OVERRIDE
+
+def remove_dupes(state: WindowState, view: "DupesView", paths: list[str]):
+    """Queue removal of duplicates marked in the dupes panel
+
+    Files changed since they were hashed are left alone; deleting for
+    good asks first, like :delete."""
+    to_trash = state.settings.get("delete") == "trash"
+    expected = {path: view.results.keys[path] for path in paths}
+
+    def confirmed():
+        try:
+            job = remove_files(paths, to_trash, expected)
+        except OSError as exc:
+            notify(f"{type(exc).__name__}: {exc}", "error")
+            return
+        view.removed(paths)
+        notify(job.progress())
+    if to_trash:
+        confirmed()
+        return
+    state.ask(f"Delete {len(paths)} duplicates for good?", confirmed)
+
+@command.add_command("dupes")
+def find_dupes(screen: curses.window, state: WindowState, args: list[str]):
+    """Find duplicate files under the current directory, min=SIZE skips smaller files"""
+    # pylint: disable-next=import-outside-toplevel
+    from props.dupes import DupesView, draw_dupes, dupes as start_dupes
+    min_size = 1
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key != "min":
+            notify(f"Unknown option: {arg}", "error")
+            return ReturnType.ERR
+        try:
+            min_size = parse_size(value)
+        except ValueError as exc:
+            notify(str(exc), "error")
+            return ReturnType.ERR
+    results, job = start_dupes(state.fetch()[1].cwd, min_size)
+    maxy, maxx = screen.getmaxyx()
+    view = DupesView(results, job, lambda paths: remove_dupes(state, view, paths))
+    state.open_focus(Panel(maxy - 2, maxx, 1, 0, draw_dupes, view), view)
+    return ReturnType.OVERRIDE
+
+def sync_side(comparison: "Comparison", to_right: bool, force: bool):
+    """Queue a sync making one side of a comparison match the other
+
+    Files newer on the destination are only overwritten when forced."""
+    if not comparison.done:
+        notify("Still comparing, sync once it is done", "error")
+        return
+    kept = 0 if force else comparison.kept(to_right)
+    note = f", {kept} newer on the destination kept" if kept else ""
+    copies = comparison.copies(to_right, force)
+    if not copies:
+        notify(f"Nothing to sync{note}")
+        return
+    src, dst = (comparison.left, comparison.right) if to_right else (comparison.right, comparison.left)
+    notify(f"{sync(copies, f'sync {src} -> {dst}').progress()}{note}")
+
+@command.add_command("compare", "diff")
+def compare_tabs(screen: curses.window, state: WindowState, args: list[str]):
+    """Compare the current tab's tree with another tab's (the next one by default)"""
+    # pylint: disable-next=import-outside-toplevel
+    from props.compare import CompareView, compare as start_compare, draw_compare
+    count = len(state.tab_states)
+    try:
+        other = int(args[0]) if args else (state.active + 1) % count
+    except ValueError:
+        notify(f"Invalid tab index: {args[0]}", "error")
+        return ReturnType.ERR
+    if not 0 <= other < count or other == state.active:
+        notify(f"Provide another tab's index, 0 to {count - 1}", "error")
+        return ReturnType.ERR
+    left, right = state.fetch()[1].cwd, state.tab_states[other].cwd
+    if left == right:
+        notify("Both tabs show the same directory", "error")
+        return ReturnType.ERR
+    comparison, job = start_compare(left, right)
+    maxy, maxx = screen.getmaxyx()
+    view = CompareView(comparison, job, sync_side)
+    state.open_focus(Panel(maxy - 2, maxx, 1, 0, draw_compare, view), view)
+    return ReturnType.OVERRIDE
+
+def transfer(state: WindowState, args: list[str], start: Callable[[str, str], Job],
+             start_all: Callable[[list[str], str], Job]):
+    """Queue a copy or move of the selection, or of the entry under the cursor"""
+    tabstate = state.fetch()[1]
+    try:
+        dst = str(Path(tabstate.content.cwd, Path(args[0]).expanduser()))
+    except IndexError:
+        notify("Please provide the destination", "error")
+        return ReturnType.ERR
+    try:
+        sources = selected_paths(tabstate)
+    except IndexError:
+        notify("Nothing to transfer", "error")
+        return ReturnType.ERR
+    try:
+        job = start(sources[0], dst) if len(sources) == 1 else start_all(sources, dst)
+    except OSError as exc:
+        notify(f"{type(exc).__name__}: {exc}", "error")
+        return ReturnType.ERR
+    tabstate.selection.clear()
+    notify(job.progress())
+    return ReturnType.CONTINUE
+
+@command.add_command("copy", "cp")
+def copy(_, state: WindowState, args: list[str]):
+    """Copy the selection or the entry under the cursor to a path, in the background"""
+    return transfer(state, args, copy_job, copy_all)
+
+@command.add_command("move", "mv")
+def move(_, state: WindowState, args: list[str]):
+    """Move the selection or the entry under the cursor to a path, in the background"""
+    return transfer(state, args, move_job, move_all)
+
+def remove(state: WindowState, start: Callable[[str], Job], to_trash: bool):
+    """Queue removal of the selection, or of the entry under the cursor
+
+    Deleting for good asks first; the trash can be emptied by hand."""
+    tabstate = state.fetch()[1]
+    try:
+        paths = selected_paths(tabstate)
+    except IndexError:
+        notify("Nothing to delete", "error")
+        return ReturnType.ERR
+
+    def confirmed():
+        try:
+            job = start(paths[0]) if len(paths) == 1 else remove_files(paths, to_trash)
+        except OSError as exc:
+            notify(f"{type(exc).__name__}: {exc}", "error")
+            return
+        tabstate.selection.clear()
+        state.reload((tabstate.content.cwd,))
+        notify(job.progress())
+    if to_trash:
+        confirmed()
+        return ReturnType.CONTINUE
+    what = Path(paths[0]).name if len(paths) == 1 else f"{len(paths)} entries"
+    state.ask(f"Delete {what} for good?", confirmed)
+    return ReturnType.CONTINUE
+
+@command.add_command("delete", "rm")
+def delete(_, state: WindowState, __):
+    """Delete the selection or the entry under the cursor (to the trash if delete=trash is set)"""
+    if state.settings.get("delete") == "trash":
+        return remove(state, trash, True)
+    return remove(state, delete_job, False)
+
+@command.add_command("trash")
+def move_to_trash(_, state: WindowState, __):
+    """Move the selection or the entry under the cursor to the trash"""
+    return remove(state, trash, True)
+
+@command.add_command("jobs")
+def show_job_list(screen: curses.window, state: WindowState, _):
+    """Opens the background jobs viewer"""
+    maxy, maxx = screen.getmaxyx()
+    panel = Panel(maxy - 2, maxx, 1, 0, show_jobs)
+    state.popup.append(panel)
+    return ReturnType.CONTINUE
+
+@command.add_command("cancel")
+def cancel(_, state: WindowState, args: list[str]):  # pylint: disable=unused-argument
+    """Cancel a background job by its id, or every job"""
+    if not args:
+        for job in jobs.active():
+            job.token.cancel()
+        return ReturnType.CONTINUE
+    try:
+        jobs.get(int(args[0])).token.cancel()
+    except (ValueError, KeyError):
+        notify(f"No such job: {args[0]}", "error")
+        return ReturnType.ERR
+    return ReturnType.CONTINUE
+
+@command.add_command("archive")
+def archive(_, state: WindowState, args: list[str]):
+    """Archive the selection or the entry under the cursor (.tar[.gz|.bz2|.xz], .zip, .gz, .bz2, .xz)"""
+    from props.archive import archive as archive_job  # pylint: disable=import-outside-toplevel
+    tabstate = state.fetch()[1]
+    try:
+        dest = str(Path(tabstate.content.cwd, Path(args[0]).expanduser()))
+    except IndexError:
+        notify("Please provide the archive name, i.e: archive out.tar.gz", "error")
+        return ReturnType.ERR
+    try:
+        job = archive_job(selected_paths(tabstate), dest)
+    except IndexError:
+        notify("Nothing to archive", "error")
+        return ReturnType.ERR
+    except (OSError, ValueError) as exc:
+        notify(str(exc), "error")
+        return ReturnType.ERR
+    tabstate.selection.clear()
+    notify(job.progress())
+    return ReturnType.CONTINUE
+
+@command.add_command("extract")
+def extract(_, state: WindowState, args: list[str]):
+    """Extract the archive under the cursor, into the tab's directory by default"""
+    from props.archive import extract as extract_job  # pylint: disable=import-outside-toplevel
+    tabstate = state.fetch()[1]
+    dest = str(Path(tabstate.content.cwd, Path(args[0]).expanduser())) if args else tabstate.content.cwd
+    try:
+        job = extract_job(cursor_path(tabstate), dest)
+    except IndexError:
+        notify("Nothing to extract", "error")
+        return ReturnType.ERR
+    except (OSError, ValueError) as exc:
+        notify(str(exc), "error")
+        return ReturnType.ERR
+    notify(job.progress())
+    return ReturnType.CONTINUE
+
+@command.add_command("select", "sel")
+def select(_, state: WindowState, args: list[str]):
+    """Select all, none, invert, or names matching a glob (-GLOB deselects them)"""
+    tabstate = state.fetch()[1]
+    if tabstate.content.loading:
+        notify("Wait for the listing to finish", "error")
+        return ReturnType.ERR
+    apply_selection(tabstate)
+    selection = tabstate.selection
+    if not args:
+        notify("Provide all, none, invert or a glob, i.e: select *.py", "error")
+        return ReturnType.ERR
+    actions = {"all": selection.all, "none": selection.clear, "invert": selection.invert}
+    for arg in args:
+        if arg in actions:
+            actions[arg]()
+        elif arg.startswith("-"):
+            selection.glob(arg[1:], False)
+        else:
+            selection.glob(arg)
+    notify(f"{len(selection)} selected")
+    return ReturnType.CONTINUE
+
+@command.add_command("view")
+def view(screen: curses.window, state: WindowState, args: list[str]):
+    """View a file, or the entry under the cursor, in the built-in viewer"""
+    tabstate = state.fetch()[1]
+    try:
+        file = str(Path(tabstate.content.cwd, Path(args[0]).expanduser())) if args else cursor_path(tabstate)
+    except IndexError:
+        notify("Nothing to view", "error")
+        return ReturnType.ERR
+    if not Path(file).is_file():
+        notify(f"Not a regular file: {file}", "error")
+        return ReturnType.ERR
+    return view_file(screen, state, file)
+
+@command.add_command("goto")
+def goto(_, state: WindowState, args: list[str]):
+    """Go to a line in the file viewer"""
+    if state.viewer is None:
+        notify("No file is being viewed", "error")
+        return ReturnType.ERR
+    try:
+        line = int(args[0])
+    except (IndexError, ValueError):
+        notify("Provide a line number, i.e: goto 120", "error")
+        return ReturnType.ERR
+    if not state.viewer.goto(line):
+        notify(f"Line {line} isn't indexed yet", "error")
+        return ReturnType.ERR
+    return ReturnType.CONTINUE
+
+@command.add_command("du")
+def du(_, state: WindowState, args: list[str]):
+    """Toggle the disk usage column of the current tab, or set it with on/off"""
+    tabstate = state.fetch()[1]
+    if args and args[0] not in ("on", "off"):
+        notify(f"Invalid argument: {args[0]}", "error")
+        return ReturnType.ERR
+    tabstate.du = args[0] == "on" if args else not tabstate.du
+    return ReturnType.CONTINUE
+
+@command.add_command("long")
+def long(_, state: WindowState, args: list[str]):
+    """Toggle the long listing of the current tab, or set it with on/off"""
+    tabstate = state.fetch()[1]
+    if args and args[0] not in ("on", "off"):
+        notify(f"Invalid argument: {args[0]}", "error")
+        return ReturnType.ERR
+    tabstate.long = args[0] == "on" if args else not tabstate.long
+    return ReturnType.CONTINUE
+
+@command.add_command("messages", "msg")
+def messages(screen: curses.window, state: WindowState, _):
+    """Show the message history"""
+    maxy, maxx = screen.getmaxyx()
+    view = HistoryView(bus)
+    state.open_focus(Panel(maxy - 2, maxx, 1, 0, draw_history, view), view)
+    return ReturnType.OVERRIDE
+
+@command.add_command("stats")
+def stats(screen: curses.window, state: WindowState, args: list[str]):
+    """Show latency percentiles and system calls per operation, reset to start over"""
+    if args and args[0] == "reset":
+        recorder.reset()
+        return ReturnType.CONTINUE
+    maxy, maxx = screen.getmaxyx()
+    state.open_popup(Panel(maxy - 2, maxx, 1, 0, draw_stats, recorder))
+    return ReturnType.CONTINUE
+
+@command.add_command("mem")
+def mem(screen: curses.window, state: WindowState, _):
+    """Show the memory each tab holds on to, set tab_budget to bound it"""
+    maxy, maxx = screen.getmaxyx()
+    state.open_popup(Panel(maxy - 2, maxx, 1, 0, draw_memory, state))
+    return ReturnType.CONTINUE
+
+@command.add_command("trace")
+def trace(_, state: WindowState, args: list[str]):
+    """Record a Chrome trace to a file, off to write it"""
+    if not args:
+        notify(f"Tracing to {recorder.tracing}" if recorder.tracing else "Not tracing")
+        return ReturnType.CONTINUE
+    if args[0] == "off":
+        try:
+            path = recorder.stop_trace()
+        except OSError as exc:
+            notify(f"Cannot write the trace: {exc}", "error")
+            return ReturnType.ERR
+        notify(f"Trace written to {path}" if path else "Not tracing")
+        return ReturnType.CONTINUE
+    path = str(Path(state.fetch()[1].cwd, Path(args[0]).expanduser()))
+    recorder.start_trace(path)
+    notify(f"Tracing to {path}, :trace off to write it")
+    return ReturnType.CONTINUE
@@ -0,0 +1,33 @@
+"""Key input coalescing"""
+
+# pylint: disable=no-member
+
+import curses
+
+SHIFT_TAB = 353
+MAX_BURST = 4096
+
+VERTICAL = {curses.KEY_UP: -1, curses.KEY_DOWN: 1}
+TABS = {ord("\t"): 1, SHIFT_TAB: -1}
+
+
+def coalesce(screen: curses.window, key: int, deltas: dict[int, int], delay: int):
+    """Sum the deltas of key and of every already queued key of the same kind
+
+    The first queued key of another kind is pushed back for the normal
+    key handling, so a held-down key costs one move and one redraw no
+    matter how many repeats piled up."""
+    total = deltas[key]
+    screen.nodelay(True)
+    try:
+        for _ in range(MAX_BURST):
+            pending = screen.getch()
+            if pending == -1:
+                break
+            if pending not in deltas:
+                curses.ungetch(pending)
+                break
+            total += deltas[pending]
+    finally:
+        screen.timeout(delay)
+    return total
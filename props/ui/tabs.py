@@ -3,16 +3,42 @@
 # pylint: disable=no-member
 
 import curses
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from os.path import join
 from typing import NamedTuple
 
 from lymia import Menu
+from ..colors import Basic
+from ..du import Sizes
+from ..filter import Filter
+from ..meta import long_label, stat_cache
+from ..perf import timed
+from ..select import Selection
+from ..sort import argsort, keys_for, parse, request_stat_keys
 from ..utils import Directory
 
+# Rough size of a painted row besides its label
+ROW_BYTES = 120
+DEFAULT_TAB_BUDGET = 256 * 1024 * 1024
+
 class CursorHistory(NamedTuple):
     path: str
     cursor: int
 
+@dataclass
+class Viewport:
+    """What was last painted in a tab, to redraw only damaged rows"""
+    top: int = 0
+    size: tuple[int, int] = (0, 0)
+    rows: list[tuple[str, int]] = field(default_factory=list)
+    footer: str = ""
+    signature: tuple = ()
+
+    def invalidate(self):
+        """Force a full repaint on the next draw"""
+        self.rows.clear()
+        self.signature = ()
+
 @dataclass
 class TabState:
     """Tab state"""
@@ -20,9 +46,242 @@ class TabState:
     menu: Menu[str]
     content: Directory
     cursor_history: list[CursorHistory]
+    pending_cursor: int = -1
+    watch: bool = False
+    loaded: bool = True
+    sort: str = ""
+    du: bool = False
+    sizes: Sizes | None = None
+    filter: Filter | None = None
+    long: bool = False
+    selection: Selection = field(default_factory=Selection)
+    viewport: Viewport = field(default_factory=Viewport)
+    # Entry under the cursor when the tab was hibernated
+    resume: str | None = None
+    # monotonic() of when the tab was last active
+    used: float = 0.0
+
+def apply_pending_cursor(state: TabState):
+    """Seek to a cursor that was waiting for its directory to load
+
+    A woken tab finds its entry by name once the listing is complete,
+    falling back to where the entry used to be."""
+    if state.resume is not None:
+        if not state.loaded or state.content.loading:
+            return
+        index = state.content.listing.find(state.resume)
+        state.resume = None
+        if index >= 0:
+            state.pending_cursor = index
+    if state.pending_cursor < 0:
+        return
+    size = len(state.content)
+    if size > state.pending_cursor or not state.content.loading:
+        state.menu.seek(max(min(state.pending_cursor, size - 1), 0))
+        state.pending_cursor = -1
+
+def apply_sort(state: TabState):
+    """Bring a tab's entries into its sort order, keeping the cursor's entry"""
+    content = state.content
+    if content.sorting == state.sort or content.loading:
+        return
+    resort(state)
+
+@timed("sort")
+def resort(state: TabState):
+    """Sort a tab's entries now, unless the stat keys it needs aren't there yet"""
+    content = state.content
+    try:
+        order, reverse = parse(state.sort)
+    except ValueError:
+        state.sort = ""
+        order, reverse = "", False
+    listing = content.listing
+    permutation = None
+    if order:
+        keys = keys_for(listing, order)
+        if keys is None:
+            request_stat_keys(content.cwd, listing)
+            return
+        permutation = argsort(keys, reverse)
+    try:
+        current = content.name(state.menu.cursor)
+    except IndexError:
+        current = None
+    if content.reorder(state.sort, permutation, listing) and current is not None:
+        state.menu.seek(max(content.index(current), 0))
+
+def apply_filter(state: TabState):
+    """Narrow the tab down to its filter's matches, following listing changes"""
+    typeahead = state.filter
+    if typeahead is None:
+        return
+    content = state.content
+    listing = content.listing
+    if typeahead.listing is listing and content.narrowed == (typeahead.matches is not None):
+        return
+    typeahead.reset(listing)
+    if content.narrow(typeahead.matches, listing) and state.menu.cursor >= len(content):
+        state.menu.seek(max(len(content) - 1, 0))
+
+def apply_selection(state: TabState):
+    """Carry the selection over to the tab's current listing
+
+    Waits for loads to finish, a half-streamed listing would drop names,
+    but a selection in another directory is dropped at once."""
+    content = state.content
+    if not content.loading:
+        state.selection.follow(content.cwd, content.listing, content.version)
+    elif state.selection and state.selection.cwd != content.cwd:
+        state.selection = Selection()
 
+def selected_paths(state: TabState):
+    """Paths of the selected entries, or of the entry under the cursor"""
+    content = state.content
+    apply_selection(state)
+    if state.selection:
+        return [join(content.cwd, name) for name in state.selection.names()]
+    return [join(content.cwd, content.name(state.menu.cursor))]
+
+def apply_sizes(state: TabState):
+    """Start or stop sizing the tab's directory"""
+    sizes = state.sizes
+    if sizes is not None and (not state.du or sizes.path != state.content.cwd):
+        sizes.token.cancel()
+        state.sizes = sizes = None
+    if state.du and sizes is None:
+        state.sizes = Sizes(state.content.cwd)
+        state.sizes.start()
+
+def footprint(state: TabState, owned: bool = True):
+    """Rough bytes a tab holds on to, its listing only if owned"""
+    size = state.content.nbytes() + len(state.selection.bits)
+    if not owned:
+        size -= state.content.listing.nbytes()
+    if state.sizes is not None:
+        size += state.sizes.nbytes()
+    return size + sum(len(label) + ROW_BYTES for label, _ in state.viewport.rows)
+
+def hibernate(state: TabState):
+    """Drop a tab's listing and everything derived from it
+
+    Only the directory, the entry under the cursor and the cursor history
+    are kept; the tab lists its directory again once it is activated."""
+    content = state.content
+    if state.loaded and not content.loading and len(content):
+        state.resume = content.name(min(state.menu.cursor, len(content) - 1))
+        state.pending_cursor = content.listing.find(state.resume)
+    content.release()
+    if state.sizes is not None:
+        state.sizes.token.cancel()
+        state.sizes = None
+    state.selection = Selection()
+    state.filter = None
+    state.viewport = Viewport()
+    state.loaded = False
+
+def signature(state: TabState):
+    """Everything a tab's picture depends on"""
+    content = state.content
+    return (state.menu.cursor, content.version, len(content), content.loading,
+            state.pending_cursor, content.sorting,
+            state.sizes.version if state.sizes else -1,
+            state.filter.query if state.filter else None,
+            stat_cache.version if state.long else -1, state.selection.version)
+
+def needs_draw(state: TabState):
+    """Whether drawing the tab would change anything on screen"""
+    viewport = state.viewport
+    return (not viewport.rows or viewport.signature != signature(state)
+            or state.content.sorting != state.sort or state.du != (state.sizes is not None))
+
+def scroll(top: int, cursor: int, height: int, count: int):
+    """First visible row so that the cursor stays in view"""
+    if cursor < top:
+        top = cursor
+    elif cursor >= top + height:
+        top = cursor - height + 1
+    return max(min(top, count - height), 0)
+
+def footer(state: TabState):
+    """Text on the bottom border"""
+    if state.content.loading:
+        return f" loading {len(state.content)} entries\u2026 "
+    selected = f" {len(state.selection)} selected " if state.selection else ""
+    if state.sizes is not None:
+        return state.sizes.summary() + selected
+    return selected
+
+@timed("render")
 def draw_tab(screen: curses.window, state: TabState):
-    """Draw tab"""
-    screen.erase()
-    screen.box()
-    state.menu.draw(screen)
+    """Draw tab, repainting only rows that changed since the last draw"""
+    apply_pending_cursor(state)
+    apply_sort(state)
+    apply_filter(state)
+    apply_selection(state)
+    apply_sizes(state)
+    viewport = state.viewport
+    maxy, maxx = screen.getmaxyx()
+    height = maxy - 2
+    width = maxx - 3
+    text = footer(state)
+    if viewport.size != (maxy, maxx) or len(text) < len(viewport.footer):
+        viewport.invalidate()
+        viewport.size = (maxy, maxx)
+    if not viewport.rows:
+        screen.erase()
+        screen.box()
+        viewport.rows = [("", -1)] * max(height, 0)
+        viewport.footer = ""
+
+    content = state.content
+    count = len(content)
+    cursor = min(state.menu.cursor, count - 1)
+    top = scroll(viewport.top, cursor, height, count)
+    selected = curses.color_pair(int(Basic.SELECTED))
+    sizes = state.sizes
+    selection = state.selection if state.selection.stamp == content.version else None
+    missing: list[str] = []
+    for y in range(height):
+        index = top + y
+        if index < count:
+            label, style = content.row(index)
+            if state.long:
+                name = content.name(index)
+                meta, fresh = stat_cache.peek(join(content.cwd, name))
+                if not fresh:
+                    missing.append(name)
+                label = long_label(meta, label)
+            if selection:
+                label = f"{'+' if content.at(index) in selection else ' '}{label}"
+            if sizes is not None:
+                column = sizes.label(content.name(index))
+                label = f"{label[:width - 12].ljust(width - 12)} {column:>11}"
+            attr = selected if index == cursor else curses.color_pair(style)
+        else:
+            label, attr = "", 0
+        if viewport.rows[y] == (label, attr):
+            continue
+        viewport.rows[y] = (label, attr)
+        try:
+            screen.addnstr(y + 1, 2, label.ljust(width), width, attr)
+        except curses.error:
+            pass
+    viewport.top = top
+    if state.long:
+        # Rows a page away are fetched too, so scrolling finds them ready
+        for index in (*range(max(top - height, 0), top),
+                      *range(top + height, min(top + 2 * height, count))):
+            name = content.name(index)
+            if not stat_cache.peek(join(content.cwd, name))[1]:
+                missing.append(name)
+        if missing:
+            stat_cache.request(content.cwd, missing)
+
+    if text != viewport.footer:
+        viewport.footer = text
+        try:
+            screen.addstr(maxy - 1, 2, text[:max(maxx - 4, 0)])
+        except curses.error:
+            pass
+    viewport.signature = signature(state)
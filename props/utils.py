@@ -1,8 +1,12 @@
 """utils"""
 
-from os import listdir, stat
+from array import array
+from bisect import bisect_left
+from os import DirEntry, kill, scandir, stat
+from time import time_ns
 from os.path import join
 from pathlib import Path
+from threading import Lock
 from stat import (
     S_ISCHR,
     S_ISDOOR,
@@ -15,12 +19,51 @@ from stat import (
     S_ISSOCK,
     S_ISWHT,
 )
-from typing import Any, TypedDict
+from typing import Any, Callable, Iterable, TypedDict
 
 from lymia.menu import MenuEntry
+from props.cache import listing_cache
+from props.perf import syscalls, timed
 
 DEFAULT = ("", 0)
 
+# Type codes stored in Listing.types, index into TYPE_NAMES.
+TYPE_NAMES = (
+    "reg",
+    "directory",
+    "link",
+    "block",
+    "char",
+    "fifo",
+    "sock",
+    "door",
+    "port",
+    "whiteout",
+)
+T_REG = 0
+T_DIR = 1
+T_LINK = 2
+T_BLOCK = 3
+T_CHAR = 4
+T_FIFO = 5
+T_SOCK = 6
+T_DOOR = 7
+T_PORT = 8
+T_WHT = 9
+T_UNKNOWN = 255
+ENTRY_CACHE = 512
+# Rough size of a cached MenuEntry with its label and closure
+ENTRY_BYTES = 400
+# Past this many changes, merging beats inserting one by one.
+SMALL_CHANGE = 64
+# Entries renamed out of the way while they get deleted, followed by the pid
+# doing it; hidden from listings while that process runs
+DELETING_PREFIX = ".~elymicia-deleting-"
+# Files being written, renamed to their real name once complete; same rules
+STAGING_PREFIX = ".~elymicia-staging-"
+# Sort key of one entry by order, from (directory, name, type code); see props.sort
+KEYERS: dict[str, Callable[[str, str, int], Any]] = {}
+
 
 class FormatColor(TypedDict):
     """File formats"""
@@ -37,30 +80,81 @@ class FormatColor(TypedDict):
     whiteout: tuple[str, int]
 
 
-def get_fmt(fmt: FormatColor, path: str):
-    """Get format style"""
-    st = stat(path, follow_symlinks=False).st_mode
+def mode_type(st: int):
+    """Return type code of a st_mode"""
     if S_ISCHR(st):
-        return fmt["char"]
+        return T_CHAR
     if S_ISDOOR(st):
-        return fmt["door"]
+        return T_DOOR
     if S_ISDIR(st):
-        return fmt["directory"]
+        return T_DIR
     if S_ISBLK(st):
-        return fmt["block"]
+        return T_BLOCK
     if S_ISLNK(st):
-        return fmt["link"]
+        return T_LINK
     if S_ISFIFO(st):
-        return fmt["link"]
+        return T_FIFO
     if S_ISPORT(st):
-        return fmt["port"]
+        return T_PORT
     if S_ISREG(st):
-        return fmt["reg"]
+        return T_REG
     if S_ISSOCK(st):
-        return fmt["sock"]
+        return T_SOCK
     if S_ISWHT(st):
-        return fmt["whiteout"]
-    return DEFAULT
+        return T_WHT
+    return T_UNKNOWN
+
+
+def staged(name: str):
+    """Whether an entry is being deleted or written by a running Elymicia, and so not listed
+
+    What a crashed process left behind shows up again, to be dealt with."""
+    if name.startswith(DELETING_PREFIX):
+        pid = name[len(DELETING_PREFIX):].partition("-")[0]
+    elif name.startswith(STAGING_PREFIX):
+        pid = name[len(STAGING_PREFIX):].partition("-")[0]
+    else:
+        return False
+    if not pid.isdigit():
+        return False
+    try:
+        kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Someone else's process, alive
+        pass
+    return True
+
+
+def type_fmt(fmt: FormatColor, code: int) -> tuple[str, int]:
+    """Get format style of a type code"""
+    if code == T_UNKNOWN:
+        return DEFAULT
+    if code == T_FIFO:
+        # fifo has always been drawn like links
+        return fmt["link"]
+    return fmt[TYPE_NAMES[code]]  # type: ignore
+
+
+def get_fmt(fmt: FormatColor, path: str):
+    """Get format style"""
+    syscalls()
+    return type_fmt(fmt, mode_type(stat(path, follow_symlinks=False).st_mode))
+
+
+def entry_type(entry: DirEntry):
+    """Classify a scandir entry from its d_type, T_UNKNOWN if that isn't enough"""
+    try:
+        if entry.is_symlink():
+            return T_LINK
+        if entry.is_dir(follow_symlinks=False):
+            return T_DIR
+        if entry.is_file(follow_symlinks=False):
+            return T_REG
+    except OSError:
+        pass
+    return T_UNKNOWN
 
 
 def path_pointer(path: str, name: str, fmt: FormatColor):
@@ -72,27 +166,289 @@ def path_pointer(path: str, name: str, fmt: FormatColor):
     return MenuEntry(fname, lambda: Path(normalized), style=style)
 
 
-def _lsdir(path: str, fmt: FormatColor):
+class Listing:
+    """Compact, column-oriented table of directory entries"""
+
+    __slots__ = ("names", "types", "inodes", "keys", "version", "_sized")
+
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self.types = array("B")
+        self.inodes = array("Q")
+        # Sort keys computed for this listing, see props.sort
+        self.keys: dict[str, Any] = {}
+        # Bumped whenever entries move, so work started on the old order can tell
+        self.version = 0
+        # (entry count, bytes) of the last nbytes()
+        self._sized = (0, 0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, name: str, code: int, inode: int):
+        """Append an entry"""
+        self.names.append(name)
+        self.types.append(code)
+        self.inodes.append(inode)
+
+    def extend(self, entries: Iterable[DirEntry]):
+        """Append scandir entries"""
+        names = self.names
+        types = self.types
+        inodes = self.inodes
+        for entry in entries:
+            if staged(entry.name):
+                continue
+            names.append(entry.name)
+            types.append(entry_type(entry))
+            inodes.append(entry.inode())
+
+    def copy(self):
+        """Shallow copy, sort keys included"""
+        listing = Listing()
+        listing.names = self.names.copy()
+        listing.types = array("B", self.types)
+        listing.inodes = array("Q", self.inodes)
+        listing.keys = {order: keys[:] for order, keys in self._columns()}
+        return listing
+
+    def _columns(self):
+        """Sort keys that can follow entry changes
+
+        Other key columns are dropped, a pending stat job with them. Called
+        from the main thread only, like everything touching keys."""
+        count = len(self.names)
+        kept: dict[str, Any] = {}
+        columns = []
+        for order, keys in self.keys.items():
+            if order in KEYERS and len(keys) == count:
+                kept[order] = keys
+                columns.append((order, keys))
+        self.keys = kept
+        return columns
+
+    def sort(self):
+        """Sort entries by name"""
+        names = self.names
+        order = sorted(range(len(names)), key=names.__getitem__)
+        self.permute(order)
+
+    def permute(self, order: list[int]):
+        """Reorder every column by a permutation"""
+        names = self.names
+        types = self.types
+        inodes = self.inodes
+        columns = self._columns()
+        self.names = [names[i] for i in order]
+        self.types = array("B", [types[i] for i in order])
+        self.inodes = array("Q", [inodes[i] for i in order])
+        self.keys.update((key, _take(keys, order)) for key, keys in columns)
+        self.version += 1
+
+    def find(self, name: str):
+        """Index of a name, -1 if it isn't listed"""
+        names = self.names
+        index = bisect_left(names, name)
+        if index < len(names) and names[index] == name:
+            return index
+        return -1
+
+    def insert(self, entries: list[tuple[str, int, int]], path: str = ""):
+        """Insert (name, type code, inode) entries of path, keeping the order
+
+        Sort keys are computed for the new entries only."""
+        columns = self._columns()
+        if len(entries) > SMALL_CHANGE:
+            for name, code, inode in entries:
+                self.append(name, code, inode)
+                for order, keys in columns:
+                    keys.append(KEYERS[order](path, name, code))
+            self.sort()
+            return
+        self.version += 1
+        for name, code, inode in entries:
+            index = bisect_left(self.names, name)
+            self.names.insert(index, name)
+            self.types.insert(index, code)
+            self.inodes.insert(index, inode)
+            for order, keys in columns:
+                keys.insert(index, KEYERS[order](path, name, code))
+
+    def remove(self, names: set[str]):
+        """Remove entries by name, along with their sort keys"""
+        if len(names) > SMALL_CHANGE:
+            keep = [i for i, name in enumerate(self.names) if name not in names]
+            self.permute(keep)
+            return
+        columns = self._columns()
+        self.version += 1
+        for name in names:
+            index = self.find(name)
+            if index < 0:
+                continue
+            del self.names[index]
+            del self.types[index]
+            del self.inodes[index]
+            for _, keys in columns:
+                del keys[index]
+
+    def resolve(self, path: str, index: int):
+        """Resolve an entry's type code through lstat"""
+        code = self.types[index]
+        if code != T_UNKNOWN:
+            return code
+        syscalls()
+        try:
+            code = mode_type(stat(join(path, self.names[index]), follow_symlinks=False).st_mode)
+        except OSError:
+            return T_UNKNOWN
+        self.types[index] = code
+        return code
+
+    def nbytes(self):
+        """Rough memory footprint, remembered until the entry count changes"""
+        count = len(self.names)
+        if self._sized[0] != count:
+            self._sized = (count, sum(map(len, self.names)) + 49 * count
+                           + self.types.itemsize * len(self.types)
+                           + self.inodes.itemsize * len(self.inodes))
+        return self._sized[1]
+
+
+def _take(keys: Any, order: list[int]):
+    """Sort keys in a new order, keeping their container type"""
+    if isinstance(keys, array):
+        return array(keys.typecode, [keys[i] for i in order])
+    return [keys[i] for i in order]
+
+
+@timed("list")
+def _lsdir(path: str):
     """lsdir"""
-    ls = listdir(path)
-    ls.sort()
-    return tuple(map(lambda a: path_pointer(path, a, fmt), ls))
+    syscalls()
+    st = stat(path)
+    listing = listing_cache.get(st)
+    if listing is not None:
+        return listing
+    syscalls()
+    stamp = time_ns()
+    listing = Listing()
+    with scandir(path) as it:
+        listing.extend(it)
+    listing.sort()
+    listing_cache.put(path, st, listing, stamp)
+    return listing
 
 
 class Directory:
     """lsdir"""
 
-    def __init__(self, cwd: str, fmt: FormatColor) -> None:
+    def __init__(self, cwd: str, fmt: FormatColor, load: bool = True) -> None:
         self._cwd = cwd
-        self._c = _lsdir(cwd, fmt)
         self._fmt = fmt
+        self._c = _lsdir(cwd) if load else Listing()
+        self._entries: dict[int, MenuEntry] = {}
+        self._generation = 0
+        self._loading = False
+        self._token: Any = None
+        self._lock = Lock()
+        self._owned = False
+        self._order: array | None = None
+        self._rank: array | None = None
+        self._view: array | None = None
+        self._sorting = ""
+        self._version = 0
 
     def __len__(self):
+        if self._view is not None:
+            return len(self._view)
         return len(self._c)
 
+    @property
+    def cwd(self):
+        """Current directory"""
+        return self._cwd
+
+    @property
+    def listing(self):
+        """Entry table"""
+        return self._c
+
+    @property
+    def version(self):
+        """Bumped whenever the entries change, in place or not"""
+        return self._version
+
+    @property
+    def sorting(self):
+        """Sort order the entries are in, empty for the plain name order"""
+        return self._sorting
+
+    @property
+    def narrowed(self):
+        """Whether only some entries are shown"""
+        return self._view is not None
+
+    @property
+    def loading(self):
+        """Whether a background load is still streaming in"""
+        return self._loading
+
+    def cancel(self):
+        """Cancel the in-flight background load, if any"""
+        with self._lock:
+            if self._token is not None:
+                self._token.cancel()
+                self._token = None
+            self._generation += 1
+            self._loading = False
+
+    def begin(self, path: str, token: Any):
+        """Start a background load of path, return its generation"""
+        self.cancel()
+        with self._lock:
+            self._cwd = path
+            self._c = Listing()
+            self._unsort()
+            self._token = token
+            self._loading = True
+            return self._generation
+
+    def publish(self, generation: int, listing: Listing, done: bool):
+        """Swap in a listing from a background load, False if it is stale"""
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._c = listing
+            self._owned = False
+            self._unsort()
+            if done:
+                self._loading = False
+                self._token = None
+            return True
+
+    def release(self):
+        """Drop the listing and what was derived from it, keeping cwd"""
+        self.cancel()
+        with self._lock:
+            self._c = Listing()
+            self._owned = False
+            self._unsort()
+
+    def nbytes(self):
+        """Rough memory footprint of the listing and what was derived from it"""
+        size = self._c.nbytes() + ENTRY_BYTES * len(self._entries)
+        for column in (self._order, self._rank, self._view):
+            if column is not None:
+                size += column.itemsize * len(column)
+        return size
+
     def refresh(self):
         """Refresh directory state"""
-        self._c = _lsdir(self._cwd, self._fmt)
+        self.cancel()
+        self._c = _lsdir(self._cwd)
+        self._owned = False
+        self._unsort()
 
     def chdir(self, path: str):
         """Change directory"""
@@ -101,11 +457,110 @@ class Directory:
         self._cwd = path
         self.refresh()
 
+    def _unsort(self):
+        self._version += 1
+        self._order = None
+        self._rank = None
+        self._view = None
+        self._sorting = ""
+        self._entries.clear()
+
+    def reorder(self, sorting: str, order: array | None, listing: Listing):
+        """Show entries in a permutation of listing, None for name order
+
+        Returns False if the directory moved on to another listing."""
+        with self._lock:
+            if listing is not self._c:
+                return False
+            self._order = order
+            self._rank = None
+            self._sorting = sorting
+            self._entries.clear()
+            return True
+
+    def narrow(self, view: array | None, listing: Listing):
+        """Show only these listing indices, in this order, None for all
+
+        Returns False if the directory moved on to another listing."""
+        with self._lock:
+            if listing is not self._c:
+                return False
+            self._view = view
+            self._rank = None
+            self._entries.clear()
+            return True
+
+    def at(self, index: int):
+        """Listing index of a displayed entry"""
+        if self._view is not None:
+            return self._view[index]
+        if self._order is None:
+            return index
+        return self._order[index]
+
+    def name(self, index: int):
+        """Name of an entry"""
+        return self._c.names[self.at(index)]
+
+    def index(self, name: str):
+        """Index of an entry by name, -1 if it isn't listed"""
+        index = self._c.find(name)
+        if index < 0 or (self._order is None and self._view is None):
+            return index
+        if self._rank is None:
+            shown = self._order if self._view is None else self._view
+            rank = array("l", [-1]) * len(self._c)
+            for position, item in enumerate(shown):
+                rank[item] = position
+            self._rank = rank
+        return self._rank[index]
+
+    def apply(self, created: dict[str, int], removed: set[str]):
+        """Apply created names (with their type code) and removed names
+
+        Names already in the wanted state are skipped, so applying the same
+        changes twice is harmless. Returns whether anything changed."""
+        with self._lock:
+            listing = self._c
+            gone = {name for name in removed if listing.find(name) >= 0}
+            new = [(name, code, 0) for name, code in created.items()
+                   if listing.find(name) < 0 and not staged(name)]
+            if not gone and not new:
+                return False
+            if not self._owned:
+                # Listings can be shared with the cache and other tabs
+                listing = listing.copy()
+                self._owned = True
+            listing.remove(gone)
+            listing.insert(new, self._cwd)
+            self._c = listing
+            self._unsort()
+            return True
+
+    def row(self, index: int):
+        """Label and style of an entry"""
+        index = self.at(index)
+        name = self._c.names[index]
+        suffix, style = type_fmt(self._fmt, self._c.resolve(self._cwd, index))
+        return name + suffix, style
+
     def __call__(self, index: int):
-        return self._c[index]  # type: ignore
+        if index < 0:
+            # Rows as shown, which a filter may narrow down
+            index += len(self)
+        entry = self._entries.get(index)
+        if entry is not None:
+            return entry
+        label, style = self.row(index)
+        normalized = join(self._cwd, self.name(index))
+        entry = MenuEntry(label, lambda: Path(normalized), style=style)
+        if len(self._entries) >= ENTRY_CACHE:
+            self._entries.clear()
+        self._entries[index] = entry
+        return entry
 
     def __iter__(self):
-        return self._c.__iter__()
+        return map(self, range(len(self)))
 
 
 class Mapper:
@@ -0,0 +1,267 @@
+"""Built-in file viewer"""
+
+# pylint: disable=no-member
+
+import curses
+import mmap
+from array import array
+from bisect import bisect_left
+from threading import Thread
+
+from props.workers import Cancelled, Token, wakeup
+
+BLOCK = 64 * 1024
+NOTIFY_EVERY = 256
+SNIFF = 8192
+HEX_WIDTH = 16
+MAX_LINE = 4096
+CONTROL = {code: "?" for code in (*range(32), 127)}
+
+
+def map_file(path: str):
+    """Map a file read-only, an empty file maps to b\"\""""
+    with open(path, "rb") as file:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses empty files
+            return b""
+
+
+class LineIndex:
+    """Newline counts per fixed-size block of a file, filled in the background
+
+    counts[i] is the number of newlines before byte i * BLOCK, so finding
+    line N is a bisect plus a short scan inside one block, and the index
+    of a 10 GB file still fits in about a megabyte."""
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+        self.counts = array("Q", [0])
+        self.done = size == 0
+        self.failed = False
+        self.token = Token()
+
+    def start(self):
+        """Start indexing in the background"""
+        if not self.done:
+            Thread(target=self._build, daemon=True).start()
+        return self.token
+
+    @property
+    def indexed(self):
+        """Bytes covered so far"""
+        return min((len(self.counts) - 1) * BLOCK, self.size)
+
+    def _build(self):
+        try:
+            # A mapping of our own, the viewer may close its one at any time
+            view = map_file(self.path)
+            try:
+                if isinstance(view, mmap.mmap) and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    view.madvise(mmap.MADV_SEQUENTIAL)
+                total = 0
+                for block, start in enumerate(range(0, min(self.size, len(view)), BLOCK)):
+                    self.token.check()
+                    total += view[start:start + BLOCK].count(b"\n")
+                    self.counts.append(total)
+                    if block % NOTIFY_EVERY == 0:
+                        wakeup.notify()
+            finally:
+                if isinstance(view, mmap.mmap):
+                    view.close()
+        except Cancelled:
+            return
+        except OSError:
+            self.failed = True
+            return
+        self.done = True
+        wakeup.notify()
+
+
+class Viewer:
+    """A memory-mapped file, decoded a screenful at a time"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._view = map_file(path)
+        self.size = len(self._view)
+        self.hex = b"\0" in self._view[:SNIFF]
+        self.top = 0
+        self.rows = 1
+        self.index = LineIndex(path, self.size)
+
+    def handle_key(self, key: int):
+        """Apply a viewer key, return False for keys the viewer doesn't know"""
+        action = KEYS.get(key)
+        if action is None:
+            return False
+        action(self)
+        return True
+
+    def close(self):
+        """Stop indexing and unmap the file"""
+        self.index.token.cancel()
+        if isinstance(self._view, mmap.mmap):
+            self._view.close()
+
+    def _next(self, offset: int):
+        found = self._view.find(b"\n", offset)
+        return self.size if found < 0 else found + 1
+
+    def _prev(self, offset: int):
+        if offset <= 0:
+            return 0
+        return self._view.rfind(b"\n", 0, offset - 1) + 1
+
+    def _last_top(self):
+        if self.hex:
+            last = max(self.size - 1, 0) // HEX_WIDTH
+            return max(last - self.rows + 1, 0) * HEX_WIDTH
+        top = self.size
+        for _ in range(self.rows):
+            top = self._prev(top)
+        return top
+
+    def line_at(self, offset: int):
+        """Line number (from 0) starting at offset, None while not indexed"""
+        block = offset // BLOCK
+        if block >= len(self.index.counts):
+            return None
+        return self.index.counts[block] + self._view[block * BLOCK:offset].count(b"\n")
+
+    def line_start(self, line: int):
+        """Offset of a line (from 0), None while not indexed that far"""
+        counts = self.index.counts
+        if line <= 0:
+            return 0
+        if line > counts[-1]:
+            return self._last_top() if self.index.done else None
+        block = bisect_left(counts, line) - 1
+        offset = block * BLOCK
+        for _ in range(line - counts[block]):
+            offset = self._view.find(b"\n", offset) + 1
+        return offset
+
+    def lines(self):
+        """Number of lines, None while indexing"""
+        if not self.index.done:
+            return None
+        count = self.index.counts[-1]
+        return count + (1 if self.size and self._view[self.size - 1] != 10 else 0)
+
+    def scroll(self, delta: int):
+        """Move by delta lines, or rows in hex mode"""
+        if self.hex:
+            self.top = max(min(self.top + delta * HEX_WIDTH, self._last_top()), 0)
+            return
+        top = self.top
+        for _ in range(abs(delta)):
+            moved = self._next(top) if delta > 0 else self._prev(top)
+            if moved >= self.size or moved == top:
+                break
+            top = moved
+        self.top = min(top, self._last_top()) if delta > 0 else top
+
+    def home(self):
+        """Go to the start"""
+        self.top = 0
+
+    def end(self):
+        """Go to the end, no index needed"""
+        self.top = self._last_top()
+
+    def goto(self, line: int):
+        """Go to a line (from 1), return False while it isn't indexed yet"""
+        offset = self.line_start(line - 1)
+        if offset is None:
+            return False
+        self.hex = False
+        self.top = min(offset, self._last_top())
+        return True
+
+    def seek(self, offset: int):
+        """Go to the line holding a byte offset, no index needed"""
+        self.hex = False
+        self.top = min(self._prev(min(offset, self.size) + 1), self._last_top())
+
+    def toggle_hex(self):
+        """Switch between text and hex"""
+        if self.hex:
+            self.top = self._prev(self.top + 1)
+        else:
+            self.top -= self.top % HEX_WIDTH
+        self.hex = not self.hex
+
+    def text_rows(self, count: int, width: int):
+        """Decoded lines from top"""
+        rows: list[str] = []
+        offset = self.top
+        while len(rows) < count and offset < self.size:
+            end = self._next(offset)
+            raw = self._view[offset:min(end, offset + MAX_LINE)]
+            text = raw.decode("utf-8", "replace").rstrip("\r\n").expandtabs(4)
+            rows.append(text[:width].translate(CONTROL))
+            offset = end
+        return rows
+
+    def hex_rows(self, count: int):
+        """Offset, hex and ascii columns from top"""
+        rows: list[str] = []
+        for offset in range(self.top, min(self.top + count * HEX_WIDTH, self.size), HEX_WIDTH):
+            chunk = self._view[offset:offset + HEX_WIDTH]
+            hexed = " ".join(f"{byte:02x}" for byte in chunk)
+            text = "".join(chr(byte) if 32 <= byte < 127 else "." for byte in chunk)
+            rows.append(f"{offset:010x}  {hexed:<{HEX_WIDTH * 3}} {text}")
+        return rows
+
+    def position(self):
+        """Where we are, for the header"""
+        if self.hex:
+            return f"{self.top:#x}/{self.size:#x}"
+        line = self.line_at(self.top)
+        total = self.lines()
+        where = "?" if line is None else str(line + 1)
+        if total is None:
+            percent = self.index.indexed * 100 // max(self.size, 1)
+            state = "index failed" if self.index.failed else f"indexing {percent}%"
+            return f"line {where}, {state}"
+        return f"line {where}/{total}"
+
+
+KEYS = {
+    curses.KEY_UP: lambda v: v.scroll(-1),
+    ord("k"): lambda v: v.scroll(-1),
+    curses.KEY_DOWN: lambda v: v.scroll(1),
+    ord("j"): lambda v: v.scroll(1),
+    curses.KEY_PPAGE: lambda v: v.scroll(-v.rows),
+    curses.KEY_NPAGE: lambda v: v.scroll(v.rows),
+    ord(" "): lambda v: v.scroll(v.rows),
+    curses.KEY_HOME: Viewer.home,
+    ord("g"): Viewer.home,
+    curses.KEY_END: Viewer.end,
+    ord("G"): Viewer.end,
+    ord("x"): Viewer.toggle_hex,
+}
+CLOSE = frozenset((curses.KEY_LEFT, ord("q"), 27))
+
+
+def draw_viewer(screen: curses.window, viewer: Viewer):
+    """Draw the visible part of a file"""
+    screen.erase()
+    screen.box()
+    maxy, maxx = screen.getmaxyx()
+    viewer.rows = max(maxy - 2, 1)
+    width = max(maxx - 2, 0)
+    if viewer.hex:
+        rows = viewer.hex_rows(viewer.rows)
+    else:
+        rows = viewer.text_rows(viewer.rows, width)
+    header = f" {viewer.path} | {viewer.position()} | x: hex, q: close "
+    try:
+        screen.addnstr(0, 2, header, max(maxx - 4, 0))
+        for y, row in enumerate(rows):
+            screen.addnstr(y + 1, 1, row, width)
+    except curses.error:
+        pass
@@ -0,0 +1,166 @@
+"""Live directory watching"""
+
+from time import monotonic
+
+from props.inotify import (
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_ISDIR,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    Inotify,
+    available,
+)
+from props.ui.tabs import TabState, apply_selection
+from props.utils import T_DIR, T_UNKNOWN
+from props.workers import load_directory
+
+COALESCE = 0.25
+# How long a move's source waits for its destination, which can come in a later read
+COOKIE_AGE = 1.0
+
+
+class _Pending:
+    """Net changes of one directory since the last apply"""
+
+    __slots__ = ("present", "renames", "reload")
+
+    def __init__(self) -> None:
+        self.present: dict[str, int] = {}
+        self.renames: dict[str, str] = {}
+        self.reload = False
+
+
+class Watcher:
+    """Applies inotify events to watched tabs as incremental updates"""
+
+    def __init__(self) -> None:
+        self._inotify: Inotify | None = None
+        self._watches: dict[int, str] = {}
+        self._paths: dict[str, int] = {}
+        self._pending: dict[str, _Pending] = {}
+        self._cookies: dict[int, tuple[str, str, float]] = {}
+        self._last = 0.0
+
+    @property
+    def enabled(self):
+        """Whether watching works on this system"""
+        return available()
+
+    def _ensure(self):
+        if self._inotify is None:
+            self._inotify = Inotify()
+        return self._inotify
+
+    def sync(self, states: list[TabState]):
+        """Watch exactly the directories of tabs in live mode"""
+        wanted = {state.content.cwd for state in states if state.watch and state.loaded}
+        if not available() or not wanted and self._inotify is None:
+            return
+        inotify = self._ensure()
+        for path in list(self._paths):
+            if path not in wanted:
+                wd = self._paths.pop(path)
+                self._watches.pop(wd, None)
+                self._pending.pop(path, None)
+                inotify.rm_watch(wd)
+        for path in wanted - self._paths.keys():
+            try:
+                wd = inotify.add_watch(path)
+            except OSError:
+                continue
+            self._paths[path] = wd
+            self._watches[wd] = path
+
+    def _collect(self):
+        if self._inotify is None:
+            return
+        for event in self._inotify.read():
+            if event.mask & IN_Q_OVERFLOW:
+                for path in self._paths:
+                    self._pending.setdefault(path, _Pending()).reload = True
+                continue
+            path = self._watches.get(event.wd)
+            if path is None:
+                continue
+            pending = self._pending.setdefault(path, _Pending())
+            if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                pending.reload = True
+                continue
+            if not event.name:
+                continue
+            if event.mask & IN_MOVED_FROM:
+                self._cookies[event.cookie] = (path, event.name, monotonic())
+            elif event.mask & IN_MOVED_TO:
+                source = self._cookies.pop(event.cookie, None)
+                if source is not None and source[0] == path:
+                    pending.renames[source[1]] = event.name
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                pending.present[event.name] = T_DIR if event.mask & IN_ISDIR else T_UNKNOWN
+            elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+                pending.present[event.name] = -1
+
+    def poll(self, states: list[TabState]):
+        """Read pending events and apply them at most every COALESCE seconds
+
+        Returns whether any visible listing changed."""
+        self._collect()
+        now = monotonic()
+        if self._cookies:
+            self._cookies = {cookie: source for cookie, source in self._cookies.items()
+                             if now - source[2] < COOKIE_AGE}
+        if not self._pending or now - self._last < COALESCE:
+            return False
+        self._last = now
+        changed = False
+        for state in states:
+            if not state.watch or not state.loaded or state.content.loading:
+                continue
+            pending = self._pending.get(state.content.cwd)
+            if pending is not None:
+                changed = apply_pending(state, pending) or changed
+        for path in [p for p in self._pending if not self._loading(p, states)]:
+            del self._pending[path]
+        return changed
+
+    @staticmethod
+    def _loading(path: str, states: list[TabState]):
+        return any(state.content.loading and state.content.cwd == path for state in states)
+
+
+def apply_pending(state: TabState, pending: _Pending):
+    """Apply net changes to a tab, keeping the cursor on the same entry"""
+    content = state.content
+    if pending.reload:
+        try:
+            load_directory(content, content.cwd)
+        except OSError:
+            return False
+        return True
+    try:
+        current = content.name(state.menu.cursor)
+    except IndexError:
+        current = None
+    created = {name: code for name, code in pending.present.items() if code >= 0}
+    removed = {name for name, code in pending.present.items() if code < 0}
+    # Taken before the listing changes in place under the selection's bits
+    apply_selection(state)
+    selected = state.selection.names()
+    if not content.apply(created, removed):
+        return False
+    if selected:
+        state.selection.follow(content.cwd, content.listing, content.version,
+                               [pending.renames.get(name, name) for name in selected])
+    if current is not None:
+        current = pending.renames.get(current, current)
+        index = content.index(current)
+        if index < 0:
+            index = min(state.menu.cursor, len(content) - 1)
+        state.menu.seek(max(index, 0))
+    return True
+
+
+watcher = Watcher()
@@ -0,0 +1,149 @@
+"""Background workers"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from os import cpu_count, scandir, stat, stat_result
+from threading import Event, Lock
+from time import time_ns
+from typing import Callable, Iterator
+
+from props.cache import listing_cache
+from props.perf import syscalls, timed
+from props.utils import Directory, Listing
+
+BATCH = 2048
+
+
+class Cancelled(Exception):
+    """Raised inside a worker when its job is cancelled"""
+
+
+class Token:
+    """Cancellation token shared by a job and whoever started it"""
+
+    def __init__(self) -> None:
+        self._event = Event()
+
+    def cancel(self):
+        """Cancel the job"""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """Whether the job is cancelled"""
+        return self._event.is_set()
+
+    def check(self):
+        """Raise Cancelled if the job is cancelled"""
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class Wakeup:
+    """Flag raised by workers when the screen should be redrawn"""
+
+    def __init__(self) -> None:
+        self._dirty = False
+        self._lock = Lock()
+
+    def notify(self):
+        """Ask for a redraw"""
+        with self._lock:
+            self._dirty = True
+
+    def consume(self):
+        """Return whether a redraw was asked, and reset the flag"""
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = False
+        return dirty
+
+
+class WorkerPool:
+    """Lazily started thread pool"""
+
+    def __init__(self, workers: int | None = None) -> None:
+        self._workers = workers or min(8, (cpu_count() or 1) + 2)
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = Lock()
+
+    @property
+    def workers(self):
+        """Worker count"""
+        return self._workers
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run fn in the pool"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._workers, "elymicia")
+            return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        """Stop the pool, dropping queued work"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+pool = WorkerPool()
+wakeup = Wakeup()
+
+
+@timed("list.stream")
+def stream_listing(directory: Directory, generation: int, it: Iterator, token: Token,
+                   path: str = "", st: stat_result | None = None, stamp: int = 0):
+    """Read a scandir iterator, publishing sorted snapshots to directory
+
+    A snapshot goes out each time the listing has doubled, so sorting and
+    copying them adds up to O(n) over the whole load. Complete listings
+    are stored in the listing cache when st is given."""
+    listing = Listing()
+    shown = 0
+    try:
+        with it:
+            while True:
+                token.check()
+                count = len(listing)
+                listing.extend(islice(it, BATCH))
+                if len(listing) - count < BATCH:
+                    break
+                if len(listing) >= 2 * shown:
+                    listing.sort()
+                    if not directory.publish(generation, listing.copy(), False):
+                        return
+                    shown = len(listing)
+                    wakeup.notify()
+    except Cancelled:
+        return
+    except OSError:
+        st = None
+    listing.sort()
+    if st is not None:
+        listing_cache.put(path, st, listing, stamp)
+    directory.publish(generation, listing, True)
+    wakeup.notify()
+
+
+@timed("list")
+def load_directory(directory: Directory, path: str):
+    """Start loading path into directory in the background
+
+    Opening the directory happens right away so that permission errors
+    surface to the caller; reading it is left to the pool. Directories
+    found in the listing cache are published right away."""
+    syscalls()
+    st = stat(path)
+    listing = listing_cache.get(st)
+    if listing is not None:
+        generation = directory.begin(path, None)
+        directory.publish(generation, listing, True)
+        return None
+    syscalls()
+    stamp = time_ns()
+    it = scandir(path)
+    token = Token()
+    generation = directory.begin(path, token)
+    pool.submit(stream_listing, directory, generation, it, token, path, st, stamp)
+    return token